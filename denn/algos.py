@@ -2,46 +2,144 @@ import numpy as np
 import torch
 import torch.nn as nn
 import os
-
-from denn.utils import LambdaLR, plot_results, calc_gradient_penalty, handle_overwrite
-from denn.config.config import write_config
-
-try:
-    from ray.tune import track
-except:
-    print("Ray not loaded.")
+import sys
+import time
+from functools import partial
+from copy import deepcopy
+
+from denn.utils import LambdaLR, plot_results, calc_gradient_penalty, unique_dirname, \
+    MetricBuffer, RateLimiter
+from denn.runstore import RunStore
+from denn.render import render_async
+from denn.distributed import ShardedProblem, broadcast_params, all_reduce_grads, \
+    all_reduce_mean, broadcast_flag, is_main
 
 this_dir = os.path.dirname(os.path.abspath(__file__))
 
+def _tune_log(**metrics):
+    """ report metrics to ray tune when running under it
+        (ray is never imported here; it is only used if the caller loaded it) """
+    track = sys.modules.get('ray.tune.track')
+    if track is None:
+        return
+    try:
+        track.log(**metrics)
+    except Exception as e:
+        # print(f'Caught exception {e}')
+        pass
+
+_MSE_COLUMNS = {'train': 'history.train', 'val': 'history.val'}
+_GAN_LOSS_COLUMNS = {'G': 'history.G', 'D': 'history.D'}
+
+def _l2_loss_columns(method):
+    """ plot label -> history column of the L2 losses for `method` """
+    if method == 'supervised':
+        return {'$L_S$': 'history.loss'}
+    elif method == 'semisupervised':
+        return {'$L_S$': 'history.loss1', '$L_U$': 'history.loss2'}
+    return {'$L_U$': 'history.loss'}
+
+def _history_dict(history, columns):
+    return {k: history[c.split('.', 1)[1]] for k, c in columns.items()}
+
+def get_state(nets, optimizers, step):
+    """ copy of network / optimizer state to clone or resume a run """
+    return {'nets': [deepcopy(n.state_dict()) for n in nets],
+        'optimizers': [deepcopy(o.state_dict()) for o in optimizers],
+        'step': step}
+
+def load_state(state, nets, optimizers, schedulers, lrs, betas, gamma=1.):
+    """ restore `state` and apply the given (possibly mutated) lrs / betas in place
+
+        `lrs` are base learning rates: with lr schedules the lr at step `s` is
+        lr * gamma**s, so a run resumed from `state` continues its decay.
+        Returns the step to resume from.
+    """
+    for net, s in zip(nets, state['nets']):
+        net.load_state_dict(s)
+    for opt, s in zip(optimizers, state['optimizers']):
+        opt.load_state_dict(s)
+    step = state['step']
+    decay = gamma**step if schedulers else 1.
+    for opt, lr, b in zip(optimizers, lrs, betas):
+        for group in opt.param_groups:
+            group['lr'] = lr * decay
+            group['betas'] = tuple(b)
+    for sched, lr in zip(schedulers, lrs):
+        sched.base_lrs = [lr]
+        sched.last_epoch = step
+    return step
+
+def _data_parallel(problem, nets, method):
+    """ shard `problem` over the ranks of the process group and sync the
+        initial `nets`; returns the sharded problem and whether this is rank 0 """
+    assert method == 'unsupervised', 'Distributed training supports the unsupervised method only'
+    broadcast_params(*nets)
+    return ShardedProblem(problem), is_main()
+
+def _save_run(store, grid, pred_dict, diff_dict, preds=None, plot_spec=None, **timing):
+    """ write final grid / predictions (and optional animation traces) to the run store """
+    store.write('grid', {'grid': grid})
+    store.write('pred', pred_dict)
+    if diff_dict:
+        store.write('diff', diff_dict)
+    if preds is not None:
+        # TODO: for systems (i.e. multi-dim preds),
+        # hstack flattens preds, need to use dstack
+        store.write('animation', {k: np.hstack(v) for k, v in preds.items()})
+    if plot_spec is not None:
+        store.set_plot(**plot_spec)
+    store.set_timing(**timing)
+    store.close()
+    print(f'Saved run data to {store.dirname}')
+
 def train_GAN(G, D, problem, method='unsupervised', niters=100,
     g_lr=1e-3, g_betas=(0.0, 0.9), d_lr=1e-3, d_betas=(0.0, 0.9),
     lr_schedule=True, gamma=0.999, obs_every=1, d1=1., d2=1.,
     G_iters=1, D_iters=1, wgan=True, gp=0.1, conditional=True,
     log=True, plot=True, save=False, dirname='train_GAN',
-    config=None, save_for_animation=False, **kwargs):
+    config=None, save_for_animation=False, flush_every=100, log_every=1.0, callback=None,
+    state=None, return_state=False, distributed=False, **kwargs):
     """
     Train/test GAN method: supervised/semisupervised/unsupervised
+    `callback(step, val_mse)` is called every 10 steps; returning True stops training
+    `state` (from a previous run with `return_state=True`) resumes G/D and their
+    optimizers, with the lrs / betas given here applied in place
+    `distributed=True` trains data parallel over the initialized process group
+    (see denn/distributed.py): each rank uses its shard of the grid samples and
+    G/D gradients are averaged; rank 0 validates, logs and saves
     """
     assert method in ['supervised', 'semisupervised', 'unsupervised'], f'Method {method} not understood!'
 
+    main = True
+    if distributed:
+        problem, main = _data_parallel(problem, [G, D], method)
+        log, plot, save, save_for_animation = log and main, plot and main, \
+            save and main, save_for_animation and main
+
     dirname = os.path.join(this_dir, '../experiments/runs', dirname)
-    if plot and save:
-        handle_overwrite(dirname)
+    store = None
+    if save or save_for_animation:
+        dirname = unique_dirname(dirname)
+        store = RunStore(dirname, config)
 
     # validation: fixed grid/solution
     grid = problem.get_grid()
     soln = problem.get_solution(grid)
 
+    # number of points per grid sample (this rank's shard if distributed)
+    n_samp = problem.shard_size() if distributed else len(grid)
+
     # # observer mask and masked grid/solution (t_obs/y_obs)
-    observers = torch.arange(0, len(grid), obs_every)
+    observers = torch.arange(0, n_samp, obs_every)
     # grid_obs = grid[observers, :]
     # soln_obs = soln[observers, :]
 
     # labels
     real_label = 1
     fake_label = -1 if wgan else 0
-    real_labels = torch.full((len(grid),), real_label).reshape(-1,1)
-    fake_labels = torch.full((len(grid),), fake_label).reshape(-1,1)
+    real_labels = torch.full((n_samp,), float(real_label)).reshape(-1,1)
+    fake_labels = torch.full((n_samp,), float(fake_label)).reshape(-1,1)
     # masked label vectors
     real_labels_obs = real_labels[observers, :]
     fake_labels_obs = fake_labels[observers, :]
@@ -52,6 +150,11 @@ def train_GAN(G, D, problem, method='unsupervised', niters=100,
     if lr_schedule:
         lr_scheduler_G = torch.optim.lr_scheduler.ExponentialLR(optimizer=optiG, gamma=gamma)
         lr_scheduler_D = torch.optim.lr_scheduler.ExponentialLR(optimizer=optiD, gamma=gamma)
+    step0 = 0
+    if state is not None:
+        step0 = load_state(state, [G, D], [optiG, optiD],
+            [lr_scheduler_G, lr_scheduler_D] if lr_schedule else [],
+            [g_lr, d_lr], [g_betas, d_betas], gamma=gamma)
 
     # losses
     mse = nn.MSELoss()
@@ -59,11 +162,14 @@ def train_GAN(G, D, problem, method='unsupervised', niters=100,
     wass = lambda y_true, y_pred: torch.mean(y_true * y_pred)
     criterion = wass if wgan else bce
 
-    # history
-    losses = {'G': [], 'D': []}
-    mses = {'train': [], 'val': []}
+    # history (buffered on device, flushed to host every `flush_every` steps)
+    metrics = MetricBuffer(['G', 'D', 'train', 'val'], size=flush_every,
+        on_flush=None if store is None else partial(store.append, 'history'))
+    logger = RateLimiter(every=log_every, last_step=niters-1)
     preds = {'pred': [], 'soln': []}
 
+    stopped = False
+    t0, c0 = time.time(), time.process_time()
     for epoch in range(niters):
         # Train Generator
         for p in D.parameters():
@@ -88,6 +194,8 @@ def train_GAN(G, D, problem, method='unsupervised', niters=100,
                 g_loss = criterion(D(fake), real_labels)
                 # g_loss = criterion(D(fake), torch.ones_like(fake))
                 g_loss.backward(retain_graph=True)
+                if distributed:
+                    all_reduce_grads(G, n=n_samp)
                 optiG.step()
 
             elif method == 'semisupervised':
@@ -148,7 +256,8 @@ def train_GAN(G, D, problem, method='unsupervised', niters=100,
 
         for i in range(D_iters):
             if wgan:
-                norm_penalty = calc_gradient_penalty(D, real, fake, gp, cuda=False)
+                norm_penalty = calc_gradient_penalty(D, real, fake, gp, cuda=False,
+                    alpha=problem.gp_weights() if distributed else None)
             else:
                 norm_penalty = torch.zeros(1)
 
@@ -161,11 +270,10 @@ def train_GAN(G, D, problem, method='unsupervised', niters=100,
             optiD.zero_grad()
             d_loss = (real_loss + fake_loss)/2 + norm_penalty
             d_loss.backward(retain_graph=True)
+            if distributed:
+                all_reduce_grads(D, n=n_samp)
             optiD.step()
 
-        losses['D'].append(d_loss.item())
-        losses['G'].append(g_loss.item())
-
         if lr_schedule:
           lr_scheduler_G.step()
           lr_scheduler_D.step()
@@ -175,71 +283,94 @@ def train_GAN(G, D, problem, method='unsupervised', niters=100,
         pred = G(grid_samp)
         pred_adj = problem.adjust(pred, grid_samp)['pred']
         sol_samp = problem.get_solution(grid_samp)
-        train_mse = mse(pred_adj, sol_samp).item()
-        mses['train'].append(train_mse)
-
-        # val MSE: fixed grid vs true soln
-        val_pred = G(grid)
-        val_pred_adj = problem.adjust(val_pred, grid)['pred']
-        val_mse = mse(val_pred_adj, soln).item()
-        mses['val'].append(val_mse)
-
-        # save preds for animation
-        preds['pred'].append(val_pred_adj.detach())
-        preds['soln'].append(soln.detach())
-
-        try:
-            if (epoch+1) % 10 == 0:
-                # mean of val mses for last 10 steps
-                track.log(mean_squared_error=np.mean(mses['val'][-10:]))
-                # mean of G - D loss for last 10 steps
-                # loss_diff = np.mean(np.abs(losses['G'][-10] - losses['D'][-10]))
-                # track.log(mean_squared_error=loss_diff)
-        except Exception as e:
-            # print(f'Caught exception {e}')
-            pass
-
-        if log:
-            print(f'Step {epoch}: G Loss: {g_loss.item():.4e} | D Loss: {d_loss.item():.4e} | Train MSE {train_mse:.4e} | Val MSE {val_mse:.4e}')
-
-    if plot:
+        train_mse = mse(pred_adj, sol_samp)
+
+        # val MSE: fixed grid vs true soln (rank 0 only)
+        val_mse = torch.tensor(float('nan'))
+        if main:
+            val_pred = G(grid)
+            val_pred_adj = problem.adjust(val_pred, grid)['pred']
+            val_mse = mse(val_pred_adj, soln)
+
+            # save preds for animation
+            preds['pred'].append(val_pred_adj.detach())
+            preds['soln'].append(soln.detach())
+
+        if distributed: # losses / train mse averaged over the shards
+            g_loss, d_loss, train_mse = all_reduce_mean(g_loss, d_loss, train_mse, n=n_samp)
+        metrics.record(G=g_loss, D=d_loss, train=train_mse, val=val_mse)
+
+        if (epoch+1) % 10 == 0:
+            # mean of val mses for last 10 steps
+            score = np.mean(metrics.tail('val', 10))
+            stop = False
+            if main:
+                _tune_log(mean_squared_error=score)
+                stop = callback is not None and callback(epoch+1, score) and epoch+1 < niters
+            if distributed: # every rank stops at the same step
+                stop = broadcast_flag(stop)
+            if stop:
+                stopped = True # early stopping requested (e.g. by a scheduler)
+                break
+
+        if log and logger.ready(epoch):
+            m = metrics.latest()
+            print(f'Step {epoch}: G Loss: {m["G"]:.4e} | D Loss: {m["D"]:.4e} | Train MSE {m["train"]:.4e} | Val MSE {m["val"]:.4e}')
+
+    metrics.flush()
+    # cost of training (excludes plotting / saving): wall-clock, CPU-seconds, steps
+    timing = {'wall_seconds': time.time() - t0, 'cpu_seconds': time.process_time() - c0,
+        'steps': len(metrics)}
+    losses = {'G': metrics.history['G'], 'D': metrics.history['D']}
+    mses = {'train': metrics.history['train'], 'val': metrics.history['val']}
+
+    if store is not None or plot:
         pred_dict, diff_dict = problem.get_plot_dicts(G(grid), grid, soln)
+
+    if store is not None:
+        plot_spec = dict(mses=_MSE_COLUMNS, losses=_GAN_LOSS_COLUMNS, logloss=False, alpha=0.7)
+        _save_run(store, grid, pred_dict, diff_dict, preds if save_for_animation else None,
+            plot_spec=plot_spec, niters=niters, **timing)
+        if plot:
+            # render from the saved run data in a separate process
+            render_async(dirname)
+    elif plot:
         plot_results(mses, losses, grid.detach(), pred_dict, diff_dict=diff_dict,
-            save=save, dirname=dirname, logloss=False, alpha=0.7)
-
-    if save:
-        write_config(config, os.path.join(dirname, 'config.yaml'))
-
-    if save_for_animation:
-        if not os.path.exists(dirname):
-            os.mkdir(dirname)
-        anim_dir = os.path.join(dirname, "animation")
-        print(f'Saving animation traces to {anim_dir}')
-        if not os.path.exists(anim_dir):
-            os.mkdir(anim_dir)
-        np.save(os.path.join(anim_dir, "grid"), grid.detach())
-        for k, v in preds.items():
-            v = np.hstack(v)
-            # TODO: for systems (i.e. multi-dim preds),
-            # hstack flattens preds, need to use dstack
-            # v = np.dstack(v)
-            np.save(os.path.join(anim_dir, f"{k}_pred"), v)
-
-    return {'mses': mses, 'model': G, 'losses': losses}
+            save=False, logloss=False, alpha=0.7)
+
+    res = {'mses': mses, 'model': G, 'losses': losses,
+        'dirname': None if store is None else dirname, 'stopped': stopped,
+        'timing': timing}
+    if return_state:
+        res['state'] = get_state([G, D], [optiG, optiD], step0 + len(metrics))
+    return res
 
 def train_L2(model, problem, method='unsupervised', niters=100,
     lr=1e-3, betas=(0, 0.9), lr_schedule=True, gamma=0.999,
     obs_every=1, d1=1, d2=1, log=True, plot=True, save=False,
     dirname='train_L2', config=None, loss_fn=None, save_for_animation=False,
-    **kwargs):
+    flush_every=100, log_every=1.0, callback=None, distributed=False, **kwargs):
     """
     Train/test Lagaris method: supervised/semisupervised/unsupervised
+    `callback(step, val_mse)` is called every 10 steps; returning True stops training
+    `distributed=True` trains data parallel over the initialized process group
+    (see denn/distributed.py): each rank uses its shard of the grid samples and
+    gradients are averaged; rank 0 validates, logs and saves
     """
     assert method in ['supervised', 'semisupervised', 'unsupervised'], f'Method {method} not understood!'
 
+    main = True
+    if distributed:
+        problem, main = _data_parallel(problem, [model], method)
+        log, plot, save, save_for_animation = log and main, plot and main, \
+            save and main, save_for_animation and main
+        n_shard = problem.shard_size() # weight of this rank in the gradient average
+
     dirname = os.path.join(this_dir, '../experiments/runs', dirname)
-    if plot and save:
-        handle_overwrite(dirname)
+    store = None
+    if save or save_for_animation:
+        dirname = unique_dirname(dirname)
+        store = RunStore(dirname, config)
 
     # validation: fixed grid/solution
     grid = problem.get_grid()
@@ -259,17 +390,23 @@ def train_L2(model, problem, method='unsupervised', niters=100,
     if lr_schedule:
         lr_scheduler = torch.optim.lr_scheduler.ExponentialLR(optimizer=opt, gamma=gamma)
 
-    loss_trace = []
-    mses = {'train': [], 'val': []}
+    # history (buffered on device, flushed to host every `flush_every` steps)
+    keys = ['loss', 'train', 'val']
+    if method == 'semisupervised':
+        keys += ['loss1', 'loss2']
+    metrics = MetricBuffer(keys, size=flush_every,
+        on_flush=None if store is None else partial(store.append, 'history'))
+    logger = RateLimiter(every=log_every, last_step=niters-1)
     preds = {'pred': [], 'soln': []}
 
+    stopped = False
+    t0, c0 = time.time(), time.process_time()
     for i in range(niters):
         if method == 'unsupervised':
             grid_samp = problem.get_grid_sample()
             pred = model(grid_samp)
             residuals = problem.get_equation(pred, grid_samp)
             loss = mse(residuals, torch.zeros_like(residuals))
-            loss_trace.append(loss.item())
 
         elif method == 'semisupervised':
             # supervised part
@@ -285,13 +422,11 @@ def train_L2(model, problem, method='unsupervised', niters=100,
 
             # combine together
             loss = d1 * loss1 + d2 * loss2
-            loss_trace.append((loss1.item(), loss2.item()))
 
         else: # supervised
             pred = model(grid_obs)
             pred_adj = problem.adjust(pred, grid_obs)[0]
             loss = mse(pred_adj, sol_obs)
-            loss_trace.append(loss.item())
 
         # train MSE: grid sample vs true soln
         # grid_samp, sort_ids = torch.sort(grid_samp, axis=0)
@@ -299,104 +434,132 @@ def train_L2(model, problem, method='unsupervised', niters=100,
         try:
             pred_adj = problem.adjust(pred, grid_samp)['pred']
             sol_samp = problem.get_solution(grid_samp)
-            train_mse = mse(pred_adj, sol_samp).item()
+            train_mse = mse(pred_adj, sol_samp)
         except Exception as e:
             print(f'Exception: {e}')
-        mses['train'].append(train_mse)
 
-        # val MSE: fixed grid vs true soln
-        val_pred = model(grid)
-        val_pred_adj = problem.adjust(val_pred, grid)['pred']
-        val_mse = mse(val_pred_adj, sol).item()
-        mses['val'].append(val_mse)
-
-        # store preds for animation
-        preds['pred'].append(val_pred_adj.detach())
-        preds['soln'].append(sol.detach())
-
-        try:
-            if (i+1) % 10 == 0:
-                # mean of val mses for last 10 steps
-                track.log(mean_squared_error=np.mean(mses['val'][-10:]))
-        except Exception as e:
-            # print(f'Caught exception {e}')
-            pass
-
-        if log:
-            print(f'Step {i}: Loss {loss.item():.4e} | Train MSE {train_mse:.4e} | Val MSE {val_mse:.4e}')
+        # val MSE: fixed grid vs true soln (rank 0 only)
+        val_mse = torch.tensor(float('nan'))
+        if main:
+            val_pred = model(grid)
+            val_pred_adj = problem.adjust(val_pred, grid)['pred']
+            val_mse = mse(val_pred_adj, sol)
+
+            # store preds for animation
+            preds['pred'].append(val_pred_adj.detach())
+            preds['soln'].append(sol.detach())
+
+        if method == 'semisupervised':
+            metrics.record(loss=loss, train=train_mse, val=val_mse, loss1=loss1, loss2=loss2)
+        elif distributed: # loss / train mse averaged over the shards
+            loss_mean, train_mse = all_reduce_mean(loss, train_mse, n=n_shard)
+            metrics.record(loss=loss_mean, train=train_mse, val=val_mse)
+        else:
+            metrics.record(loss=loss, train=train_mse, val=val_mse)
+
+        if (i+1) % 10 == 0:
+            # mean of val mses for last 10 steps
+            score = np.mean(metrics.tail('val', 10))
+            stop = False
+            if main:
+                _tune_log(mean_squared_error=score)
+                stop = callback is not None and callback(i+1, score) and i+1 < niters
+            if distributed: # every rank stops at the same step
+                stop = broadcast_flag(stop)
+            if stop:
+                stopped = True # early stopping requested (e.g. by a scheduler)
+                break
+
+        if log and logger.ready(i):
+            m = metrics.latest()
+            print(f'Step {i}: Loss {m["loss"]:.4e} | Train MSE {m["train"]:.4e} | Val MSE {m["val"]:.4e}')
 
         opt.zero_grad()
         loss.backward(retain_graph=True)
+        if distributed:
+            all_reduce_grads(model, n=n_shard)
         opt.step()
         if lr_schedule:
             lr_scheduler.step()
 
-    if plot:
-        loss_dict = {}
-        if method == 'supervised':
-            loss_dict['$L_S$'] = loss_trace
-        elif method == 'semisupervised':
-            loss_dict['$L_S$'] = [l[0] for l in loss_trace]
-            loss_dict['$L_U$'] = [l[1] for l in loss_trace]
-        else:
-            loss_dict['$L_U$'] = loss_trace
-
-        save_to = os.path.join(this_dir, '../experiments/runs', dirname)
+    metrics.flush()
+    # cost of training (excludes plotting / saving): wall-clock, CPU-seconds, steps
+    timing = {'wall_seconds': time.time() - t0, 'cpu_seconds': time.process_time() - c0,
+        'steps': len(metrics)}
+    mses = {'train': metrics.history['train'], 'val': metrics.history['val']}
+    if method == 'semisupervised':
+        loss_trace = list(zip(metrics.history['loss1'], metrics.history['loss2']))
+    else:
+        loss_trace = metrics.history['loss']
 
+    if store is not None or plot:
         pred_dict, diff_dict = problem.get_plot_dicts(model(grid), grid, sol)
+
+    loss_columns = _l2_loss_columns(method)
+    if store is not None:
+        plot_spec = dict(mses=_MSE_COLUMNS, losses=loss_columns, logloss=True, alpha=0.7)
+        _save_run(store, grid, pred_dict, diff_dict, preds if save_for_animation else None,
+            plot_spec=plot_spec, niters=niters, **timing)
+        if plot:
+            # render from the saved run data in a separate process
+            render_async(dirname)
+    elif plot:
+        loss_dict = _history_dict(metrics.history, loss_columns)
         plot_results(mses, loss_dict, grid.detach(), pred_dict, diff_dict=diff_dict,
-            save=save, dirname=dirname, logloss=True, alpha=0.7)
-
-    if save:
-        write_config(config, os.path.join(dirname, 'config.yaml'))
-
-    if save_for_animation:
-        if not os.path.exists(dirname):
-            os.mkdir(dirname)
-        anim_dir = os.path.join(dirname, "animation")
-        print(f'Saving animation traces to {anim_dir}')
-        if not os.path.exists(anim_dir):
-            os.mkdir(anim_dir)
-        np.save(os.path.join(anim_dir, "grid"), grid.detach())
-        for k, v in preds.items():
-            v = np.hstack(v)
-            # TODO: for systems (i.e. multi-dim preds),
-            # hstack flattens preds, need to use dstack
-            # v = np.dstack(v)
-            np.save(os.path.join(anim_dir, f"{k}_pred"), v)
-
-    return {'mses': mses, 'model': model, 'losses': loss_trace}
+            save=False, logloss=True, alpha=0.7)
+
+    return {'mses': mses, 'model': model, 'losses': loss_trace,
+        'dirname': None if store is None else dirname, 'stopped': stopped,
+        'timing': timing}
 
 def train_GAN_2D(G, D, problem, method='unsupervised', niters=100,
     g_lr=1e-3, g_betas=(0.0, 0.9), d_lr=1e-3, d_betas=(0.0, 0.9),
     lr_schedule=True, gamma=0.999, obs_every=1, d1=1., d2=1.,
     G_iters=1, D_iters=1, wgan=True, gp=0.1, conditional=True,
     log=True, plot=True, save=False, dirname='train_GAN',
-    config=None, save_for_animation=False, **kwargs):
+    config=None, save_for_animation=False, flush_every=100, log_every=1.0, callback=None,
+    state=None, return_state=False, distributed=False, **kwargs):
     """
     Train/test GAN method: supervised/semisupervised/unsupervised
+    `callback(step, val_mse)` is called every 10 steps; returning True stops training
+    `state` (from a previous run with `return_state=True`) resumes G/D and their
+    optimizers, with the lrs / betas given here applied in place
+    `distributed=True` trains data parallel over the initialized process group
+    (see denn/distributed.py): each rank uses its shard of the grid samples and
+    G/D gradients are averaged; rank 0 validates, logs and saves
     """
     assert method in ['supervised', 'semisupervised', 'unsupervised'], f'Method {method} not understood!'
 
+    main = True
+    if distributed:
+        problem, main = _data_parallel(problem, [G, D], method)
+        log, plot, save, save_for_animation = log and main, plot and main, \
+            save and main, save_for_animation and main
+
     dirname = os.path.join(this_dir, '../experiments/runs', dirname)
-    if plot and save:
-        handle_overwrite(dirname)
+    store = None
+    if save or save_for_animation:
+        dirname = unique_dirname(dirname)
+        store = RunStore(dirname, config)
 
     # validation: fixed grid/solution
     x, y = problem.get_grid()
     grid = torch.cat((x, y), 1)
     soln = problem.get_solution(x, y)
 
+    # number of points per grid sample (this rank's shard if distributed)
+    n_samp = problem.shard_size() if distributed else len(grid)
+
     # # observer mask and masked grid/solution (t_obs/y_obs)
-    observers = torch.arange(0, len(grid), obs_every)
+    observers = torch.arange(0, n_samp, obs_every)
     # grid_obs = grid[observers, :]
     # soln_obs = soln[observers, :]
 
     # labels
     real_label = 1
     fake_label = -1 if wgan else 0
-    real_labels = torch.full((len(grid),), real_label).reshape(-1,1)
-    fake_labels = torch.full((len(grid),), fake_label).reshape(-1,1)
+    real_labels = torch.full((n_samp,), float(real_label)).reshape(-1,1)
+    fake_labels = torch.full((n_samp,), float(fake_label)).reshape(-1,1)
     # masked label vectors
     real_labels_obs = real_labels[observers, :]
     fake_labels_obs = fake_labels[observers, :]
@@ -407,6 +570,11 @@ def train_GAN_2D(G, D, problem, method='unsupervised', niters=100,
     if lr_schedule:
         lr_scheduler_G = torch.optim.lr_scheduler.ExponentialLR(optimizer=optiG, gamma=gamma)
         lr_scheduler_D = torch.optim.lr_scheduler.ExponentialLR(optimizer=optiD, gamma=gamma)
+    step0 = 0
+    if state is not None:
+        step0 = load_state(state, [G, D], [optiG, optiD],
+            [lr_scheduler_G, lr_scheduler_D] if lr_schedule else [],
+            [g_lr, d_lr], [g_betas, d_betas], gamma=gamma)
 
     # losses
     mse = nn.MSELoss()
@@ -414,11 +582,14 @@ def train_GAN_2D(G, D, problem, method='unsupervised', niters=100,
     wass = lambda y_true, y_pred: torch.mean(y_true * y_pred)
     criterion = wass if wgan else bce
 
-    # history
-    losses = {'G': [], 'D': []}
-    mses = {'train': [], 'val': []}
+    # history (buffered on device, flushed to host every `flush_every` steps)
+    metrics = MetricBuffer(['G', 'D', 'train', 'val'], size=flush_every,
+        on_flush=None if store is None else partial(store.append, 'history'))
+    logger = RateLimiter(every=log_every, last_step=niters-1)
     preds = {'pred': [], 'soln': []}
 
+    stopped = False
+    t0, c0 = time.time(), time.process_time()
     for epoch in range(niters):
         # Train Generator
         for p in D.parameters():
@@ -439,6 +610,8 @@ def train_GAN_2D(G, D, problem, method='unsupervised', niters=100,
             g_loss = criterion(D(fake), real_labels)
             # g_loss = criterion(D(fake), torch.ones_like(fake))
             g_loss.backward(retain_graph=True)
+            if distributed:
+                all_reduce_grads(G, n=n_samp)
             optiG.step()
 
         # Train Discriminator
@@ -447,7 +620,8 @@ def train_GAN_2D(G, D, problem, method='unsupervised', niters=100,
 
         for i in range(D_iters):
             if wgan:
-                norm_penalty = calc_gradient_penalty(D, real, fake, gp, cuda=False)
+                norm_penalty = calc_gradient_penalty(D, real, fake, gp, cuda=False,
+                    alpha=problem.gp_weights() if distributed else None)
             else:
                 norm_penalty = torch.zeros(1)
 
@@ -460,11 +634,10 @@ def train_GAN_2D(G, D, problem, method='unsupervised', niters=100,
             optiD.zero_grad()
             d_loss = (real_loss + fake_loss)/2 + norm_penalty
             d_loss.backward(retain_graph=True)
+            if distributed:
+                all_reduce_grads(D, n=n_samp)
             optiD.step()
 
-        losses['D'].append(d_loss.item())
-        losses['G'].append(g_loss.item())
-
         if lr_schedule:
           lr_scheduler_G.step()
           lr_scheduler_D.step()
@@ -474,71 +647,94 @@ def train_GAN_2D(G, D, problem, method='unsupervised', niters=100,
         pred = G(grid_samp)
         pred_adj = problem.adjust(pred, xs, ys)['pred']
         sol_samp = problem.get_solution(xs, ys)
-        train_mse = mse(pred_adj, sol_samp).item()
-        mses['train'].append(train_mse)
-
-        # val MSE: fixed grid vs true soln
-        val_pred = G(grid)
-        val_pred_adj = problem.adjust(val_pred, x, y)['pred']
-        val_mse = mse(val_pred_adj, soln).item()
-        mses['val'].append(val_mse)
-
-        # save preds for animation
-        preds['pred'].append(val_pred_adj.detach())
-        preds['soln'].append(soln.detach())
-
-        try:
-            if (epoch+1) % 10 == 0:
-                # mean of val mses for last 10 steps
-                track.log(mean_squared_error=np.mean(mses['val'][-10:]))
-                # mean of G - D loss for last 10 steps
-                # loss_diff = np.mean(np.abs(losses['G'][-10] - losses['D'][-10]))
-                # track.log(mean_squared_error=loss_diff)
-        except Exception as e:
-            # print(f'Caught exception {e}')
-            pass
-
-        if log:
-            print(f'Step {epoch}: G Loss: {g_loss.item():.4e} | D Loss: {d_loss.item():.4e} | Train MSE {train_mse:.4e} | Val MSE {val_mse:.4e}')
-
-    if plot:
+        train_mse = mse(pred_adj, sol_samp)
+
+        # val MSE: fixed grid vs true soln (rank 0 only)
+        val_mse = torch.tensor(float('nan'))
+        if main:
+            val_pred = G(grid)
+            val_pred_adj = problem.adjust(val_pred, x, y)['pred']
+            val_mse = mse(val_pred_adj, soln)
+
+            # save preds for animation
+            preds['pred'].append(val_pred_adj.detach())
+            preds['soln'].append(soln.detach())
+
+        if distributed: # losses / train mse averaged over the shards
+            g_loss, d_loss, train_mse = all_reduce_mean(g_loss, d_loss, train_mse, n=n_samp)
+        metrics.record(G=g_loss, D=d_loss, train=train_mse, val=val_mse)
+
+        if (epoch+1) % 10 == 0:
+            # mean of val mses for last 10 steps
+            score = np.mean(metrics.tail('val', 10))
+            stop = False
+            if main:
+                _tune_log(mean_squared_error=score)
+                stop = callback is not None and callback(epoch+1, score) and epoch+1 < niters
+            if distributed: # every rank stops at the same step
+                stop = broadcast_flag(stop)
+            if stop:
+                stopped = True # early stopping requested (e.g. by a scheduler)
+                break
+
+        if log and logger.ready(epoch):
+            m = metrics.latest()
+            print(f'Step {epoch}: G Loss: {m["G"]:.4e} | D Loss: {m["D"]:.4e} | Train MSE {m["train"]:.4e} | Val MSE {m["val"]:.4e}')
+
+    metrics.flush()
+    # cost of training (excludes plotting / saving): wall-clock, CPU-seconds, steps
+    timing = {'wall_seconds': time.time() - t0, 'cpu_seconds': time.process_time() - c0,
+        'steps': len(metrics)}
+    losses = {'G': metrics.history['G'], 'D': metrics.history['D']}
+    mses = {'train': metrics.history['train'], 'val': metrics.history['val']}
+
+    if store is not None or plot:
         pred_dict, diff_dict = problem.get_plot_dicts(G(grid), x, y, soln)
+
+    if store is not None:
+        plot_spec = dict(mses=_MSE_COLUMNS, losses=_GAN_LOSS_COLUMNS, logloss=False, alpha=0.7)
+        _save_run(store, grid, pred_dict, diff_dict, preds if save_for_animation else None,
+            plot_spec=plot_spec, niters=niters, **timing)
+        if plot:
+            # render from the saved run data in a separate process
+            render_async(dirname)
+    elif plot:
         plot_results(mses, losses, grid.detach(), pred_dict, diff_dict=diff_dict,
-            save=save, dirname=dirname, logloss=False, alpha=0.7)
-
-    if save:
-        write_config(config, os.path.join(dirname, 'config.yaml'))
-
-    if save_for_animation:
-        if not os.path.exists(dirname):
-            os.mkdir(dirname)
-        anim_dir = os.path.join(dirname, "animation")
-        print(f'Saving animation traces to {anim_dir}')
-        if not os.path.exists(anim_dir):
-            os.mkdir(anim_dir)
-        np.save(os.path.join(anim_dir, "grid"), grid.detach())
-        for k, v in preds.items():
-            v = np.hstack(v)
-            # TODO: for systems (i.e. multi-dim preds),
-            # hstack flattens preds, need to use dstack
-            # v = np.dstack(v)
-            np.save(os.path.join(anim_dir, f"{k}_pred"), v)
-
-    return {'mses': mses, 'model': G, 'losses': losses}
+            save=False, logloss=False, alpha=0.7)
+
+    res = {'mses': mses, 'model': G, 'losses': losses,
+        'dirname': None if store is None else dirname, 'stopped': stopped,
+        'timing': timing}
+    if return_state:
+        res['state'] = get_state([G, D], [optiG, optiD], step0 + len(metrics))
+    return res
 
 def train_L2_2D(model, problem, method='unsupervised', niters=100,
     lr=1e-3, betas=(0, 0.9), lr_schedule=True, gamma=0.999,
     obs_every=1, d1=1, d2=1, log=True, plot=True, save=False,
     dirname='train_L2', config=None, loss_fn=None, save_for_animation=False,
-    **kwargs):
+    flush_every=100, log_every=1.0, callback=None, distributed=False, **kwargs):
     """
     Train/test Lagaris method: supervised/semisupervised/unsupervised
+    `callback(step, val_mse)` is called every 10 steps; returning True stops training
+    `distributed=True` trains data parallel over the initialized process group
+    (see denn/distributed.py): each rank uses its shard of the grid samples and
+    gradients are averaged; rank 0 validates, logs and saves
     """
     assert method in ['supervised', 'semisupervised', 'unsupervised'], f'Method {method} not understood!'
 
+    main = True
+    if distributed:
+        problem, main = _data_parallel(problem, [model], method)
+        log, plot, save, save_for_animation = log and main, plot and main, \
+            save and main, save_for_animation and main
+        n_shard = problem.shard_size() # weight of this rank in the gradient average
+
     dirname = os.path.join(this_dir, '../experiments/runs', dirname)
-    if plot and save:
-        handle_overwrite(dirname)
+    store = None
+    if save or save_for_animation:
+        dirname = unique_dirname(dirname)
+        store = RunStore(dirname, config)
 
     # validation: fixed grid/solution
     x, y = problem.get_grid()
@@ -555,17 +751,23 @@ def train_L2_2D(model, problem, method='unsupervised', niters=100,
     if lr_schedule:
         lr_scheduler = torch.optim.lr_scheduler.ExponentialLR(optimizer=opt, gamma=gamma)
 
-    loss_trace = []
-    mses = {'train': [], 'val': []}
+    # history (buffered on device, flushed to host every `flush_every` steps)
+    keys = ['loss', 'train', 'val']
+    if method == 'semisupervised':
+        keys += ['loss1', 'loss2']
+    metrics = MetricBuffer(keys, size=flush_every,
+        on_flush=None if store is None else partial(store.append, 'history'))
+    logger = RateLimiter(every=log_every, last_step=niters-1)
     preds = {'pred': [], 'soln': []}
 
+    stopped = False
+    t0, c0 = time.time(), time.process_time()
     for i in range(niters):
         xs, ys = problem.get_grid_sample()
         grid_samp = torch.cat((xs, ys), 1)
         pred = model(grid_samp)
         residuals = problem.get_equation(pred, xs, ys)
         loss = mse(residuals, torch.zeros_like(residuals))
-        loss_trace.append(loss.item())
 
         # train MSE: grid sample vs true soln
         # grid_samp, sort_ids = torch.sort(grid_samp, axis=0)
@@ -573,70 +775,78 @@ def train_L2_2D(model, problem, method='unsupervised', niters=100,
         try:
             pred_adj = problem.adjust(pred, xs, ys)['pred']
             sol_samp = problem.get_solution(xs, ys)
-            train_mse = mse(pred_adj, sol_samp).item()
+            train_mse = mse(pred_adj, sol_samp)
         except Exception as e:
             print(f'Exception: {e}')
-        mses['train'].append(train_mse)
 
-        # val MSE: fixed grid vs true soln
-        val_pred = model(grid)
-        val_pred_adj = problem.adjust(val_pred, x, y)['pred']
-        val_mse = mse(val_pred_adj, sol).item()
-        mses['val'].append(val_mse)
+        # val MSE: fixed grid vs true soln (rank 0 only)
+        val_mse = torch.tensor(float('nan'))
+        if main:
+            val_pred = model(grid)
+            val_pred_adj = problem.adjust(val_pred, x, y)['pred']
+            val_mse = mse(val_pred_adj, sol)
 
-        # store preds for animation
-        preds['pred'].append(val_pred_adj.detach())
-        preds['soln'].append(sol.detach())
+            # store preds for animation
+            preds['pred'].append(val_pred_adj.detach())
+            preds['soln'].append(sol.detach())
 
-        try:
-            if (i+1) % 10 == 0:
-                # mean of val mses for last 10 steps
-                track.log(mean_squared_error=np.mean(mses['val'][-10:]))
-        except Exception as e:
-            # print(f'Caught exception {e}')
-            pass
-
-        if log:
-            print(f'Step {i}: Loss {loss.item():.4e} | Train MSE {train_mse:.4e} | Val MSE {val_mse:.4e}')
+        if distributed: # loss / train mse averaged over the shards
+            loss_mean, train_mse = all_reduce_mean(loss, train_mse, n=n_shard)
+            metrics.record(loss=loss_mean, train=train_mse, val=val_mse)
+        else:
+            metrics.record(loss=loss, train=train_mse, val=val_mse)
+
+        if (i+1) % 10 == 0:
+            # mean of val mses for last 10 steps
+            score = np.mean(metrics.tail('val', 10))
+            stop = False
+            if main:
+                _tune_log(mean_squared_error=score)
+                stop = callback is not None and callback(i+1, score) and i+1 < niters
+            if distributed: # every rank stops at the same step
+                stop = broadcast_flag(stop)
+            if stop:
+                stopped = True # early stopping requested (e.g. by a scheduler)
+                break
+
+        if log and logger.ready(i):
+            m = metrics.latest()
+            print(f'Step {i}: Loss {m["loss"]:.4e} | Train MSE {m["train"]:.4e} | Val MSE {m["val"]:.4e}')
 
         opt.zero_grad()
         loss.backward(retain_graph=True)
+        if distributed:
+            all_reduce_grads(model, n=n_shard)
         opt.step()
         if lr_schedule:
             lr_scheduler.step()
 
-    if plot:
-        loss_dict = {}
-        if method == 'supervised':
-            loss_dict['$L_S$'] = loss_trace
-        elif method == 'semisupervised':
-            loss_dict['$L_S$'] = [l[0] for l in loss_trace]
-            loss_dict['$L_U$'] = [l[1] for l in loss_trace]
-        else:
-            loss_dict['$L_U$'] = loss_trace
-
-        save_to = os.path.join(this_dir, '../experiments/runs', dirname)
+    metrics.flush()
+    # cost of training (excludes plotting / saving): wall-clock, CPU-seconds, steps
+    timing = {'wall_seconds': time.time() - t0, 'cpu_seconds': time.process_time() - c0,
+        'steps': len(metrics)}
+    mses = {'train': metrics.history['train'], 'val': metrics.history['val']}
+    if method == 'semisupervised':
+        loss_trace = list(zip(metrics.history['loss1'], metrics.history['loss2']))
+    else:
+        loss_trace = metrics.history['loss']
 
+    if store is not None or plot:
         pred_dict, diff_dict = problem.get_plot_dicts(model(grid), x, y, sol)
+
+    loss_columns = _l2_loss_columns(method)
+    if store is not None:
+        plot_spec = dict(mses=_MSE_COLUMNS, losses=loss_columns, logloss=True, alpha=0.7)
+        _save_run(store, grid, pred_dict, diff_dict, preds if save_for_animation else None,
+            plot_spec=plot_spec, niters=niters, **timing)
+        if plot:
+            # render from the saved run data in a separate process
+            render_async(dirname)
+    elif plot:
+        loss_dict = _history_dict(metrics.history, loss_columns)
         plot_results(mses, loss_dict, grid.detach(), pred_dict, diff_dict=diff_dict,
-            save=save, dirname=dirname, logloss=True, alpha=0.7)
-
-    if save:
-        write_config(config, os.path.join(dirname, 'config.yaml'))
-
-    if save_for_animation:
-        if not os.path.exists(dirname):
-            os.mkdir(dirname)
-        anim_dir = os.path.join(dirname, "animation")
-        print(f'Saving animation traces to {anim_dir}')
-        if not os.path.exists(anim_dir):
-            os.mkdir(anim_dir)
-        np.save(os.path.join(anim_dir, "grid"), grid.detach())
-        for k, v in preds.items():
-            v = np.hstack(v)
-            # TODO: for systems (i.e. multi-dim preds),
-            # hstack flattens preds, need to use dstack
-            # v = np.dstack(v)
-            np.save(os.path.join(anim_dir, f"{k}_pred"), v)
-
-    return {'mses': mses, 'model': model, 'losses': loss_trace}
+            save=False, logloss=True, alpha=0.7)
+
+    return {'mses': mses, 'model': model, 'losses': loss_trace,
+        'dirname': None if store is None else dirname, 'stopped': stopped,
+        'timing': timing}
@@ -0,0 +1,189 @@
+import json
+import math
+import time
+import argparse
+import threading
+import multiprocessing as mp
+from multiprocessing.managers import BaseManager
+from copy import deepcopy
+import numpy as np
+
+from denn.config.config import get_config
+from denn.sweep import _init_worker as _init_sweep_worker, _WORKER, shared_problem
+
+class ASHA():
+    """ asynchronous successive halving (single bracket), minimizing a score
+
+        Progress `t` is counted in reports (trainers report every 10 steps).
+        Rungs sit at grace_period * reduction_factor**k below max_t; a trial
+        reaching a rung continues only if its score is in the best
+        1/reduction_factor of the scores recorded at that rung so far,
+        and every trial stops at max_t.
+    """
+    def __init__(self, max_t, grace_period=1, reduction_factor=4):
+        assert max_t > 0 and grace_period > 0 and reduction_factor > 1
+        self.max_t = max_t
+        self.grace_period = grace_period
+        self.reduction_factor = reduction_factor
+        n_rungs = int(math.log(max_t / grace_period) / math.log(reduction_factor) + 1)
+        self.rungs = [grace_period * reduction_factor**k for k in reversed(range(n_rungs))]
+        self.recorded = {r: {} for r in self.rungs}
+        self.last = {}
+        self._lock = threading.Lock()
+
+    def cutoff(self, recorded):
+        if not recorded:
+            return None
+        return np.nanpercentile(list(recorded.values()), 100 / self.reduction_factor)
+
+    def report(self, trial_id, t, score):
+        """ record `score` of `trial_id` at progress `t`; True if the trial should continue """
+        with self._lock:
+            self.last[trial_id] = (t, float(score))
+            if t >= self.max_t:
+                return False
+            for rung in self.rungs: # highest rung first
+                if t < rung or trial_id in self.recorded[rung]:
+                    continue
+                cutoff = self.cutoff(self.recorded[rung])
+                self.recorded[rung][trial_id] = float(score)
+                return cutoff is None or not score > cutoff
+            return True
+
+    def results(self):
+        """ {trial_id: (last t, last score)} """
+        with self._lock:
+            return dict(self.last)
+
+class ASHAManager(BaseManager):
+    """ serves one `ASHA` instance to all pool workers """
+
+ASHAManager.register('ASHA', ASHA)
+
+# search bounds of the ray tune script
+LR_BOUND = (1e-6, 1e-2)
+GAMMA_BOUND = (0.99, 0.9999)
+BETA_BOUND = (0, 0.999)
+N_NODES = [20, 30, 40]
+N_LAYERS = [2, 3, 4]
+
+def sample_config(params, rng, gan=True):
+    """ random config from the search space of ray_tune.py """
+    config = deepcopy(params)
+    training = config['training']
+    if gan:
+        training['g_lr'] = float(rng.uniform(*LR_BOUND))
+        training['d_lr'] = float(rng.uniform(*LR_BOUND))
+        training['g_betas'] = rng.uniform(*BETA_BOUND, size=2).tolist()
+        training['d_betas'] = rng.uniform(*BETA_BOUND, size=2).tolist()
+        config['discriminator']['n_hidden_units'] = int(rng.choice(N_NODES))
+        config['discriminator']['n_hidden_layers'] = int(rng.choice(N_LAYERS))
+    else:
+        # train_L2 takes `lr` / `betas`
+        training['lr'] = float(rng.uniform(*LR_BOUND))
+        training['betas'] = rng.uniform(*BETA_BOUND, size=2).tolist()
+    training['gamma'] = float(rng.uniform(*GAMMA_BOUND))
+    config['generator']['n_hidden_units'] = int(rng.choice(N_NODES))
+    config['generator']['n_hidden_layers'] = int(rng.choice(N_LAYERS))
+    return config
+
+def _init_worker(threads, pkey, gan, force, scheduler, problem):
+    _init_sweep_worker(threads, pkey, None, gan, force, problem)
+    _WORKER['scheduler'] = scheduler
+
+def _run_trial(trial):
+    """ train one trial, reporting to the shared scheduler (never raises) """
+    from denn.experiments import run_experiment
+
+    scheduler = _WORKER['scheduler']
+    trial_id = trial['trial_id']
+    callback = lambda step, score: not scheduler.report(trial_id, step // 10, score)
+    rec = dict(trial)
+    t0 = time.time()
+    try:
+        res = run_experiment(_WORKER['pkey'], trial['config'], gan=_WORKER['gan'],
+            force=_WORKER['force'], callback=callback, problem=_WORKER['problem'])
+    except Exception as e:
+        rec.update(status='failed', error=repr(e), seconds=time.time() - t0)
+        return rec
+    rec.update(status='stopped' if res.get('stopped') else 'finished',
+        seconds=time.time() - t0, run_id=res.get('run_id'),
+        steps=len(res['mses']['val']))
+    return rec
+
+def run_asha(pkey, params, fname, gan=True, nsample=100, max_t=None, grace_period=None,
+    reduction_factor=4, workers=None, threads=None, force=False, seed=0):
+    """ sample `nsample` configs and train them on a process pool under ASHA
+
+        max_t / grace_period default to niters/10 and niters/100 reports
+        (as in ray_tune.py); trial records are appended to `fname` (JSON lines)
+    """
+    niters = params['training']['niters']
+    max_t = max_t or max(1, niters // 10)
+    grace_period = grace_period or max(1, niters // 100)
+    workers = workers or mp.cpu_count()
+    threads = threads or max(1, mp.cpu_count() // workers)
+
+    params = deepcopy(params)
+    params['training'].update(log=False, plot=False, save=False)
+    rng = np.random.RandomState(seed)
+    trials = [{'trial_id': i, 'config': sample_config(params, rng, gan=gan)}
+        for i in range(nsample)]
+
+    with ASHAManager() as manager:
+        scheduler = manager.ASHA(max_t, grace_period, reduction_factor)
+        with open(fname, 'a') as f, mp.Pool(workers, initializer=_init_worker,
+            initargs=(threads, pkey, gan, force, scheduler, shared_problem(pkey, params))) as pool:
+            for i, rec in enumerate(pool.imap_unordered(_run_trial, trials)):
+                t, score = scheduler.results().get(rec['trial_id'], (0, np.nan))
+                rec.update(t=t, mean_squared_error=score)
+                f.write(json.dumps(rec, default=str) + '\n')
+                f.flush()
+                print(f'[{i+1}/{nsample}] trial {rec["trial_id"]} {rec["status"]} '
+                      f'at t={t}: {score:.4e}')
+                trials[rec['trial_id']] = rec
+    return trials
+
+if __name__ == "__main__":
+    args = argparse.ArgumentParser()
+    args.add_argument('--pkey', type=str, default='EXP',
+        help='problem to run (exp=Exponential, sho=SimpleOscillator, nlo=NonlinearOscillator)')
+    args.add_argument('--classical', action='store_true', default=False,
+        help='whether to use classical training, default False (use GAN))')
+    args.add_argument('--nsample', type=int, default=100,
+        help='number of sampled configs')
+    args.add_argument('--max-t', type=int, default=None,
+        help='max reports per trial (1 report = 10 steps), default niters/10')
+    args.add_argument('--grace-period', type=int, default=None,
+        help='reports before the first rung, default niters/100')
+    args.add_argument('--reduction-factor', type=int, default=4)
+    args.add_argument('--workers', type=int, default=None,
+        help='number of worker processes, default all CPUs')
+    args.add_argument('--threads', type=int, default=None,
+        help='torch threads per worker, default CPUs / workers')
+    args.add_argument('--seed', type=int, default=0,
+        help='seed for sampling configs')
+    args.add_argument('--fname', type=str, default=None,
+        help='trial records (JSON lines), default {PKEY}_{method}_asha.jsonl')
+    args.add_argument('--force', action='store_true', default=False,
+        help='re-run trials even if a cached result exists')
+    args = args.parse_args()
+
+    gan = not args.classical
+    method = 'gan' if gan else 'L2'
+    fname = args.fname or f'{args.pkey.upper()}_{method}_asha.jsonl'
+    print(f'Using {"GAN" if gan else "classical"} method')
+
+    trials = run_asha(args.pkey, get_config(args.pkey), fname, gan=gan,
+        nsample=args.nsample, max_t=args.max_t, grace_period=args.grace_period,
+        reduction_factor=args.reduction_factor, workers=args.workers,
+        threads=args.threads, force=args.force, seed=args.seed)
+
+    done = [t for t in trials if t.get('status') != 'failed' and not np.isnan(t['mean_squared_error'])]
+    done = sorted(done, key=lambda t: t['mean_squared_error'])
+    print('Sorted top results')
+    for t in done[:10]:
+        print(f"trial {t['trial_id']}: {t['mean_squared_error']:.4e} ({t['status']} at t={t['t']})")
+    if done:
+        print('Best config is:', done[0]['config'])
+        print('Best MSE is: ', done[0]['mean_squared_error'])
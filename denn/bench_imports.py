@@ -0,0 +1,57 @@
+import sys
+import json
+import argparse
+import subprocess
+import numpy as np
+
+# modules only needed for plotting / tuning / RANS reference solutions;
+# importing the trainers must not pull these in (unless torch already does)
+HEAVY = ['matplotlib', 'pandas', 'IPython', 'ray', 'tqdm', 'denn.rans.numerical']
+
+_PROBE = """
+import sys, json, time
+t0 = time.perf_counter()
+import torch, numpy
+t1 = time.perf_counter()
+base = set(sys.modules)
+import {modules}
+t2 = time.perf_counter()
+print(json.dumps({{'base': t1 - t0, 'denn': t2 - t1,
+    'loaded': [m for m in {heavy!r} if m in sys.modules and m not in base]}}))
+"""
+
+def measure(modules=('denn.algos', 'denn.problems'), repeats=5):
+    """ import time of `modules` (on top of torch + numpy) in fresh interpreters """
+    code = _PROBE.format(modules=', '.join(modules), heavy=HEAVY)
+    runs = []
+    for _ in range(repeats):
+        out = subprocess.run([sys.executable, '-c', code], check=True,
+            stdout=subprocess.PIPE, universal_newlines=True).stdout
+        runs.append(json.loads(out.strip().splitlines()[-1]))
+    return {
+        'base': float(np.median([r['base'] for r in runs])),
+        'denn': float(np.median([r['denn'] for r in runs])),
+        'loaded': sorted(set(m for r in runs for m in r['loaded'])),
+    }
+
+if __name__ == '__main__':
+    args = argparse.ArgumentParser()
+    args.add_argument('--modules', type=str, nargs='*', default=['denn.algos', 'denn.problems'],
+        help='modules to import')
+    args.add_argument('--repeats', type=int, default=5,
+        help='number of fresh interpreters (median is reported)')
+    args.add_argument('--budget', type=float, default=0.5,
+        help='max seconds allowed on top of importing torch + numpy')
+    args = args.parse_args()
+
+    res = measure(args.modules, args.repeats)
+    print(f"torch + numpy: {res['base']:.3f}s | {', '.join(args.modules)}: {res['denn']:.3f}s "
+          f"(budget {args.budget:.3f}s)")
+    failed = False
+    if res['loaded']:
+        print(f"Heavy modules loaded at import: {', '.join(res['loaded'])}")
+        failed = True
+    if res['denn'] > args.budget:
+        print('Import time over budget')
+        failed = True
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,64 @@
+import os
+import glob
+import hashlib
+import functools
+from copy import deepcopy
+import torch
+
+from denn.utils import config_hash
+
+this_dir = os.path.dirname(os.path.abspath(__file__))
+CACHE_DIR = os.path.join(this_dir, '../experiments/cache')
+
+# training options that write artifacts (a run directory, plots) as a side effect
+ARTIFACT_KEYS = ['plot', 'save', 'save_for_animation']
+
+# training options that do not change the result of a run
+_NON_RESULT_KEYS = ['log', 'dirname', 'log_every', 'flush_every'] + ARTIFACT_KEYS
+
+@functools.lru_cache(maxsize=None)
+def code_version():
+    """ hash of the package source (so results are invalidated when code changes) """
+    h = hashlib.sha1()
+    for fname in sorted(glob.glob(os.path.join(this_dir, '**', '*.py'), recursive=True)):
+        h.update(os.path.relpath(fname, this_dir).encode())
+        with open(fname, 'rb') as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+def experiment_key(pkey, method, params):
+    """ hash of resolved config + seed + code version """
+    params = deepcopy(params)
+    for k in _NON_RESULT_KEYS:
+        params.get('training', {}).pop(k, None)
+    return config_hash({
+        'pkey': pkey.lower().strip(),
+        'method': method,
+        'seed': params.get('training', {}).get('seed'),
+        'params': params,
+        'code': code_version(),
+    })
+
+def _path(key, cache_dir):
+    return os.path.join(cache_dir, key[:2], f'{key}.pt')
+
+def load_result(key, cache_dir=CACHE_DIR):
+    """ cached result dict for `key` or None """
+    path = _path(key, cache_dir)
+    if not os.path.exists(path):
+        return None
+    try:
+        return torch.load(path)
+    except Exception as e:
+        print(f'Ignoring unreadable cache entry {path}: {e}')
+        return None
+
+def save_result(key, res, cache_dir=CACHE_DIR):
+    """ store histories and final model state for `key` (atomic write) """
+    path = _path(key, cache_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    entry = {k: v for k, v in res.items() if k != 'model'}
+    entry['model_state'] = res['model'].state_dict()
+    tmp = f'{path}.{os.getpid()}.tmp'
+    torch.save(entry, tmp)
+    os.replace(tmp, path)
@@ -3,14 +3,77 @@ import yaml
 
 this_dir = os.path.dirname(os.path.abspath(__file__))
 
-def get_config(problem_key):
-    """ valid pkeys = EXP, SHO, NLO, POS """
+# top-level blocks describing sweeps over a config (not part of a single run)
+SWEEP_KEYS = ['hyper_space', 'niters_space', 'search_space']
+
+# sweep spaces shared by all problems; a problem YAML only lists the keys it overrides
+DEFAULT_SWEEP_SPACES = {
+    'hyper_space': {
+        'gan': {
+            'training.g_lr': [0.001, 0.002, 0.005, 0.01],
+            'training.d_lr': [0.0005, 0.001, 0.002],
+            'generator.n_hidden_units': [20, 40],
+        },
+        'L2': {
+            'training.lr': [0.0005, 0.001, 0.005, 0.01],
+            'training.betas': [[0.0, 0.9], [0.9, 0.999]],
+            'generator.n_hidden_units': [20, 40],
+        },
+    },
+    # denn/tpe.py: type uniform / loguniform (low, high, optional size) or
+    # categorical (choices); `condition` makes a parameter active only for given values
+    'search_space': {
+        'gan': {
+            'training.g_lr': {'type': 'loguniform', 'low': 1e-6, 'high': 1e-2},
+            'training.d_lr': {'type': 'loguniform', 'low': 1e-6, 'high': 1e-2},
+            'training.gamma': {'type': 'uniform', 'low': 0.99, 'high': 0.9999,
+                'condition': {'training.lr_schedule': True}},
+            'training.g_betas': {'type': 'uniform', 'low': 0.0, 'high': 0.999, 'size': 2},
+            'training.d_betas': {'type': 'uniform', 'low': 0.0, 'high': 0.999, 'size': 2},
+            'training.wgan': {'type': 'categorical', 'choices': [False, True]},
+            'training.gp': {'type': 'loguniform', 'low': 0.01, 'high': 1.0,
+                'condition': {'training.wgan': True}},
+            'generator.n_hidden_units': {'type': 'categorical', 'choices': [20, 30, 40]},
+            'generator.n_hidden_layers': {'type': 'categorical', 'choices': [2, 3, 4]},
+            'discriminator.n_hidden_units': {'type': 'categorical', 'choices': [20, 30, 40]},
+            'discriminator.n_hidden_layers': {'type': 'categorical', 'choices': [2, 3, 4]},
+        },
+        'L2': {
+            'training.lr': {'type': 'loguniform', 'low': 1e-6, 'high': 1e-2},
+            'training.betas': {'type': 'uniform', 'low': 0.0, 'high': 0.999, 'size': 2},
+            'training.lr_schedule': {'type': 'categorical', 'choices': [False, True]},
+            'training.gamma': {'type': 'uniform', 'low': 0.99, 'high': 0.9999,
+                'condition': {'training.lr_schedule': True}},
+            'generator.n_hidden_units': {'type': 'categorical', 'choices': [20, 30, 40]},
+            'generator.n_hidden_layers': {'type': 'categorical', 'choices': [2, 3, 4]},
+        },
+    },
+}
+
+def get_config(problem_key, sweeps=False):
+    """ valid pkeys = EXP, SHO, NLO, POS
+        sweep blocks (e.g. `hyper_space`) are dropped unless `sweeps=True`
+    """
     problem_key = problem_key.strip().lower()
     fname = os.path.join(this_dir, f'{problem_key}.yaml')
     with open(fname, 'r') as f:
         params = yaml.full_load(f)
+    if not sweeps:
+        for k in SWEEP_KEYS:
+            params.pop(k, None)
     return params
 
+def get_sweep_space(problem_key, method, name='hyper_space'):
+    """ {dotted config key: list of values} of sweep `name` for `method` ('gan' or 'L2')
+
+        the problem YAML's block is merged over `DEFAULT_SWEEP_SPACES`
+    """
+    default = DEFAULT_SWEEP_SPACES.get(name, {})
+    space = get_config(problem_key, sweeps=True).get(name) or {}
+    if method not in space and method not in default:
+        raise KeyError(f'No `{name}` for {method} in {problem_key.strip().lower()}.yaml')
+    return dict(default.get(method, {}), **(space.get(method) or {}))
+
 def write_config(config_dict, save_path):
     with open(save_path, 'w') as f:
         yaml.dump(config_dict, f)
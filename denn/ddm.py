@@ -0,0 +1,344 @@
+import os
+import time
+import socket
+import argparse
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.distributed as dist
+
+from denn.models import MLP
+from denn.utils import diff, meshgrid_ij, MetricBuffer, RateLimiter, unique_dirname
+from denn.config.config import get_config
+import denn.problems as pb
+
+this_dir = os.path.dirname(os.path.abspath(__file__))
+
+# edges of a subdomain: (name, axis of the normal, side) -- the neighbour across
+# edge k shares it as edge k ^ 1
+EDGES = [('left', 0, 0), ('right', 0, 1), ('bottom', 1, 0), ('top', 1, 1)]
+
+def subdomains(xmin, xmax, ymin, ymax, px, py):
+    """ (x0, x1, y0, y1) of the px x py boxes; box (i, j) is rank i * py + j """
+    xs, ys = np.linspace(xmin, xmax, px + 1), np.linspace(ymin, ymax, py + 1)
+    return [(float(xs[i]), float(xs[i+1]), float(ys[j]), float(ys[j+1]))
+        for i in range(px) for j in range(py)]
+
+def neighbours(rank, px, py):
+    """ rank across each of EDGES (None on the outer boundary) """
+    i, j = divmod(rank, py)
+    return [(i-1) * py + j if i > 0 else None,
+            (i+1) * py + j if i < px - 1 else None,
+            i * py + j - 1 if j > 0 else None,
+            i * py + j + 1 if j < py - 1 else None]
+
+def owner(x, y, boxes, px, py):
+    """ rank owning each point (points on an interface go to the upper box) """
+    x0, x1, y0, y1 = boxes[0][0], boxes[-1][1], boxes[0][2], boxes[-1][3]
+    i = np.clip(np.floor((np.asarray(x) - x0) / (x1 - x0) * px), 0, px - 1).astype(int)
+    j = np.clip(np.floor((np.asarray(y) - y0) / (y1 - y0) * py), 0, py - 1).astype(int)
+    return i * py + j
+
+class SubdomainNet(nn.Module):
+    """ MLP on one box, with inputs rescaled to [-1, 1]^2 """
+    def __init__(self, box, **mlp_kwargs):
+        super().__init__()
+        x0, x1, y0, y1 = box
+        self.register_buffer('center', torch.tensor([[(x0 + x1) / 2, (y0 + y1) / 2]]))
+        self.register_buffer('scale', torch.tensor([[(x1 - x0) / 2, (y1 - y0) / 2]]))
+        self.mlp = MLP(**mlp_kwargs)
+
+    def forward(self, xy):
+        return self.mlp((xy - self.center) / self.scale)
+
+class DDMModel(nn.Module):
+    """ global (raw, unadjusted) network output assembled from the subdomain nets
+
+        behaves like a single network on (x, y) inputs, e.g. for
+        `problem.get_plot_dicts(model(grid), x, y, sol)`
+    """
+    def __init__(self, nets, boxes, px, py):
+        super().__init__()
+        self.nets = nn.ModuleList(nets)
+        self.boxes = boxes
+        self.px, self.py = px, py
+
+    def forward(self, xy):
+        ranks = torch.as_tensor(owner(xy[:, 0].detach().numpy(), xy[:, 1].detach().numpy(),
+            self.boxes, self.px, self.py)).reshape(-1, 1)
+        out = torch.zeros(len(xy), 1)
+        for r, net in enumerate(self.nets):
+            mask = ranks == r
+            if mask.any():
+                out = torch.where(mask, net(xy), out)
+        return out
+
+def _interface_points(box, edge, n):
+    """ `n` points along one edge of `box` (corners excluded), as (x, y) columns """
+    x0, x1, y0, y1 = box
+    _, axis, side = EDGES[edge]
+    if axis == 0:
+        t = torch.linspace(y0, y1, n + 2)[1:-1]
+        x, y = torch.full_like(t, (x0, x1)[side]), t
+    else:
+        t = torch.linspace(x0, x1, n + 2)[1:-1]
+        x, y = t, torch.full_like(t, (y0, y1)[side])
+    return x.reshape(-1, 1).requires_grad_(), y.reshape(-1, 1).requires_grad_()
+
+def _local_grid(box, nx, ny):
+    """ cell-centred nx x ny grid on `box` (no points shared between boxes) """
+    x0, x1, y0, y1 = box
+    hx, hy = (x1 - x0) / nx, (y1 - y0) / ny
+    xs = torch.linspace(x0 + hx / 2, x1 - hx / 2, nx)
+    ys = torch.linspace(y0 + hy / 2, y1 - hy / 2, ny)
+    gx, gy = meshgrid_ij(xs, ys)
+    return gx.reshape(-1, 1), gy.reshape(-1, 1), hx, hy
+
+def problem_boxes(problem, px, py):
+    """ `subdomains` of the domain of a PoissonEquation """
+    return subdomains(problem.xmin, problem.xmax, problem.ymin, problem.ymax, px, py)
+
+def train_subdomain(rank, world_size, params, px, py, niters=1000, lr=1e-3, betas=(0.9, 0.999),
+    lr_schedule=True, gamma=0.999, n_iface=32, w_iface=1., w_flux=1., seed=0,
+    log=True, log_every=1.0, flush_every=100, problem=None, boxes=None, **kwargs):
+    """ train the net of box `rank` of the Poisson problem (call on every rank)
+
+        loss = PDE residual MSE on the box's collocation points
+             + w_iface * mean (u - u_nb)^2 + w_flux * mean (du/dn - du_nb/dn)^2
+        on every interface, where the neighbours' interface values of the same
+        step (detached) are exchanged with one all_gather per step. The
+        outer Dirichlet conditions are imposed by the problem's adjustment as in
+        single-network training. Train / val MSE (over the global grid) and the
+        losses are summed over ranks every step.
+        `problem` and `boxes` are built from `params` unless given.
+        Returns (net, history, timing); rank 0's history holds the global metrics.
+    """
+    assert world_size == px * py, f'Need px * py = {px * py} processes, got {world_size}'
+    if problem is None:
+        problem = pb.PoissonEquation(**params['problem'])
+    if boxes is None:
+        boxes = problem_boxes(problem, px, py)
+    box, nbs = boxes[rank], neighbours(rank, px, py)
+
+    torch.manual_seed(0) # same init in every box (inputs are rescaled to the box)
+    net = SubdomainNet(box, **params['generator'])
+    torch.manual_seed(seed + rank)
+
+    # collocation points of this box; sampled with noise like PoissonEquation
+    gx, gy, hx, hy = _local_grid(box, max(2, problem.nx // px), max(2, problem.ny // py))
+    perturb = problem.perturb
+
+    # validation: the box's share of the global grid
+    x, y = problem.get_grid()
+    mine = torch.as_tensor(owner(x.detach().numpy().ravel(), y.detach().numpy().ravel(),
+        boxes, px, py) == rank)
+    xv, yv = x[mine].reshape(-1, 1), y[mine].reshape(-1, 1)
+    sol_v = problem.get_solution(xv, yv).detach()
+
+    iface = {e: _interface_points(box, e, n_iface) for e, nb in enumerate(nbs) if nb is not None}
+
+    opt = torch.optim.Adam(net.parameters(), lr=lr, betas=betas)
+    if lr_schedule:
+        lr_scheduler = torch.optim.lr_scheduler.ExponentialLR(optimizer=opt, gamma=gamma)
+
+    metrics = MetricBuffer(['loss', 'pde', 'iface', 'train', 'val'], size=flush_every)
+    logger = RateLimiter(every=log_every, last_step=niters-1)
+    t0, c0 = time.time(), time.process_time()
+    for i in range(niters):
+        xs = (gx + hx / 4 * torch.randn_like(gx) if perturb else gx.clone()).requires_grad_()
+        ys = (gy + hy / 4 * torch.randn_like(gy) if perturb else gy.clone()).requires_grad_()
+        u = net(torch.cat((xs, ys), 1))
+        residuals = problem.get_equation(u, xs, ys)
+        loss_pde = torch.mean(residuals**2)
+
+        # interface values / normal fluxes, exchanged with the neighbours
+        mine_vals = torch.zeros(len(EDGES), 2, n_iface)
+        ifv = {}
+        for e, (xe, ye) in iface.items():
+            ue = problem.adjust(net(torch.cat((xe, ye), 1)), xe, ye)['pred']
+            fe = diff(ue, xe if EDGES[e][1] == 0 else ye)
+            ifv[e] = (ue.reshape(-1), fe.reshape(-1))
+            mine_vals[e, 0], mine_vals[e, 1] = ifv[e][0].detach(), ifv[e][1].detach()
+        gathered = [torch.zeros_like(mine_vals) for _ in range(world_size)]
+        dist.all_gather(gathered, mine_vals)
+
+        loss_iface = torch.zeros(())
+        for e, (ue, fe) in ifv.items():
+            other = gathered[nbs[e]][e ^ 1]
+            loss_iface = loss_iface + w_iface * torch.mean((ue - other[0])**2) \
+                + w_flux * torch.mean((fe - other[1])**2)
+        loss = loss_pde + loss_iface
+
+        opt.zero_grad()
+        loss.backward()
+        opt.step()
+        if lr_schedule:
+            lr_scheduler.step()
+
+        # global metrics: sums of squared errors / losses over ranks
+        with torch.no_grad():
+            u_adj = problem.adjust(u, xs, ys)['pred']
+            sse_train = torch.sum((u_adj - problem.get_solution(xs, ys))**2)
+            sse_val = torch.sum((problem.adjust(net(torch.cat((xv, yv), 1)), xv, yv)['pred'] - sol_v)**2)
+        stats = torch.stack([loss.detach(), loss_pde.detach(), loss_iface.detach(),
+            sse_train, torch.tensor(float(len(xs))), sse_val, torch.tensor(float(len(xv)))])
+        dist.all_reduce(stats)
+        metrics.record(loss=stats[0], pde=stats[1], iface=stats[2],
+            train=stats[3] / stats[4], val=stats[5] / stats[6])
+
+        if log and rank == 0 and logger.ready(i):
+            m = metrics.latest()
+            print(f'Step {i}: Loss {m["loss"]:.4e} | PDE {m["pde"]:.4e} | Interface {m["iface"]:.4e} '
+                  f'| Train MSE {m["train"]:.4e} | Val MSE {m["val"]:.4e}')
+
+    metrics.flush()
+    timing = {'wall_seconds': time.time() - t0, 'cpu_seconds': time.process_time() - c0,
+        'steps': len(metrics)}
+    return net, metrics.history, timing
+
+def gather_model(net, params, boxes, px, py):
+    """ all_gather the subdomain nets' parameters and assemble a DDMModel (on every rank) """
+    flat = torch.nn.utils.parameters_to_vector(net.parameters()).detach()
+    gathered = [torch.zeros_like(flat) for _ in range(px * py)]
+    dist.all_gather(gathered, flat)
+    nets = []
+    for box, v in zip(boxes, gathered):
+        n = SubdomainNet(box, **params['generator'])
+        torch.nn.utils.vector_to_parameters(v, n.parameters())
+        nets.append(n)
+    return DDMModel(nets, boxes, px, py)
+
+def _save(model, problem, params, history, timing, niters, dirname, plot=True):
+    """ store the assembled solution like the trainers do (and render it) """
+    from denn.runstore import RunStore
+    from denn.algos import _save_run
+    from denn.render import render_async
+
+    x, y = problem.get_grid()
+    grid = torch.cat((x, y), 1)
+    pred_dict, diff_dict = problem.get_plot_dicts(model(grid), x, y, problem.get_solution(x, y))
+    dirname = unique_dirname(os.path.join(this_dir, '../experiments/runs', dirname))
+    store = RunStore(dirname, params)
+    store.append('history', {k: np.asarray(v) for k, v in history.items()})
+    plot_spec = dict(mses={'train': 'history.train', 'val': 'history.val'},
+        losses={'$L_U$': 'history.pde', '$L_I$': 'history.iface'}, logloss=True, alpha=0.7)
+    _save_run(store, grid, pred_dict, diff_dict, plot_spec=plot_spec, niters=niters, **timing)
+    if plot:
+        render_async(dirname)
+    return dirname
+
+def _worker(rank, world_size, params, px, py, opts, init_method=None, queue=None, threads=None):
+    """ process entry: join the group, train one box, rank 0 assembles / saves / reports """
+    if threads:
+        torch.set_num_threads(threads)
+    if not dist.is_initialized():
+        dist.init_process_group('gloo', init_method=init_method or 'env://',
+            rank=rank, world_size=world_size)
+    problem = pb.PoissonEquation(**params['problem'])
+    boxes = problem_boxes(problem, px, py)
+    net, history, timing = train_subdomain(rank, world_size, params, px, py,
+        problem=problem, boxes=boxes, **opts)
+    model = gather_model(net, params, boxes, px, py)
+    res = None
+    if rank == 0:
+        res = {'mses': {'train': history['train'], 'val': history['val']},
+            'losses': {'pde': history['pde'], 'iface': history['iface']},
+            'model': model, 'timing': timing, 'dirname': None}
+        if opts.get('save'):
+            res['dirname'] = _save(model, problem, params, history, timing, opts['niters'],
+                opts.get('dirname', 'POS_ddm'), plot=opts.get('plot', True))
+        if queue is not None:
+            queue.put({k: v for k, v in res.items() if k != 'model'})
+            # numpy copies: shared tensors would not outlive this process
+            queue.put((boxes, [{k: v.numpy() for k, v in n.state_dict().items()} for n in model.nets]))
+    dist.destroy_process_group()
+    return res
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def run_ddm(params, px=2, py=2, threads=None, **opts):
+    """ train the px x py subdomains in px * py local processes (gloo)
+
+        returns rank 0's results, with the assembled DDMModel as `model`
+    """
+    import multiprocessing as mp
+    import queue as queue_module
+
+    world_size = px * py
+    threads = threads or max(1, mp.cpu_count() // world_size)
+    ctx = mp.get_context('spawn')
+    queue = ctx.Queue()
+    init_method = f'tcp://127.0.0.1:{_free_port()}'
+    procs = [ctx.Process(target=_worker, args=(r, world_size, params, px, py, opts,
+        init_method, queue if r == 0 else None, threads)) for r in range(world_size)]
+    for proc in procs:
+        proc.start()
+    results = []
+    while len(results) < 2: # rank 0 sends its results, then the boxes and nets
+        failed = [r for r, proc in enumerate(procs) if proc.exitcode not in (None, 0)]
+        if failed:
+            for proc in procs:
+                proc.terminate()
+            raise RuntimeError(f'Subdomain processes {failed} failed')
+        try:
+            results.append(queue.get(timeout=1.))
+        except queue_module.Empty:
+            pass
+    res, (boxes, states) = results
+    for proc in procs:
+        proc.join()
+
+    nets = []
+    for box, state in zip(boxes, states):
+        net = SubdomainNet(box, **params['generator'])
+        net.load_state_dict({k: torch.from_numpy(v) for k, v in state.items()})
+        nets.append(net)
+    res['model'] = DDMModel(nets, boxes, px, py)
+    return res
+
+if __name__ == '__main__':
+    args = argparse.ArgumentParser()
+    args.add_argument('--px', type=int, default=2,
+        help='number of subdomains along x')
+    args.add_argument('--py', type=int, default=2,
+        help='number of subdomains along y')
+    args.add_argument('--niters', type=int, default=None,
+        help='training steps, default training.niters of pos.yaml')
+    args.add_argument('--lr', type=float, default=1e-3)
+    args.add_argument('--hidden', type=int, default=20,
+        help='hidden units of each subdomain MLP')
+    args.add_argument('--layers', type=int, default=2,
+        help='hidden layers of each subdomain MLP')
+    args.add_argument('--n-iface', type=int, default=32,
+        help='points per interface edge')
+    args.add_argument('--w-iface', type=float, default=1.,
+        help='weight of the interface continuity term')
+    args.add_argument('--w-flux', type=float, default=1.,
+        help='weight of the interface flux term')
+    args.add_argument('--threads', type=int, default=None,
+        help='torch threads per process, default CPUs / subdomains')
+    args.add_argument('--no-save', action='store_true', default=False,
+        help='do not store / plot the assembled solution')
+    args = args.parse_args()
+
+    params = get_config('pos')
+    params['generator'].update(n_hidden_units=args.hidden, n_hidden_layers=args.layers)
+    training = params['training']
+    opts = dict(niters=args.niters or training['niters'], lr=args.lr,
+        gamma=training['gamma'], lr_schedule=training['lr_schedule'], seed=training['seed'],
+        n_iface=args.n_iface, w_iface=args.w_iface, w_flux=args.w_flux,
+        save=not args.no_save, plot=training['plot'], dirname='POS_ddm')
+
+    if 'WORLD_SIZE' in os.environ: # launched by torchrun: this process is one subdomain
+        res = _worker(int(os.environ['RANK']), int(os.environ['WORLD_SIZE']), params,
+            args.px, args.py, opts, threads=args.threads)
+    else:
+        print(f'Training {args.px} x {args.py} subdomains in {args.px * args.py} processes')
+        res = run_ddm(params, args.px, args.py, threads=args.threads, **opts)
+    if res is not None:
+        print(f"Val MSE {res['mses']['val'][-1]:.4e} | {res['timing']['wall_seconds']:.1f}s")
+        if res['dirname']:
+            print(f"Saved run data to {res['dirname']}")
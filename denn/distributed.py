@@ -0,0 +1,119 @@
+import os
+import torch
+import torch.distributed as dist
+
+def init_distributed(backend='gloo'):
+    """ join the process group set up by the launcher (torchrun / torch.distributed.launch)
+
+        reads RANK / WORLD_SIZE / MASTER_ADDR / MASTER_PORT from the environment;
+        a plain `python` run (no WORLD_SIZE) stays single-process.
+        Returns (rank, world_size).
+    """
+    if not dist.is_available():
+        raise RuntimeError('torch.distributed is not available in this torch build')
+    if not dist.is_initialized() and int(os.environ.get('WORLD_SIZE', 1)) > 1:
+        dist.init_process_group(backend=backend, init_method='env://')
+    return get_rank(), get_world_size()
+
+def cleanup_distributed():
+    if dist.is_available() and dist.is_initialized():
+        dist.destroy_process_group()
+
+def get_rank():
+    return dist.get_rank() if dist.is_available() and dist.is_initialized() else 0
+
+def get_world_size():
+    return dist.get_world_size() if dist.is_available() and dist.is_initialized() else 1
+
+def is_main():
+    """ True on rank 0 (and in single-process runs), which owns validation and artifacts """
+    return get_rank() == 0
+
+def broadcast_params(*nets):
+    """ copy rank 0's parameters to all ranks so replicas start identical """
+    if get_world_size() == 1:
+        return
+    with torch.no_grad():
+        for net in nets:
+            for p in net.parameters():
+                dist.broadcast(p.data, src=0)
+
+def all_reduce_grads(*nets, n=1):
+    """ average parameter gradients over ranks (one flat all-reduce per call)
+
+        each rank's gradients are weighted by `n`, the number of samples its
+        (mean) loss was taken over, so shards of unequal size give the
+        gradient of the mean over the full sample
+    """
+    world = get_world_size()
+    if world == 1:
+        return
+    grads = [p.grad for net in nets for p in net.parameters() if p.grad is not None]
+    if not grads:
+        return
+    flat = torch.cat([g.reshape(-1) for g in grads] + [torch.ones(1, dtype=grads[0].dtype)]) * n
+    dist.all_reduce(flat)
+    flat = flat[:-1] / flat[-1]
+    i = 0
+    for g in grads:
+        k = g.numel()
+        g.copy_(flat[i:i+k].view_as(g))
+        i += k
+
+def all_reduce_mean(*values, n=1):
+    """ mean over ranks of 0-dim tensors (e.g. losses for logging), as one all-reduce;
+        weighted by each rank's number of samples `n` like `all_reduce_grads` """
+    world = get_world_size()
+    if world == 1:
+        return values
+    flat = torch.stack([v.detach().reshape(()).float() for v in values] + [torch.tensor(1.)]) * n
+    dist.all_reduce(flat)
+    return tuple(flat[:-1] / flat[-1])
+
+def broadcast_flag(flag):
+    """ rank 0's boolean (e.g. early stopping) on every rank """
+    if get_world_size() == 1:
+        return flag
+    t = torch.tensor([1 if flag else 0])
+    dist.broadcast(t, src=0)
+    return bool(t.item())
+
+class ShardedProblem():
+    """ view of a problem whose grid samples are this rank's shard
+
+        The full sample is drawn on every rank with the same seed and rank `r`
+        keeps rows r, r + world, r + 2 world, ... so the shards are disjoint,
+        cover the domain and together equal the single-process sample. The
+        same holds for the gradient penalty weights (`gp_weights`).
+        Everything else is delegated to the wrapped problem.
+    """
+    def __init__(self, problem, rank=None, world_size=None):
+        self.problem = problem
+        self.rank = get_rank() if rank is None else rank
+        self.world_size = get_world_size() if world_size is None else world_size
+
+    def __getattr__(self, name):
+        return getattr(self.problem, name)
+
+    def shard(self, t):
+        return t[self.rank::self.world_size]
+
+    def _sample_size(self):
+        grid = self.problem.get_grid()
+        return len(grid[0]) if isinstance(grid, tuple) else len(grid)
+
+    def shard_size(self):
+        """ number of sample points owned by this rank """
+        return len(range(self.rank, self._sample_size(), self.world_size))
+
+    def gp_weights(self):
+        """ this rank's shard of WGAN-GP interpolation weights drawn for the full
+            sample (as `calc_gradient_penalty` does), so every rank's RNG stays
+            in step with the single-process run """
+        return self.shard(torch.rand(self._sample_size(), 1))
+
+    def get_grid_sample(self):
+        samp = self.problem.get_grid_sample()
+        if isinstance(samp, tuple): # 2D: (x, y)
+            return tuple(self.shard(s) for s in samp)
+        return self.shard(samp)
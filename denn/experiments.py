@@ -6,7 +6,9 @@ import numpy as np
 from denn.algos import train_L2, train_L2_2D, train_GAN, train_GAN_2D
 from denn.models import MLP
 from denn.config.config import get_config
-from denn.utils import handle_overwrite
+from denn.registry import RunRegistry
+from denn.cache import experiment_key, load_result, save_result, ARTIFACT_KEYS
+from denn.distributed import init_distributed, cleanup_distributed
 import denn.problems as pb
 
 def get_problem(pkey, params):
@@ -30,7 +32,25 @@ def get_problem(pkey, params):
     else:
         raise RuntimeError(f'Did not understand problem key (pkey): {pkey}')
 
-def L2_experiment(pkey, params):
+def _run_registered(pkey, method, params, train_fn, register=True):
+    """ run `train_fn()` and record it (status, metrics, artifacts) in the run registry """
+    if not register:
+        return train_fn()
+    registry = RunRegistry()
+    run_id = registry.register(pkey, method, params)
+    try:
+        res = train_fn()
+    except BaseException:
+        registry.finish(run_id, status='failed')
+        registry.close()
+        raise
+    registry.finish(run_id, mses=res['mses'], artifact_dir=res.get('dirname'),
+        status='stopped' if res.get('stopped') else 'finished', timing=res.get('timing'))
+    registry.close()
+    res['run_id'] = run_id
+    return res
+
+def L2_experiment(pkey, params, register=True, callback=None, problem=None):
     # model init seed
     torch.manual_seed(0)
     np.random.seed(0)
@@ -43,15 +63,14 @@ def L2_experiment(pkey, params):
     torch.manual_seed(params['training']['seed'])
 
     # run
-    problem = get_problem(pkey, params)
-    if pkey.lower().strip() == "pos":
-        res = train_L2_2D(model, problem, **params['training'], config=params)
-    else:
-        res = train_L2(model, problem, **params['training'], config=params)
+    if problem is None:
+        problem = get_problem(pkey, params)
+    train = train_L2_2D if pkey.lower().strip() == "pos" else train_L2
+    return _run_registered(pkey, 'L2', params,
+        lambda: train(model, problem, **params['training'], config=params, callback=callback),
+        register=register)
 
-    return res
-
-def gan_experiment(pkey, params):
+def gan_experiment(pkey, params, register=True, callback=None, problem=None):
     # model init seed
     torch.manual_seed(0)
     np.random.seed(0)
@@ -65,12 +84,49 @@ def gan_experiment(pkey, params):
     np.random.seed(params['training']['seed'])
 
     # run
-    problem = get_problem(pkey, params)
-    if pkey.lower().strip() == "pos":
-        res = train_GAN_2D(gen, disc, problem, **params['training'], config=params)
-    else:
-        res = train_GAN(gen, disc, problem, **params['training'], config=params)
+    if problem is None:
+        problem = get_problem(pkey, params)
+    train = train_GAN_2D if pkey.lower().strip() == "pos" else train_GAN
+    return _run_registered(pkey, 'gan', params,
+        lambda: train(gen, disc, problem, **params['training'], config=params, callback=callback),
+        register=register)
 
+def _replay(res, callback):
+    """ feed a cached val history to `callback` as training would (every 10 steps) """
+    val = res['mses']['val']
+    for i in range(10, len(val)+1, 10):
+        if callback(i, np.mean(val[i-10:i])) and i < len(val):
+            res['stopped'] = True
+            break
+    return res
+
+def run_experiment(pkey, params, gan=False, force=False, callback=None, problem=None):
+    """ run L2/GAN experiment, memoized on (config, seed, code version)
+
+        returns the cached histories and final model (with `cached=True`)
+        when an identical run already completed; `force=True` re-runs it, as
+        do runs that request artifacts (`save`, `plot`, `save_for_animation`),
+        which only training writes. Runs stopped early by `callback` are not
+        cached. A prebuilt (e.g. shared) `problem` matching `params['problem']`
+        can be passed to skip its setup.
+    """
+    method = 'gan' if gan else 'L2'
+    key = experiment_key(pkey, method, params)
+    artifacts = any(params['training'].get(k) for k in ARTIFACT_KEYS)
+    if not (force or artifacts):
+        res = load_result(key)
+        if res is not None:
+            model = MLP(**params['generator'])
+            model.load_state_dict(res.pop('model_state'))
+            res['model'] = model
+            res['cached'] = True
+            return res if callback is None else _replay(res, callback)
+
+    experiment = gan_experiment if gan else L2_experiment
+    res = experiment(pkey, params, callback=callback, problem=problem)
+    if not res.get('stopped'):
+        save_result(key, res)
+    res['cached'] = False
     return res
 
 if __name__ == '__main__':
@@ -79,13 +135,28 @@ if __name__ == '__main__':
         help='whether to use GAN-based training, default False (use L2-based)')
     args.add_argument('--pkey', type=str, default='EXP',
         help='problem to run (exp=Exponential, sho=SimpleOscillator, nlo=NonlinearOscillator)')
+    args.add_argument('--distributed', action='store_true', default=False,
+        help='data-parallel training over the processes started by torchrun (gloo backend)')
     args = args.parse_args()
 
     params = get_config(args.pkey)
 
+    register = True
+    if args.distributed:
+        rank, world_size = init_distributed()
+        params['training']['distributed'] = True
+        register = rank == 0 # rank 0 registers the run and saves its artifacts
+        if rank == 0:
+            print(f'Data-parallel training on {world_size} processes')
+
     if args.gan:
-        print(f'Running GAN training for {args.pkey} problem...')
-        gan_experiment(args.pkey, params)
+        if register:
+            print(f'Running GAN training for {args.pkey} problem...')
+        gan_experiment(args.pkey, params, register=register)
     else:
-        print(f'Running classical training for {args.pkey} problem...')
-        L2_experiment(args.pkey, params)
+        if register:
+            print(f'Running classical training for {args.pkey} problem...')
+        L2_experiment(args.pkey, params, register=register)
+
+    if args.distributed:
+        cleanup_distributed()
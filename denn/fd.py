@@ -1,7 +1,10 @@
 
+import functools
+from inspect import signature
 from scipy import sparse
-from scipy.sparse.linalg import spsolve
+from scipy.sparse.linalg import splu, cg
 import numpy as np
+from denn.multigrid import Multigrid, laplacian
 
 # from mpl_toolkits.mplot3d import Axes3D
 # import matplotlib.pyplot as plt
@@ -15,126 +18,177 @@ import numpy as np
 #     f = np.asarray(f).flatten() # Flattens into a ((M-2)**2, ) array
 #     return f
 
-def rhs_func(x, y, M):
-    ###----- Element-wise multiplication -----###
-    x, y = x[1:-1,1:-1], y[1:-1,1:-1]
-    g = -(2*x*(y-1)*(y - 2*x + x*y + 2)*np.exp(x-y)).flatten()
-    f = [g[i::M-2] for i in range(M-2)] # Extracts only the inner values
-    f = np.asarray(f).flatten() # Flattens into a ((M-2)**2, ) array
-    return f
-
-
-def bc_dirichlet(x, y, M):
-    ###----- Initializes boundary condition values -----###
-    lBC = np.zeros(M) # Y[:,0]**2
-    leftBC = lBC[1:M-1]
-
-    rBC = np.zeros(M) # np.ones((M,1)).flatten()
-    rightBC = rBC[1:M-1]
-
-    tBC = np.zeros(M) #X[0,:]**3
-    topBC = tBC[1:M-1]
-
-    bBC = np.zeros(M) #np.ones((1,M)).flatten()
-    bottomBC = bBC[1:M-1]
-
-    ###----- Creates a ((M-2)**2, ) array of zeros -----###
-    g1 = np.zeros(((M-2)**2, 1)).flatten()
-
-    ###----- Fills in the top BC (red circles on p. 21) -----###
-    for i in range(M-2):
-        g1[(M-2)*i] = topBC[i]
-
-    ###----- Fills in the bottom BC (blue circles on p. 21) -----###
-    for j in range(M-2):
-        g1[(M-2)*(j+1)-1] = bottomBC[j]
-
-    ###----- Fills in the left BC (top orange circle on p. 21) -----###
-    k1 = np.zeros((len(leftBC),1))
-    k1[0] = 1.0
-    leftBCk = sparse.kron(k1,leftBC).toarray().flatten()
-
-    ###----- Fills in the right BC (bottom orange circle on p. 21) -----###
-    k2 = np.zeros((len(rightBC),1))
-    k2[-1] = 1.0
-    rightBCk = sparse.kron(k2,rightBC).toarray().flatten()
-
-    ###----- Collects all -----###
-    g = g1 + leftBCk + rightBCk
-
-    return [g, lBC, tBC, rBC, bBC]
-
-
-def generate_lhs_matrix(M, hx, hy):
-
-    alpha = hx**2/hy**2
-
-    main_diag = 2 * (1 + alpha) * np.ones((M - 2, 1)).ravel()
-    off_diag = -1 * np.ones((M - 2, 1)).ravel()
-
-    a = main_diag.shape[0]
-
-    diagonals = [main_diag, off_diag, off_diag]
-
-    B = sparse.diags(diagonals, [0, -1, 1], shape=(a, a)).toarray()
-
-    C = sparse.diags([-1*np.ones((M+1, 1)).ravel()], [0], shape=(a,a)).toarray()
-
-    e1 = sparse.eye(M-2).toarray()
-
-    A1 = sparse.kron(e1,B).toarray()
-
-    e2 = sparse.diags([1*np.ones((M, 1)).ravel(),1*np.ones((M, 1)).ravel()], [-1,1], shape=(M-2,M-2)).toarray()
-
-    A2 = sparse.kron(e2,C).toarray()
-
-    mat = A1 + A2
-
-    return mat
-
+def poisson_source(x, y):
+    """ f of -Laplace(u) = f for the pos problem (PoissonEquation) """
+    return -(2*x*(y-1)*(y - 2*x + x*y + 2)*np.exp(x-y))
+
+
+def poisson_solution(x, y):
+    return x*(1-x)*y*(1-y)*np.exp(x-y)
+
+
+###----- Dirichlet boundaries, named as in PoissonEquation.adjust -----###
+BOUNDARIES = ['x_min', 'x_max', 'y_min', 'y_max']
+
+def _boundary_values(bc, side, s):
+    """ values of boundary function `bc[side]` (callable or constant, default 0) along `s` """
+    g = (bc or {}).get(side, 0.)
+    return np.broadcast_to(g(s) if callable(g) else g, s.shape).astype(float)
+
+
+def assemble(nx, ny, xmin=0., xmax=1., ymin=0., ymax=1., source=None, bc=None, matrix=True):
+    """ 5-point FD system for -Laplace(u) = source with Dirichlet boundaries
+
+        The grid is nx x ny nodes of [xmin, xmax] x [ymin, ymax] (as in
+        PoissonEquation) and arrays are indexed [x, y], so `U.reshape(-1, 1)`
+        lines up with the problem's `grid_x` / `grid_y`. `source(x, y)` and the
+        boundary functions `bc = {'x_min': g(y), 'x_max': g(y), 'y_min': g(x),
+        'y_max': g(x)}` take arrays (constants are also accepted). Returns a dict
+        with the nodes `X`, `Y`, `U` holding the boundary values, the CSR
+        matrix `A` of the inner points (x-major; skipped if not `matrix`), the
+        right hand side `b` and the spacing `h`.
+    """
+    x = np.linspace(xmin, xmax, nx)
+    y = np.linspace(ymin, ymax, ny)
+    hx, hy = x[1] - x[0], y[1] - y[0]
+    X, Y = np.meshgrid(x, y, indexing='ij')
+
+    ###----- Boundary values, the x sides own the corners -----###
+    U = np.zeros((nx, ny))
+    U[:, 0] = _boundary_values(bc, 'y_min', x)
+    U[:, -1] = _boundary_values(bc, 'y_max', x)
+    U[0, :] = _boundary_values(bc, 'x_min', y)
+    U[-1, :] = _boundary_values(bc, 'x_max', y)
+
+    ###----- Source at the inner points plus the boundary neighbours -----###
+    b = np.zeros((nx-2, ny-2))
+    if source is not None:
+        b += source(X[1:-1, 1:-1], Y[1:-1, 1:-1])
+    b[0, :] += U[0, 1:-1] / hx**2
+    b[-1, :] += U[-1, 1:-1] / hx**2
+    b[:, 0] += U[1:-1, 0] / hy**2
+    b[:, -1] += U[1:-1, -1] / hy**2
+
+    A = laplacian((nx-2, ny-2), (hx, hy)) if matrix else None
+    return {'X': X, 'Y': Y, 'U': U, 'A': A, 'b': b.flatten(), 'h': (hx, hy)}
+
+
+SOLVERS = ['splu', 'cg', 'dst', 'mg']
+
+class PoissonSolver():
+    """ reusable solver of A*x = b, A = -Laplacian of the nx x ny inner points
+
+        The setup is done once per grid: the sparse LU factorization ('splu',
+        minimum degree ordering on A^T + A to keep the fill-in low), the matrix
+        and Jacobi preconditioner ('cg'), the sine-transform eigenvalues ('dst',
+        exact O(N log N) solves on a rectangle) or the multigrid hierarchy
+        ('mg', see denn.multigrid; `mg_kwargs` select the cycle / smoother).
+        `solve` takes one right hand side or a stack of them.
+    """
+    chunk = 16
+    def __init__(self, nx, ny, hx, hy, solver='splu', tol=1e-10, **mg_kwargs):
+        if solver not in SOLVERS:
+            raise ValueError(f'Unknown FD solver {solver}, use one of {SOLVERS}')
+        self.shape, self.h = (nx, ny), (hx, hy)
+        self.solver = solver
+        self.tol = tol
+        if solver == 'splu':
+            self.lu = splu(laplacian(self.shape, self.h).tocsc(), permc_spec='MMD_AT_PLUS_A')
+        elif solver == 'cg':
+            self.A = laplacian(self.shape, self.h)
+            self.jacobi = sparse.diags(1 / self.A.diagonal())
+        elif solver == 'dst':
+            lam = lambda n, h: (2 - 2 * np.cos(np.pi * np.arange(1, n+1) / (n+1))) / h**2
+            self.eig = lam(nx, hx)[:, None] + lam(ny, hy)[None, :]
+        else:
+            self.mg = Multigrid(self.shape, self.h, **mg_kwargs)
+
+    def solve(self, b, verbose=False):
+        """ solution(s) for `b` of shape (nx*ny,) or (k, nx*ny), same shape as `b`
+
+            a stack costs one batched back-substitution / transform ('splu', 'dst')
+            or k iterative solves ('cg', 'mg', with the setup reused)
+        """
+        b = np.asarray(b, dtype=float)
+        B = b.reshape(-1, self.shape[0] * self.shape[1])
+        if self.solver == 'splu':
+            # SuperLU back-substitutes a few columns at a time best (cache reuse)
+            V = np.concatenate([self.lu.solve(B[i:i+self.chunk].T).T
+                for i in range(0, len(B), self.chunk)])
+        elif self.solver == 'dst':
+            from scipy import fft
+            B_hat = fft.dstn(B.reshape(-1, *self.shape), type=1, axes=(1, 2))
+            V = fft.idstn(B_hat / self.eig, type=1, axes=(1, 2))
+        else:
+            V = np.stack([self._solve_iterative(rhs, verbose) for rhs in B])
+        return V.reshape(b.shape)
+
+    def _solve_iterative(self, rhs, verbose):
+        if self.solver == 'cg':
+            V, info = cg(self.A, rhs, M=self.jacobi, maxiter=10 * len(rhs), **{_CG_TOL: self.tol})
+            if info != 0:
+                raise RuntimeError(f'CG did not converge (info={info})')
+            return V
+        V, info = self.mg.solve(rhs, tol=self.tol, verbose=verbose)
+        if not info['converged']:
+            raise RuntimeError(f"Multigrid did not converge (residual {info['residuals'][-1]:.3e})")
+        return V.flatten()
+
+# scipy >= 1.12 calls the relative tolerance of cg `rtol`
+_CG_TOL = 'rtol' if 'rtol' in signature(cg).parameters else 'tol'
+
+@functools.lru_cache(maxsize=8)
+def get_solver(nx, ny, hx, hy, solver='splu', tol=1e-10, **mg_kwargs):
+    """ PoissonSolver for the (grid, spacing, solver) key, set up on first use """
+    return PoissonSolver(nx, ny, hx, hy, solver=solver, tol=tol, **mg_kwargs)
+
+
+def solve_poisson(nx=32, ny=32, xmin=0., xmax=1., ymin=0., ymax=1., source=None, bc=None,
+    solver='splu', verbose=False, **solver_kwargs):
+    """ FD solution on the nx x ny grid (see `assemble`); returns X, Y, U indexed [x, y] """
+    system = assemble(nx, ny, xmin, xmax, ymin, ymax, source=source, bc=bc, matrix=False)
+    V = get_solver(nx-2, ny-2, *system['h'], solver=solver, **solver_kwargs).solve(
+        system['b'], verbose=verbose)
+    U = system['U']
+    U[1:-1, 1:-1] = V.reshape(nx-2, ny-2)
+    return system['X'], system['Y'], U
+
+
+def solve_poisson_batch(nx=32, ny=32, xmin=0., xmax=1., ymin=0., ymax=1., sources=None,
+    bcs=None, solver='splu', **solver_kwargs):
+    """ FD solutions for a list of sources and / or boundary conditions on one
+        grid (a shorter list is repeated); returns X, Y and U[k, x, y] """
+    k = max(len(sources or [None]), len(bcs or [None]))
+    sources = sources or [None] * k
+    bcs = bcs or [None] * k
+    systems = [assemble(nx, ny, xmin, xmax, ymin, ymax, source=sources[i % len(sources)],
+        bc=bcs[i % len(bcs)], matrix=False) for i in range(k)]
+    h = systems[0]['h']
+    V = get_solver(nx-2, ny-2, *h, solver=solver, **solver_kwargs).solve(
+        np.stack([s['b'] for s in systems]))
+    U = np.stack([s['U'] for s in systems])
+    U[:, 1:-1, 1:-1] = V.reshape(k, nx-2, ny-2)
+    return systems[0]['X'], systems[0]['Y'], U
+
+
+def solve_problem(problem, source=poisson_source, bc=None, **kwargs):
+    """ FD solution on the grid of a PoissonEquation, as a column in the
+        order of `problem.get_grid()` (comparable with the network's prediction) """
+    _, _, U = solve_poisson(problem.nx, problem.ny, problem.xmin, problem.xmax,
+        problem.ymin, problem.ymax, source=source, bc=bc, **kwargs)
+    return U.reshape(-1, 1)
 
 ###========================================###
 
-def fd():
-    M = 32
-    (x0, xf) = (0.0, 1.0)
-    (y0, yf) = (0.0, 1.0)
-
-    hx = (xf - x0)/(M-1)
-    hy = (yf - y0)/(M-1)
-
-    x1 = np.linspace(x0, xf, M)
-    y1 = np.linspace(y0, yf, M)
-
-    ###----- Generates a grid ----###
-    X, Y = np.meshgrid(x1, y1)
-
-    ###----- The right hand side function ----###
-    frhs = rhs_func(X, Y, M)
-
-    ###----- Boundary conditions ----###
-    fbc = bc_dirichlet(X, Y, M)
-
-    rhs = frhs*(hx**2) + fbc[0]
-
-    A = generate_lhs_matrix(M, hx, hy)
-
-    ###----- Solves A*x=b --> x=A\b ----###
-    V = np.linalg.solve(A,rhs)
-
-    ###----- Reshapes the 1D array into a 2D array -----###
-    V = V.reshape((M-2, M-2)).T
-
-    ###----- Fills in boundary values for Dirichlet BC -----###
-    U = np.zeros((M,M))
-
-    U[1:M-1, 1:M-1] = V
-    U[:,0] = fbc[1]
-    U[0,:] = fbc[2]
-    U[:,M-1] = fbc[3]
-    U[M-1,:] = fbc[4]
+def fd(M=32, solver='splu', **solver_kwargs):
+    """ FD solution of the pos problem on an M x M grid of the unit square,
+        with rows of X, Y, U along y (meshgrid 'xy' layout)
 
-    return X, Y, U
+        the sparse LU fill-in grows quickly with M, for M >~ 1000 use
+        solver='dst' (M=2048 takes about a second) or the O(N) solver='mg'
+    """
+    X, Y, U = solve_poisson(M, M, source=poisson_source, solver=solver, **solver_kwargs)
+    return X.T, Y.T, U.T
 
 # ###----- Plots -----###
 # fig = plt.figure()
@@ -0,0 +1,172 @@
+import json
+import argparse
+import numpy as np
+
+from denn.config.config import get_config, get_sweep_space
+from denn.utils import dict_product
+from denn.sweep import cell_key, run_cells
+from denn.tpe import TPESampler
+
+KNOBS = ['n', 'niters']
+
+def fidelity_overrides(params, scale, knobs=KNOBS):
+    """ dotted overrides shrinking collocation size and / or niters by `scale` (1 = full)
+
+        1D problems scale `problem.n`; 2D problems scale the number of grid
+        points, i.e. `nx` and `ny` by sqrt(scale)
+    """
+    over = {}
+    problem = params['problem']
+    if 'n' in knobs:
+        if 'nx' in problem:
+            for k in ['nx', 'ny']:
+                over[f'problem.{k}'] = max(4, int(round(problem[k] * np.sqrt(scale))))
+        elif 'n' in problem:
+            over['problem.n'] = max(10, int(round(problem['n'] * scale)))
+    if 'niters' in knobs:
+        over['training.niters'] = max(10, int(round(params['training']['niters'] * scale)))
+    return over
+
+def fidelity_scales(eta=3, levels=3):
+    """ geometric fidelity ladder ending at full fidelity, e.g. [1/9, 1/3, 1] """
+    return [float(eta)**-(levels - 1 - k) for k in range(levels)]
+
+def _cost(params, over):
+    """ relative cost (collocation points x iterations) of a fidelity vs. full """
+    full = dict(params['problem'], niters=params['training']['niters'])
+    cost = 1.
+    for k, v in over.items():
+        cost *= v / full[k.split('.', 1)[1]]
+    return cost
+
+def get_candidates(pkey, method, params, ncand=27, grid=False, seed=0):
+    """ hyper settings from the `hyper_space` grid or random draws from `search_space` """
+    if grid:
+        return list(dict_product(get_sweep_space(pkey, method)))
+    sampler = TPESampler(get_sweep_space(pkey, method, name='search_space'),
+        n_startup=np.inf, seed=seed)
+    return [sampler.sample(params) for _ in range(ncand)]
+
+def _cells(pkey, method, params, candidates, ids, level, over):
+    seed = params['training']['seed']
+    cells = []
+    for i in ids:
+        hypers = dict(candidates[i], **over)
+        cells.append({'key': cell_key(pkey, method, params, hypers, seed), 'hypers': hypers,
+            'seed': seed, 'candidate': i, 'level': level})
+    return cells
+
+def _scores(records):
+    return {r['candidate']: r.get('final_val_mse', np.inf) for r in records}
+
+def successive_halving(pkey, params, candidates, fname, gan=False, eta=3, levels=3,
+    knobs=KNOBS, **pool_kwargs):
+    """ screen `candidates` at low fidelity and promote the best 1/eta to the next level
+
+        returns [(candidate index, full-fidelity val mse)] best first
+    """
+    method = 'gan' if gan else 'L2'
+    ids = list(range(len(candidates)))
+    cost = 0.
+    for level, scale in enumerate(fidelity_scales(eta, levels)):
+        over = fidelity_overrides(params, scale, knobs)
+        print(f'Level {level}: {len(ids)} candidates at {over}')
+        records = run_cells(pkey, params, _cells(pkey, method, params, candidates, ids, level, over),
+            fname, gan=gan, **pool_kwargs)
+        cost += len(ids) * _cost(params, over)
+        scores = _scores(records)
+        ids = sorted(ids, key=lambda i: scores.get(i, np.inf))
+        if level < levels - 1:
+            ids = ids[:max(1, len(ids) // eta)]
+    print(f'Total cost: {cost:.2f} full runs (vs {len(candidates)} without screening)')
+    return [(i, scores.get(i, np.inf)) for i in ids]
+
+def rank_correlation(pkey, params, candidates, fname, gan=False, eta=3, levels=3,
+    knobs=KNOBS, **pool_kwargs):
+    """ run every candidate at every fidelity and compare rankings with full fidelity
+
+        returns one row per level: spearman / kendall correlation with the
+        full-fidelity val mse and the recall of the full-fidelity top 1/eta
+        among the top 1/eta at that level
+    """
+    from scipy.stats import spearmanr, kendalltau
+
+    method = 'gan' if gan else 'L2'
+    ids = list(range(len(candidates)))
+    scales = fidelity_scales(eta, levels)
+    overs = [fidelity_overrides(params, s, knobs) for s in scales]
+    cells = []
+    for level, over in enumerate(overs):
+        cells += _cells(pkey, method, params, candidates, ids, level, over)
+    records = run_cells(pkey, params, cells, fname, gan=gan, **pool_kwargs)
+    by_level = [_scores([r for r in records if r['level'] == l]) for l in range(levels)]
+
+    full = by_level[-1]
+    k = max(1, len(ids) // eta)
+    top_full = set(sorted(ids, key=lambda i: full.get(i, np.inf))[:k])
+    rows = []
+    for level, (scale, over, scores) in enumerate(zip(scales, overs, by_level)):
+        both = [i for i in ids if np.isfinite(scores.get(i, np.inf)) and np.isfinite(full.get(i, np.inf))]
+        lo, hi = [np.log(scores[i]) for i in both], [np.log(full[i]) for i in both]
+        top = set(sorted(ids, key=lambda i: scores.get(i, np.inf))[:k])
+        rows.append({'level': level, 'scale': scale, 'overrides': over,
+            'cost': _cost(params, over), 'n': len(both),
+            'spearman': float(spearmanr(lo, hi)[0]) if len(both) > 2 else np.nan,
+            'kendall': float(kendalltau(lo, hi)[0]) if len(both) > 2 else np.nan,
+            'top_recall': len(top & top_full) / k})
+    return rows
+
+if __name__ == "__main__":
+    args = argparse.ArgumentParser()
+    args.add_argument('--pkey', type=str, default='EXP',
+        help='problem to run (exp=Exponential, sho=SimpleOscillator, nlo=NonlinearOscillator)')
+    args.add_argument('--classical', action='store_true', default=False,
+        help='whether to use classical training, default False (use GAN))')
+    args.add_argument('--report', action='store_true', default=False,
+        help='run all candidates at all fidelities and report rank correlations')
+    args.add_argument('--ncand', type=int, default=27,
+        help='number of random candidates from `search_space`')
+    args.add_argument('--grid', action='store_true', default=False,
+        help='use the `hyper_space` grid as candidates instead')
+    args.add_argument('--eta', type=int, default=3,
+        help='fidelity ratio between levels and fraction promoted (1/eta)')
+    args.add_argument('--levels', type=int, default=3,
+        help='number of fidelity levels (the last one is the full config)')
+    args.add_argument('--knobs', type=str, nargs='+', default=KNOBS, choices=KNOBS,
+        help='what to scale with fidelity: collocation size (n) and / or niters')
+    args.add_argument('--workers', type=int, default=None,
+        help='number of worker processes, default all CPUs')
+    args.add_argument('--threads', type=int, default=None,
+        help='torch threads per worker, default CPUs / workers')
+    args.add_argument('--seed', type=int, default=0)
+    args.add_argument('--fname', type=str, default=None,
+        help='run records (JSON lines), default {PKEY}_{method}_fidelity.jsonl')
+    args.add_argument('--force', action='store_true', default=False,
+        help='re-run cells even if a cached / recorded result exists')
+    args = args.parse_args()
+
+    gan = not args.classical
+    method = 'gan' if gan else 'L2'
+    fname = args.fname or f'{args.pkey.upper()}_{method}_fidelity.jsonl'
+    params = get_config(args.pkey)
+    candidates = get_candidates(args.pkey, method, params, ncand=args.ncand,
+        grid=args.grid, seed=args.seed)
+    pool_kwargs = dict(workers=args.workers, threads=args.threads, force=args.force)
+
+    if args.report:
+        rows = rank_correlation(args.pkey, params, candidates, fname, gan=gan, eta=args.eta,
+            levels=args.levels, knobs=args.knobs, **pool_kwargs)
+        print(f'Rank correlation with full fidelity ({args.pkey}, {method}, {len(candidates)} candidates)')
+        print('level\tcost\tspearman\tkendall\ttop-1/eta recall\toverrides')
+        for r in rows:
+            print(f"{r['level']}\t{r['cost']:.3f}\t{r['spearman']:.3f}\t{r['kendall']:.3f}"
+                  f"\t{r['top_recall']:.2f}\t{r['overrides']}")
+        report = fname.replace('.jsonl', '') + '_report.json'
+        with open(report, 'w') as f:
+            json.dump(rows, f, indent=1)
+        print(f'Saved report to {report}')
+    else:
+        ranking = successive_halving(args.pkey, params, candidates, fname, gan=gan,
+            eta=args.eta, levels=args.levels, knobs=args.knobs, **pool_kwargs)
+        best, mse = ranking[0]
+        print(f'Best full-fidelity val MSE {mse:.4e} with {candidates[best]}')
@@ -0,0 +1,186 @@
+import numpy as np
+
+# Butcher tableaux of the embedded pairs, in the layout of scipy.integrate:
+# `A`, `B` for the propagated solution, `E` (one extra entry for the FSAL stage
+# f(t + h, y_new)) for the error estimate and `P` for the dense output
+# y(t + x h) = y + h K^T P [x, x^2, ...]
+DOPRI5 = dict(
+    C=np.array([0, 1/5, 3/10, 4/5, 8/9, 1]),
+    A=np.array([
+        [0, 0, 0, 0, 0],
+        [1/5, 0, 0, 0, 0],
+        [3/40, 9/40, 0, 0, 0],
+        [44/45, -56/15, 32/9, 0, 0],
+        [19372/6561, -25360/2187, 64448/6561, -212/729, 0],
+        [9017/3168, -355/33, 46732/5247, 49/176, -5103/18656]]),
+    B=np.array([35/384, 0, 500/1113, 125/192, -2187/6784, 11/84]),
+    E=np.array([-71/57600, 0, 71/16695, -71/1920, 17253/339200, -22/525, 1/40]),
+    P=np.array([
+        [1, -8048581381/2820520608, 8663915743/2820520608, -12715105075/11282082432],
+        [0, 0, 0, 0],
+        [0, 131558114200/32700410799, -68118460800/10900136933, 87487479700/32700410799],
+        [0, -1754552775/470086768, 14199869525/1410260304, -10690763975/1880347072],
+        [0, 127303824393/49829197408, -318862633887/49829197408, 701980252875/199316789632],
+        [0, -282668133/205662961, 2019193451/616988883, -1453857185/822651844],
+        [0, 40617522/29380423, -110615467/29380423, 69997945/29380423]]),
+    order=5, error_order=4)
+
+BS23 = dict(
+    C=np.array([0, 1/2, 3/4]),
+    A=np.array([
+        [0, 0],
+        [1/2, 0],
+        [0, 3/4]]),
+    B=np.array([2/9, 1/3, 4/9]),
+    E=np.array([5/72, -1/12, -1/9, 1/8]),
+    P=np.array([
+        [1, -4/3, 5/9],
+        [0, 1, -2/3],
+        [0, 4/3, -8/9],
+        [0, -1, 1]]),
+    order=3, error_order=2)
+
+EMBEDDED = {'dopri5': DOPRI5, 'bs23': BS23}
+
+# composition weights of leapfrog substeps
+_W1 = 1 / (2 - 2**(1/3))
+SYMPLECTIC = {'leapfrog': [1.], 'yoshida4': [_W1, 1 - 2 * _W1, _W1]}
+
+def _rms(x):
+    return np.sqrt(np.mean(x**2))
+
+def _initial_step(fun, t0, y0, f0, direction, order, rtol, atol):
+    """ starting step size (Hairer, Norsett & Wanner, II.4); one function evaluation """
+    scale = atol + np.abs(y0) * rtol
+    d0, d1 = _rms(y0 / scale), _rms(f0 / scale)
+    h0 = 1e-6 if d0 < 1e-5 or d1 < 1e-5 else 0.01 * d0 / d1
+    f1 = fun(t0 + direction * h0, y0 + direction * h0 * f0)
+    d2 = _rms((f1 - f0) / scale) / h0
+    if d1 <= 1e-15 and d2 <= 1e-15:
+        h1 = max(1e-6, h0 * 1e-3)
+    else:
+        h1 = (0.01 / max(d1, d2))**(1 / (order + 1))
+    return min(100 * h0, h1)
+
+class DenseOutput():
+    """ piecewise polynomial solution of an embedded RK run, callable at any t in tspan """
+    def __init__(self, t_old, h, y_old, Q):
+        self.t_old = np.asarray(t_old)
+        self.h = np.asarray(h)
+        self.y_old = np.asarray(y_old)
+        self.Q = np.asarray(Q) # [segment, component, power]
+
+    def __call__(self, t):
+        t = np.atleast_1d(np.asarray(t, dtype=float))
+        i = np.clip(np.searchsorted(self.t_old, t, side='right') - 1, 0, len(self.t_old) - 1)
+        x = (t - self.t_old[i]) / self.h[i]
+        powers = np.cumprod(np.repeat(x[:, None], self.Q.shape[2], axis=1), axis=1)
+        return self.y_old[i] + self.h[i, None] * np.einsum('nmk,nk->nm', self.Q[i], powers)
+
+def embedded_rk(dydt, tspan, y0, method='dopri5', rtol=1e-6, atol=1e-9, h0=None,
+    max_steps=1000000, dense=True, args=()):
+    """ adaptive integration with an embedded Runge-Kutta pair ('dopri5' or 'bs23')
+
+        the local error estimate (lower-order solution) is kept below
+        atol + rtol |y| in RMS norm; steps are accepted / resized with the
+        standard controller of scipy's RK45 / RK23 (safety 0.9, factor in
+        [0.2, 10], no growth right after a rejection). Returns a dict
+        with the accepted steps `t[k]`, `y[k, m]`, the dense output `sol(t)`
+        (if `dense`) and the cost: `nfev`, `nsteps`, `nreject`.
+    """
+    tab = EMBEDDED[method]
+    C, A, B, E, P = tab['C'], tab['A'], tab['B'], tab['E'], tab['P']
+    exponent = -1 / (tab['error_order'] + 1)
+    n_stages = len(C)
+
+    nfev = [0]
+    def fun(t, y):
+        nfev[0] += 1
+        return np.asarray(dydt(t, y, *args), dtype=float).reshape(y.shape)
+
+    t0, t1 = float(tspan[0]), float(tspan[1])
+    direction = np.sign(t1 - t0) if t1 != t0 else 1.
+    t, y = t0, np.atleast_1d(np.asarray(y0, dtype=float))
+    f = fun(t, y)
+    h = abs(h0) if h0 else _initial_step(fun, t, y, f, direction, tab['error_order'], rtol, atol)
+
+    ts, ys = [t], [y]
+    segments = []
+    K = np.empty((n_stages + 1,) + y.shape)
+    nsteps = nreject = 0
+    rejected = False # the current step was retried: do not grow h when accepting it
+    while direction * (t1 - t) > 0:
+        if nsteps + nreject >= max_steps:
+            raise RuntimeError(f'embedded_rk: no convergence within {max_steps} steps (t={t:.6g})')
+        h = min(h, abs(t1 - t))
+        hs = direction * h
+
+        K[0] = f
+        for s in range(1, n_stages):
+            K[s] = fun(t + C[s] * hs, y + hs * np.tensordot(A[s, :s], K[:s], axes=1))
+        y_new = y + hs * np.tensordot(B, K[:n_stages], axes=1)
+        f_new = fun(t + hs, y_new)
+        K[-1] = f_new
+
+        scale = atol + np.maximum(np.abs(y), np.abs(y_new)) * rtol
+        err = _rms(hs * np.tensordot(E, K, axes=1) / scale)
+        if err < 1:
+            if dense:
+                segments.append((t, hs, y, np.tensordot(K, P, axes=(0, 0))))
+            t = t1 if h == abs(t1 - t) else t + hs
+            y, f = y_new, f_new
+            ts.append(t)
+            ys.append(y)
+            nsteps += 1
+            factor = 10. if err == 0 else min(10., 0.9 * err**exponent)
+            h *= min(1., factor) if rejected else factor
+            rejected = False
+        else:
+            h *= max(0.2, 0.9 * err**exponent)
+            nreject += 1
+            rejected = True
+
+    res = {'t': np.array(ts), 'y': np.array(ys), 'nfev': nfev[0],
+        'nsteps': nsteps, 'nreject': nreject}
+    if dense:
+        res['sol'] = DenseOutput(*zip(*segments)) if segments else None
+    return res
+
+def dopri5(dydt, tspan, y0, rtol=1e-6, atol=1e-9, **kwargs):
+    """ Dormand-Prince 5(4) """
+    return embedded_rk(dydt, tspan, y0, method='dopri5', rtol=rtol, atol=atol, **kwargs)
+
+def bs23(dydt, tspan, y0, rtol=1e-6, atol=1e-9, **kwargs):
+    """ Bogacki-Shampine 3(2) """
+    return embedded_rk(dydt, tspan, y0, method='bs23', rtol=rtol, atol=atol, **kwargs)
+
+def symplectic(dqdt, dpdt, tspan, q0, p0, n, method='leapfrog'):
+    """ fixed-step symplectic integration of q' = dqdt(t, p), p' = dpdt(t, q)
+
+        (separable, possibly time-dependent Hamiltonian). 'leapfrog' is
+        kick-drift-kick velocity Verlet (order 2), 'yoshida4' its order 4
+        triple-jump composition. The last force evaluation of a step is reused
+        by the next one. Returns `t[n+1]`, `q[n+1, m]`, `p[n+1, m]` and `nfev`.
+    """
+    weights = SYMPLECTIC[method]
+    t0, t1 = float(tspan[0]), float(tspan[1])
+    h = (t1 - t0) / n
+    q = np.atleast_1d(np.asarray(q0, dtype=float))
+    p = np.atleast_1d(np.asarray(p0, dtype=float))
+    qs, ps = [q], [p]
+
+    a = np.asarray(dpdt(t0, q), dtype=float)
+    nfev = 1
+    for i in range(n):
+        t = t0 + i * h
+        for w in weights:
+            hw = w * h
+            p = p + hw / 2 * a
+            q = q + hw * np.asarray(dqdt(t + hw / 2, p), dtype=float)
+            t = t + hw
+            a = np.asarray(dpdt(t, q), dtype=float)
+            p = p + hw / 2 * a
+            nfev += 2
+        qs.append(q)
+        ps.append(p)
+    return {'t': t0 + h * np.arange(n + 1), 'q': np.array(qs), 'p': np.array(ps), 'nfev': nfev}
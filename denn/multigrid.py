@@ -0,0 +1,173 @@
+import time
+from itertools import product
+import numpy as np
+from scipy import sparse
+from scipy.sparse.linalg import splu
+
+# multigrid for -Laplace(u) = f on the interior points of a uniform grid of a
+# box (any dimension) with Dirichlet boundaries; boundary values enter through
+# f, as in fd.py. Arrays hold the interior points only, axis a has spacing h[a].
+
+def laplacian(shape, h):
+    """ sparse -Laplacian of the interior points (C order, last axis fastest) """
+    mat = 0
+    for a, (n, ha) in enumerate(zip(shape, h)):
+        T = sparse.diags([2 * np.ones(n), -np.ones(n-1), -np.ones(n-1)], [0, -1, 1]) / ha**2
+        factors = [sparse.identity(m) for m in shape]
+        factors[a] = T
+        K = factors[0]
+        for F in factors[1:]:
+            K = sparse.kron(K, F, format='csr')
+        mat = mat + K
+    return sparse.csr_matrix(mat)
+
+def apply_laplacian(u, h):
+    """ matrix-free -Laplacian (2d+1 point stencil) with zero boundary values """
+    p = np.pad(u, 1)
+    out = np.zeros_like(u)
+    inner = [slice(1, -1)] * u.ndim
+    for a, ha in enumerate(h):
+        lo, hi = list(inner), list(inner)
+        lo[a], hi[a] = slice(0, -2), slice(2, None)
+        out += (2 * u - p[tuple(lo)] - p[tuple(hi)]) / ha**2
+    return out
+
+def interpolation(n_fine, n_coarse):
+    """ linear interpolation from `n_coarse` to `n_fine` interior points of the
+        same interval, as a sparse (n_fine, n_coarse) matrix
+
+        for n_fine = 2 n_coarse + 1 the grids are nested (standard coarsening);
+        otherwise the coarse points are interpolated at the fine positions
+    """
+    s = np.arange(1, n_fine + 1) * (n_coarse + 1) / (n_fine + 1) # fine points in coarse index units
+    j = np.floor(s + 1e-12).astype(int)
+    w = np.clip(s - j, 0, 1)
+    rows = np.tile(np.arange(n_fine), 2)
+    cols = np.concatenate([j, j + 1])
+    vals = np.concatenate([1 - w, w])
+    keep = (cols >= 1) & (cols <= n_coarse) & (vals > 1e-12) # boundary values are zero
+    return sparse.csr_matrix((vals[keep], (rows[keep], cols[keep] - 1)), shape=(n_fine, n_coarse))
+
+def _along(mat, u, axis):
+    """ apply `mat` to axis `axis` of `u` """
+    v = np.moveaxis(u, axis, 0)
+    out = mat @ v.reshape(v.shape[0], -1)
+    return np.moveaxis(out.reshape((mat.shape[0],) + v.shape[1:]), 0, axis)
+
+def _coarsen(n):
+    if n < 3:
+        return n
+    return (n - 1) // 2 if n % 2 else n // 2
+
+CYCLES = {'V': 1, 'W': 2}
+SMOOTHERS = ['jacobi', 'rbgs']
+
+class Multigrid():
+    """ geometric multigrid solver, O(N) work and memory per cycle
+
+        The hierarchy halves every axis (nested grids for 2^k - 1 interior
+        points, linear interpolation between non-nested ones otherwise) down to
+        `coarse_size` unknowns, which are solved with a sparse LU. Transfers are
+        linear interpolation and its (full weighting) transpose, the coarse
+        operators are rediscretized. `smoother` is weighted Jacobi (`omega`,
+        default 2d/(2d+1)) or red-black Gauss-Seidel, with `nu1` / `nu2` pre- /
+        post-smoothing sweeps; `cycle` is 'V' or 'W'.
+    """
+    def __init__(self, shape, h, cycle='V', smoother='rbgs', nu1=2, nu2=2, omega=None,
+        coarse_size=1024):
+        if cycle not in CYCLES:
+            raise ValueError(f'Unknown cycle {cycle}, use one of {list(CYCLES)}')
+        if smoother not in SMOOTHERS:
+            raise ValueError(f'Unknown smoother {smoother}, use one of {SMOOTHERS}')
+        self.cycle = cycle
+        self.smoother = smoother
+        self.nu1, self.nu2 = nu1, nu2
+        self.omega = omega or 2 * len(shape) / (2 * len(shape) + 1)
+
+        shape, h = tuple(shape), tuple(float(x) for x in h)
+        lengths = [ha * (n + 1) for n, ha in zip(shape, h)]
+        self.levels = []
+        while True:
+            level = {'shape': shape, 'h': h, 'diag': sum(2 / ha**2 for ha in h)}
+            self.levels.append(level)
+            coarse = tuple(_coarsen(n) for n in shape)
+            if np.prod(shape) <= coarse_size or coarse == shape:
+                break
+            level['P'] = [interpolation(n, nc) for n, nc in zip(shape, coarse)]
+            level['R'] = [sparse.diags(1 / np.asarray(P.sum(axis=0)).ravel()) @ P.T.tocsr()
+                for P in level['P']]
+            shape = coarse
+            h = tuple(L / (n + 1) for L, n in zip(lengths, shape))
+        self.levels[-1]['lu'] = splu(laplacian(shape, h).tocsc())
+
+    def smooth(self, level, u, f, sweeps):
+        lvl = self.levels[level]
+        h, d = lvl['h'], lvl['diag']
+        if self.smoother == 'jacobi':
+            for _ in range(sweeps):
+                u = u + self.omega * (f - apply_laplacian(u, h)) / d
+            return u
+
+        # red-black Gauss-Seidel, in place on the padded array: the points of
+        # one colour are the 2^(d-1) stride-2 sublattices with that index parity
+        p = np.pad(u, 1)
+        n = u.shape
+        offsets = list(product([0, 1], repeat=u.ndim))
+        for _ in range(sweeps):
+            for colour in [0, 1]:
+                for o in offsets:
+                    if sum(o) % 2 != colour:
+                        continue
+                    sub = tuple(slice(1 + oa, na + 1, 2) for oa, na in zip(o, n))
+                    val = f[tuple(slice(oa, None, 2) for oa in o)].copy()
+                    for a, ha in enumerate(h):
+                        lo, hi = list(sub), list(sub)
+                        lo[a] = slice(o[a], n[a], 2)
+                        hi[a] = slice(2 + o[a], n[a] + 2, 2)
+                        val += (p[tuple(lo)] + p[tuple(hi)]) / ha**2
+                    p[sub] = val / d
+        return p[(slice(1, -1),) * u.ndim]
+
+    def restrict(self, level, r):
+        for a, R in enumerate(self.levels[level]['R']):
+            r = _along(R, r, a)
+        return r
+
+    def prolong(self, level, e):
+        for a, P in enumerate(self.levels[level]['P']):
+            e = _along(P, e, a)
+        return e
+
+    def _cycle(self, level, u, f):
+        lvl = self.levels[level]
+        if 'lu' in lvl:
+            return lvl['lu'].solve(f.ravel()).reshape(f.shape)
+        u = self.smooth(level, u, f, self.nu1)
+        rc = self.restrict(level, f - apply_laplacian(u, lvl['h']))
+        ec = np.zeros_like(rc)
+        for _ in range(CYCLES[self.cycle]):
+            ec = self._cycle(level + 1, ec, rc)
+        u = u + self.prolong(level, ec)
+        return self.smooth(level, u, f, self.nu2)
+
+    def solve(self, f, u0=None, tol=1e-10, maxiter=100, verbose=False):
+        """ cycles until ||f - A u|| <= tol ||f||; returns u and a dict with the
+            residual history, number of cycles, mean convergence factor and time
+        """
+        t0 = time.perf_counter()
+        f = np.asarray(f, dtype=float).reshape(self.levels[0]['shape'])
+        u = np.zeros_like(f) if u0 is None else np.array(u0, dtype=float).reshape(f.shape)
+        h = self.levels[0]['h']
+        norm_f = np.linalg.norm(f) or 1.
+        res = [np.linalg.norm(f - apply_laplacian(u, h)) / norm_f]
+        while res[-1] > tol and len(res) <= maxiter:
+            u = self._cycle(0, u, f)
+            res.append(np.linalg.norm(f - apply_laplacian(u, h)) / norm_f)
+            if verbose:
+                print(f'{self.cycle}-cycle {len(res) - 1}: relative residual {res[-1]:.3e} '
+                      f'(factor {res[-1] / res[-2]:.3f})')
+        cycles = len(res) - 1
+        info = {'residuals': res, 'cycles': cycles, 'converged': res[-1] <= tol,
+            'factor': (res[-1] / res[0])**(1 / cycles) if cycles and res[0] > 0 else 0.,
+            'levels': len(self.levels), 'seconds': time.perf_counter() - t0}
+        return u, info
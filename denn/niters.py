@@ -1,133 +1,41 @@
-import pandas as pd
-import multiprocessing as mp
-import numpy as np
 import argparse
 
-from denn.experiments import gan_experiment, L2_experiment, get_problem
-import denn.config as cfg
-from denn.utils import handle_overwrite, dict_product
-
-def gan_exp_with_seed(i, q, gen_kwargs, disc_kwargs, gan_kwargs):
-    res = gan_experiment(
-        problem = _PROBLEM,
-        seed = i,
-        gen_kwargs = gen_kwargs,
-        disc_kwargs = disc_kwargs,
-        train_kwargs = gan_kwargs,
-    )
-    q.put(res['final_mse'])
-
-def gan_exp_with_hypers(hypers):
-    """
-    take hypers dict and map values onto appropriate kwargs dict
-    to run gan_experiment
-    """
-    disc_kwargs = cfg.disc_kwargs
-    gan_kwargs = cfg.gan_kwargs
-    gen_kwargs = cfg.gen_kwargs
-
-    gan_kwargs['plot'] = False # ensure plotting is off
-
-    for k, v in hypers.items():
-        if k.startswith('gan_'):
-            gan_kwargs[k.replace('gan_', '')] = v
-        elif k.startswith('gen_'):
-            gen_kwargs[k.replace('gen_', '')] = v
-        elif k.startswith('disc_'):
-            disc_kwargs[k.replace('disc_', '')] = v
-
-    q = mp.Queue()
-
-    procs = []
-    for i in range(_N_REPS):
-        p = mp.Process(target=gan_exp_with_seed, args=(i, q, gen_kwargs, disc_kwargs, gan_kwargs))
-        p.start()
-        procs.append(p)
-
-    for p in procs:
-        p.join()   
-
-    reps = []
-    while not q.empty():
-        reps.append(q.get())
-
-    res = {'mse': reps, 'hypers': hypers}
-    print(f'Result: {res}')
-    return res
-
-def L2_exp_with_seed(i, q, model_kwargs, train_kwargs):
-    res = L2_experiment(
-        problem = _PROBLEM,
-        seed = i,
-        model_kwargs = model_kwargs,
-        train_kwargs = train_kwargs,
-    )
-    q.put(res['final_mse'])
-
-def L2_exp_with_hypers(hypers):
-    """
-    take hypers dict and map values onto appropriate kwargs dict
-    to run gan_experiment
-    """
-    model_kwargs = cfg.L2_mlp_kwargs
-    train_kwargs = cfg.L2_kwargs
-
-    train_kwargs['plot'] = False # ensure plotting is off
-
-    for k, v in hypers.items():
-        if k.startswith('model_'):
-            model_kwargs[k.replace('model_', '')] = v
-        elif k.startswith('train_'):
-            train_kwargs[k.replace('train_', '')] = v
-
-    q = mp.Queue()
-
-    procs = []
-    for i in range(_N_REPS):
-        p = mp.Process(target=L2_exp_with_seed, args=(i, q, model_kwargs, train_kwargs))
-        p.start()
-        procs.append(p)
-
-    for p in procs:
-        p.join()
-
-    reps = []
-    while not q.empty():
-        reps.append(q.get())
-
-    res = {'mse': reps, 'hypers': hypers}
-    print(f'Result: {res}')
-    return res
-
-def get_niters(pkey, gan):
-    name = 'gan' if gan else 'L2'
-    name = name + '_' + pkey
-    return eval('cfg.' + name + '_niters')
+from denn.config.config import get_config, get_sweep_space
+from denn.sweep import run_sweep, summarize
 
 if __name__== "__main__":
     args = argparse.ArgumentParser()
     args.add_argument('--gan', action='store_true', default=False,
         help='whether to use GAN-based training, default False (use L2-based)')
-    args.add_argument('--fname', type=str, default='SHO_hypertune.csv',
-        help='path to save results of replications')
+    args.add_argument('--fname', type=str, default=None,
+        help='results file (JSON lines), default {PKEY}_{method}_niters.jsonl; '
+             'an existing file is resumed')
     args.add_argument('--nreps', type=int, default=20,
         help='number of replications to run')
     args.add_argument('--pkey', type=str, default='sho',
         help='problem key as a string')
+    args.add_argument('--workers', type=int, default=None,
+        help='number of worker processes, default all CPUs')
+    args.add_argument('--threads', type=int, default=None,
+        help='torch threads per worker, default CPUs / workers')
+    args.add_argument('--retries', type=int, default=1,
+        help='times to re-run a failed seed before recording it as failed')
+    args.add_argument('--force', action='store_true', default=False,
+        help='re-run seeds even if a cached / recorded result exists')
     args = args.parse_args()
 
-    _N_REPS = args.nreps
-    _PROBLEM = get_problem(args.pkey)
-
-    handle_overwrite(args.fname)
-
-    hyper_space = get_niters(args.pkey, args.gan)
-    hyper_space = dict_product(hyper_space)
-
-    if args.gan:
-        results = map(gan_exp_with_hypers, hyper_space)
-    else:
-        results = map(L2_exp_with_hypers, hyper_space)
-
-    pd.DataFrame().from_records(results).to_csv(args.fname)
-    print(f'Saved results to {args.fname}')
+    method = 'gan' if args.gan else 'L2'
+    fname = args.fname or f'{args.pkey.upper()}_{method}_niters.jsonl'
+    params = get_config(args.pkey)
+    niters_space = get_sweep_space(args.pkey, method, name='niters_space')
+
+    records = run_sweep(args.pkey, params, niters_space, fname, gan=args.gan,
+        nreps=args.nreps, workers=args.workers, threads=args.threads,
+        force=args.force, retries=args.retries)
+    print(f'Saved results to {fname}')
+
+    failed = [r for r in records if r['status'] == 'failed']
+    for r in failed:
+        print(f"Failed seed {r['seed']} {r['hypers']}: {r.get('error')}")
+    for row in sorted(summarize(records), key=lambda r: r['hypers']['training.niters']):
+        print(f"{row['hypers']}: {row['mean']:.4e} +/- {row['std']:.1e} (n={row['n']})")
@@ -0,0 +1,155 @@
+import json
+import time
+import argparse
+import multiprocessing as mp
+from copy import deepcopy
+import numpy as np
+import torch
+
+from denn.config.config import get_config
+from denn.sweep import _init_worker as _init_sweep_worker, _WORKER, shared_problem
+from denn.asha import LR_BOUND, BETA_BOUND
+
+# hyperparameters mutated by PBT (applied in place to the optimizers)
+HYPERS = ['g_lr', 'd_lr', 'g_betas', 'd_betas']
+
+def sample_hypers(rng):
+    """ initial hypers from the search space of ray_tune.py """
+    return {
+        'g_lr': float(rng.uniform(*LR_BOUND)),
+        'd_lr': float(rng.uniform(*LR_BOUND)),
+        'g_betas': rng.uniform(*BETA_BOUND, size=2).tolist(),
+        'd_betas': rng.uniform(*BETA_BOUND, size=2).tolist(),
+    }
+
+def perturb_hypers(hypers, rng, factors=(0.8, 1.2), resample_prob=0.25):
+    """ PBT explore: resample each hyper with `resample_prob`, else scale it by a random factor """
+    fresh = sample_hypers(rng)
+    new = {}
+    for k, v in hypers.items():
+        if rng.uniform() < resample_prob:
+            new[k] = fresh[k]
+        elif k.endswith('_lr'):
+            new[k] = float(np.clip(v * rng.choice(factors), *LR_BOUND))
+        else:
+            new[k] = np.clip(np.asarray(v) * rng.choice(factors, size=2), *BETA_BOUND).tolist()
+    return new
+
+def _init_worker(threads, pkey, params, problem):
+    _init_sweep_worker(threads, pkey, params, True, False, problem)
+
+def _train_member(member):
+    """ train one member for `member['steps']` steps from its (cloned) state
+
+        never raises: a failed member keeps its state and gets score inf
+    """
+    from denn.models import MLP
+    from denn.algos import train_GAN, train_GAN_2D
+
+    pkey, params = _WORKER['pkey'], _WORKER['params']
+    t0 = time.time()
+    try:
+        torch.manual_seed(0)
+        G = MLP(**params['generator'])
+        D = MLP(**params['discriminator'])
+        torch.manual_seed(member['seed'])
+        np.random.seed(member['seed'])
+
+        training = dict(params['training'], **member['hypers'])
+        training.update(niters=member['steps'], log=False, plot=False, save=False)
+        train = train_GAN_2D if pkey.lower().strip() == 'pos' else train_GAN
+        res = train(G, D, _WORKER['problem'], **training, state=member['state'],
+            return_state=True)
+    except Exception as e:
+        return dict(member, status='failed', error=repr(e), seconds=time.time() - t0,
+            score=np.inf)
+    val = res['mses']['val']
+    return dict(member, state=res['state'], status='finished', seconds=time.time() - t0,
+        score=float(np.mean(val[-10:])), final_val_mse=float(val[-1]))
+
+def exploit_explore(members, rng, quantile=0.25):
+    """ members sorted by score (best first): the bottom `quantile` copy the state
+        and hypers of a random finished member of the top `quantile` and perturb
+        the hypers (in place) """
+    n = max(1, int(len(members) * quantile))
+    top = [m for m in members[:n] if m.get('status') == 'finished']
+    if not top:
+        return members
+    for m in members[-n:]:
+        src = top[rng.randint(len(top))]
+        if m is src:
+            continue
+        m['state'] = deepcopy(src['state'])
+        m['hypers'] = perturb_hypers(src['hypers'], rng)
+        m['parent'] = src['id']
+    return members
+
+def run_pbt(pkey, params, fname, population=8, interval=None, quantile=0.25,
+    workers=None, threads=None, seed=0):
+    """ population based training of GAN lrs / betas
+
+        Every member trains for `interval` steps (default niters/20); members in
+        the bottom `quantile` then copy G/D/optimizer state and hypers from a
+        random member of the top `quantile` and perturb the hypers. The total
+        budget is `population` x niters steps. Member records of every
+        generation are appended to `fname` (JSON lines); members that fail
+        are recorded with status 'failed' and rank last (score inf).
+    """
+    niters = params['training']['niters']
+    interval = interval or max(10, niters // 20)
+    workers = max(1, min(workers or mp.cpu_count(), population))
+    threads = threads or max(1, mp.cpu_count() // workers)
+    rng = np.random.RandomState(seed)
+
+    members = [{'id': i, 'hypers': sample_hypers(rng), 'state': None, 'parent': None}
+        for i in range(population)]
+    n_gens = int(np.ceil(niters / interval))
+    with open(fname, 'a') as f, mp.Pool(workers, initializer=_init_worker,
+        initargs=(threads, pkey, params, shared_problem(pkey, params))) as pool:
+        for gen in range(n_gens):
+            steps = min(interval, niters - gen * interval)
+            for m in members:
+                m.update(generation=gen, steps=steps, seed=seed + gen * population + m['id'])
+            members = sorted(pool.map(_train_member, members), key=lambda m: m['score'])
+            for m in members:
+                rec = {k: v for k, v in m.items() if k != 'state'}
+                f.write(json.dumps(rec, default=str) + '\n')
+            f.flush()
+            failed = sum(m['status'] == 'failed' for m in members)
+            print(f"Generation {gen}: best {members[0]['score']:.4e} (member {members[0]['id']}) "
+                  f"| worst {members[-1]['score']:.4e}" + (f' | {failed} failed' if failed else ''))
+            if gen == n_gens - 1:
+                break
+            exploit_explore(members, rng, quantile)
+    return members
+
+if __name__ == "__main__":
+    args = argparse.ArgumentParser()
+    args.add_argument('--pkey', type=str, default='EXP',
+        help='problem to run (exp=Exponential, sho=SimpleOscillator, nlo=NonlinearOscillator)')
+    args.add_argument('--population', type=int, default=8,
+        help='number of concurrently trained members')
+    args.add_argument('--interval', type=int, default=None,
+        help='steps between exploit / explore, default niters/20')
+    args.add_argument('--quantile', type=float, default=0.25,
+        help='fraction of members replaced (and copied from) each generation')
+    args.add_argument('--workers', type=int, default=None,
+        help='number of worker processes, default min(CPUs, population)')
+    args.add_argument('--threads', type=int, default=None,
+        help='torch threads per worker, default CPUs / workers')
+    args.add_argument('--seed', type=int, default=0)
+    args.add_argument('--fname', type=str, default=None,
+        help='member records (JSON lines), default {PKEY}_gan_pbt.jsonl')
+    args = args.parse_args()
+
+    fname = args.fname or f'{args.pkey.upper()}_gan_pbt.jsonl'
+    members = run_pbt(args.pkey, get_config(args.pkey), fname, population=args.population,
+        interval=args.interval, quantile=args.quantile, workers=args.workers,
+        threads=args.threads, seed=args.seed)
+
+    best = members[0]
+    if best['status'] == 'failed':
+        raise SystemExit(f"All members failed, e.g. {best['error']}")
+    print(f"Best member {best['id']}: final val MSE {best['final_val_mse']:.4e}")
+    print('Final hypers:', best['hypers'])
+    print(f'Hyper schedules saved to {fname}')
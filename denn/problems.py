@@ -1,8 +1,6 @@
 import numpy as np
 import torch
-from scipy.integrate import odeint, solve_ivp
-from denn.utils import diff
-from denn.rans.numerical import solve_rans_scipy_solve_bvp
+from denn.utils import diff, meshgrid_ij
 import os
 
 _THIS_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -59,6 +57,22 @@ class Problem():
         """
         raise NotImplementedError()
 
+    def share_memory(self):
+        """ move tensor state (grids, cached reference solutions) to shared memory
+
+            call once in a parent process (after any expensive setup) and pass
+            the problem to workers: tensors are then sent as shared-memory
+            handles instead of being copied or recomputed per process
+        """
+        for k, v in vars(self).items():
+            if torch.is_tensor(v):
+                setattr(self, k, _shared(v))
+        return self
+
+def _shared(t):
+    """ shared-memory copy of `t` (a leaf that keeps `requires_grad`) """
+    return t.detach().clone().share_memory_().requires_grad_(t.requires_grad)
+
 class Exponential(Problem):
     """
     Equation:
@@ -192,14 +206,18 @@ class NonlinearOscillator(Problem):
 
     $$ \ddot{x} + 2 \beta \dot{x} + \omega^{2} x + \phi x^{2} + \epsilon x^{3} = f(t) $$
     """
-    def __init__(self, t_min = 0, t_max = 4 * np.pi, dx_dt0 = 1., **kwargs):
+    def __init__(self, t_min = 0, t_max = 4 * np.pi, dx_dt0 = 1., reference = 'spectral', **kwargs):
         """
         inputs:
             - t_min: start time
             - t_max: end time
             - dx_dt0: initial condition on dx_dt
+            - reference: reference solution, 'spectral' (Chebyshev collocation,
+              denn.spectral) or 'ivp' (solve_ivp with 1e-8 tolerances)
             - kwargs: keyword args passed to Problem.__init__()
         """
+        if reference not in ['spectral', 'ivp']:
+            raise ValueError(f'Unknown reference {reference}, use spectral or ivp')
         super().__init__(**kwargs)
 
         # ======
@@ -225,17 +243,8 @@ class NonlinearOscillator(Problem):
             requires_grad=True
         ).reshape(-1, 1)
         self.spacing = self.grid[1, 0] - self.grid[0, 0]
-
-        atol = 1e-8
-        rtol = 1e-8
-        self.sol = solve_ivp(
-            self._nlo_system,
-            t_span=(t_min, t_max),
-            y0=[self.x0, self.dx_dt0],
-            dense_output=True,
-            atol=atol,
-            rtol=rtol,
-        )
+        self.reference = reference
+        self._ref = None # reference solution (interpolant), solved on first use
 
     def get_grid(self):
         return self.grid
@@ -243,8 +252,14 @@ class NonlinearOscillator(Problem):
     def get_grid_sample(self):
         return self.sample_grid(self.grid, self.spacing)
 
-    def get_solution(self, t, atol=1e-8, rtol=1e-8):
-        """ uses scipy to solve NLO """
+    def share_memory(self):
+        # solve the reference once here so workers only evaluate the interpolant
+        self.get_solution(self.grid)
+        return super().share_memory()
+
+    def get_solution(self, t):
+        """ reference solution @ t (spectral interpolant or solve_ivp dense output),
+            solved on first use """
         try:
             t = t.detach().numpy() # if torch tensor, convert to numpy
         except:
@@ -252,8 +267,22 @@ class NonlinearOscillator(Problem):
 
         t = t.reshape(-1)
 
-        sol = self.sol.sol(t)
-        return torch.tensor(sol[0,:], dtype=torch.float).reshape(-1, 1)
+        if self._ref is None and self.reference == 'spectral':
+            from denn.spectral import nlo_reference
+            self._ref = nlo_reference(self.t_min, self.t_max, self.x0, self.dx_dt0,
+                beta=self.beta, omega=self.omega, phi=self.phi, epsilon=self.epsilon)
+        elif self._ref is None:
+            from scipy.integrate import solve_ivp
+            self._ref = solve_ivp(
+                self._nlo_system,
+                t_span=(self.t_min, self.t_max),
+                y0=[self.x0, self.dx_dt0],
+                dense_output=True,
+                atol=1e-8,
+                rtol=1e-8,
+            ).sol
+        sol = self._ref(t) if self.reference == 'spectral' else self._ref(t)[0,:]
+        return torch.tensor(sol, dtype=torch.float).reshape(-1, 1)
 
     def _nlo_system(self, t, z):
         """ NLO decomposed as system of first order equations """
@@ -291,14 +320,19 @@ class ReynoldsAveragedNavierStokes(Problem):
     RANS Equations for 1-Dimensional Channel Flow
     """
     def __init__(self, ymin = -1, ymax = 1, bc = [0, 0],
-        kappa=0.41/4, rho=1.0, nu=0.0055555555, dp_dx = -1,
-        **kwargs):
+        kappa=0.41/4, rho=1.0, nu=0.0055555555, dp_dx = -1, reference = 'spectral',
+        max_nodes=100000, tol=1e-3, **kwargs):
         """
         ymin - min y-coordinate
         ymax - max y-coordinate
         bc - boundary condation as [u(ymin), y(ymax)]
+        reference - reference solution, 'spectral' (Chebyshev collocation,
+            denn.spectral) or 'bvp' (solve_bvp by continuation, denn.rans.numerical)
+        max_nodes, tol - solve_bvp options of the 'bvp' reference
         kwargs - keyword args passed to `Problem`
         """
+        if reference not in ['spectral', 'bvp']:
+            raise ValueError(f'Unknown reference {reference}, use spectral or bvp')
         super().__init__(**kwargs)
         self.ymin = ymin
         self.ymax = ymax
@@ -316,6 +350,10 @@ class ReynoldsAveragedNavierStokes(Problem):
             requires_grad=True
         ).reshape(-1, 1)
         self.spacing = self.grid[1, 0] - self.grid[0, 0]
+        self.reference = reference
+        self.max_nodes = max_nodes
+        self.tol = tol
+        self._ref = None # reference solution (interpolant), solved on first use
 
     def get_grid(self):
         return self.grid
@@ -323,7 +361,19 @@ class ReynoldsAveragedNavierStokes(Problem):
     def get_grid_sample(self):
         return self.sample_grid(self.grid, self.spacing)
 
-    def get_solution(self, y, max_nodes=1000, tol=1e-3):
+    def share_memory(self):
+        # solve the reference once here so workers only evaluate the interpolant
+        self.get_solution(self.grid)
+        return super().share_memory()
+
+    def get_solution(self, y):
+        """ reference solution at `y`, solved on first use
+
+            'spectral': Chebyshev collocation interpolant (denn.spectral), exact
+            at any y. 'bvp': interpolated from a bvp solve on the base grid,
+            cached in memory and reached by continuation in Re_tau (see
+            denn.rans.numerical.rans_reference), so high Re_tau converges too
+        """
         try:
             y = y.detach().numpy() # if torch tensor, convert to numpy
         except:
@@ -331,9 +381,17 @@ class ReynoldsAveragedNavierStokes(Problem):
 
         y = y.reshape(-1)
 
-        res = solve_rans_scipy_solve_bvp(y, k=self.kappa, nu=self.nu, rho=self.rho,
-            dpdx=self.dp_dx, delta=self.delta, max_nodes=max_nodes, tol=tol)
-        soln = res.sol(y)[0]
+        if self._ref is None and self.reference == 'spectral':
+            from denn.spectral import rans_channel_reference
+            self._ref = rans_channel_reference(k=self.kappa, nu=self.nu, rho=self.rho,
+                dpdx=self.dp_dx, delta=self.delta, ymin=self.ymin, ymax=self.ymax)
+        elif self._ref is None:
+            from denn.rans.numerical import rans_reference, reference_sol
+            retau = np.sqrt(-self.delta * self.dp_dx / self.rho) * self.delta / self.nu
+            self._ref = reference_sol(rans_reference(retau, k=self.kappa, rho=self.rho,
+                dpdx=self.dp_dx, delta=self.delta, ymin=self.ymin, ymax=self.ymax, tol=self.tol,
+                max_nodes=self.max_nodes, n=self.n, cache_dir=None))
+        soln = self._ref(y) if self.reference == 'spectral' else self._ref(y)[0]
         return torch.tensor(soln, dtype=torch.float).reshape(-1,1)
 
     def _reynolds_stress(self, y, du_dy):
@@ -426,7 +484,7 @@ class PoissonEquation(Problem):
         xgrid = torch.linspace(xmin, xmax, nx, requires_grad=True)
         ygrid = torch.linspace(ymin, ymax, ny, requires_grad=True)
 
-        grid_x, grid_y = torch.meshgrid(xgrid, ygrid)
+        grid_x, grid_y = meshgrid_ij(xgrid, ygrid)
         self.grid_x, self.grid_y = grid_x.reshape(-1,1), grid_y.reshape(-1,1)
 
     def get_grid(self):
@@ -517,6 +575,7 @@ class SIRModel(Problem):
         ).reshape(-1, 1)
         self.spacing = self.grid[1, 0] - self.grid[0, 0]
 
+        from scipy.integrate import solve_ivp
         atol = 1e-8
         rtol = 1e-8
         self.sol = solve_ivp(
@@ -2,7 +2,7 @@ import argparse
 import numpy as np
 
 from denn.config.config import get_config
-from denn.experiments import gan_experiment, L2_experiment
+from denn.experiments import run_experiment
 from denn.utils import handle_overwrite
 
 import multiprocessing as mp
@@ -17,6 +17,8 @@ if __name__ == '__main__':
         help='number of random seeds to try')
     args.add_argument('--fname', type=str, default='rand_reps',
         help='file to save numpy results of MSEs')
+    args.add_argument('--force', action='store_true', default=False,
+        help='re-run seeds even if a cached result exists')
     args = args.parse_args()
 
     handle_overwrite(args.fname)
@@ -43,10 +45,11 @@ if __name__ == '__main__':
 
         if args.gan:
             print(f'Running GAN training for {args.pkey} problem...')
-            res = gan_experiment(args.pkey, params)
         else:
             print(f'Running classical training for {args.pkey} problem...')
-            res = L2_experiment(args.pkey, params)
+        res = run_experiment(args.pkey, params, gan=args.gan, force=args.force)
+        if res['cached']:
+            print('Using cached result')
 
         results.append(res['mses']['val'])
 
@@ -1,11 +1,18 @@
-import denn.rans.channel_flow as chan
-import matplotlib.pyplot as plt
+import os
+import time
+import hashlib
 import numpy as np
 from scipy.integrate import solve_bvp
+from scipy.interpolate import CubicHermiteSpline
+from scipy.linalg import solve_banded
 
 def solve_rans_scipy_solve_bvp(y, k=0.41/4, nu=0.0055555555, rho=1,
-    dpdx=-1, max_nodes=1000, tol=1e-3, delta=1):
-    """ use scipy solve_bvp to solve RANS equation """
+    dpdx=-1, max_nodes=1000, tol=1e-3, delta=1, u0=None):
+    """ use scipy solve_bvp to solve RANS equation
+
+        `y` is the initial mesh and `u0` the initial guess of [u, du/dy] on it
+        (default zeros)
+    """
 
     def fun(y, u):
         """ solves the equation as system
@@ -23,140 +30,234 @@ def solve_rans_scipy_solve_bvp(y, k=0.41/4, nu=0.0055555555, rho=1,
         """ boundary residuals (just zero) """
         return np.array([ua[0], ub[0]])
 
-    u0 = np.zeros((2, y.size))
+    u0 = np.zeros((2, y.size)) if u0 is None else u0
     return solve_bvp(fun, bc, y, u0, max_nodes=max_nodes, tol=tol)
 
 # ===========================
-# Things below this line are
-# highly suspect and should
-# not be trusted.
+# continuation over (Re_tau, k)
+# ===========================
+
+RANS_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../experiments/cache/rans')
+_REFS = {} # in-memory cache: key -> reference dict
+
+def retau_to_nu(retau, rho=1, dpdx=-1, delta=1):
+    """ viscosity giving friction Reynolds number u_tau delta / nu = `retau` """
+    return np.sqrt(-delta * dpdx / rho) * delta / retau
+
+def _ref_key(retau, k, rho, dpdx, delta, ymin, ymax, tol):
+    s = repr(tuple(float(v) for v in (retau, k, rho, dpdx, delta, ymin, ymax, tol)))
+    return hashlib.sha1(s.encode()).hexdigest()
+
+def reference_sol(ref):
+    """ interpolant u(y), u'(y) of a reference (the cubic spline of solve_bvp's `sol`) """
+    return CubicHermiteSpline(ref['x'], ref['y'], ref['yp'], axis=1)
+
+def _load_ref(key, cache_dir):
+    if key in _REFS:
+        return _REFS[key]
+    path = os.path.join(cache_dir, f'{key}.npz') if cache_dir else None
+    if path and os.path.exists(path):
+        with np.load(path) as f:
+            _REFS[key] = {k: f[k] for k in f.files}
+        return _REFS[key]
+    return None
+
+def _save_ref(key, ref, cache_dir):
+    _REFS[key] = ref
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+        path = os.path.join(cache_dir, f'{key}.npz')
+        tmp = f'{path}.{os.getpid()}.tmp.npz'
+        np.savez(tmp, **ref)
+        os.replace(tmp, path)
+
+def _solve_ref(retau, k, rho, dpdx, delta, x, u0, tol, max_nodes):
+    t0 = time.perf_counter()
+    res = solve_rans_scipy_solve_bvp(x, k=k, nu=retau_to_nu(retau, rho, dpdx, delta), rho=rho,
+        dpdx=dpdx, delta=delta, max_nodes=max_nodes, tol=tol, u0=u0)
+    return {'retau': retau, 'k': k, 'x': res.x, 'y': res.y, 'yp': res.yp,
+        'status': res.status, 'seconds': time.perf_counter() - t0}
+
+def continuation(points, rho=1, dpdx=-1, delta=1, ymin=-1, ymax=1, n=1000, tol=1e-3,
+    max_nodes=100000, start=None, cache_dir=RANS_CACHE_DIR, max_halvings=8, verbose=False):
+    """ solve_bvp references along a path of (Re_tau, k) points
+
+        Each solve starts from the mesh and profile of the previous point (or
+        of the reference `start`; the first point starts from zeros on `n`
+        nodes otherwise). If a step does not converge, an intermediate point
+        (geometric mean in Re_tau, mean in k) is solved first, up to
+        `max_halvings` times. Converged references are cached in memory and in
+        `cache_dir` (None: memory only) and reused by later calls. Returns the
+        list of reference dicts (mesh `x`, `y` = [u, u'], `yp`, `seconds`).
+    """
+    refs = []
+    prev = start
+    for retau, k in points:
+        key = _ref_key(retau, k, rho, dpdx, delta, ymin, ymax, tol)
+        ref = _load_ref(key, cache_dir)
+        if ref is None:
+            targets = [(retau, k)]
+            halvings = 0
+            while targets:
+                re_t, k_t = targets[-1]
+                if prev is None:
+                    x0 = np.linspace(ymin, ymax, n)
+                    u0 = np.zeros((2, n))
+                else:
+                    x0, u0 = prev['x'], prev['y']
+                ref = _solve_ref(re_t, k_t, rho, dpdx, delta, x0, u0, tol, max_nodes)
+                if verbose:
+                    print(f"Re_tau={re_t:.1f}, k={k_t:.4f}: status {ref['status']}, "
+                          f"{len(ref['x'])} nodes, {ref['seconds']:.2f}s")
+                if ref['status'] == 0:
+                    targets.pop()
+                    prev = ref
+                    if targets: # intermediate point, keep it in memory only
+                        _REFS[_ref_key(re_t, k_t, rho, dpdx, delta, ymin, ymax, tol)] = ref
+                    continue
+                if prev is None or halvings == max_halvings:
+                    raise RuntimeError(f'RANS continuation failed at Re_tau={re_t}, k={k_t} '
+                                       f'(solve_bvp status {ref["status"]})')
+                halvings += 1
+                targets.append((np.sqrt(prev['retau'] * re_t), (prev['k'] + k_t) / 2))
+            _save_ref(key, ref, cache_dir)
+        refs.append(ref)
+        prev = ref
+    return refs
+
+def rans_reference(retau, k=0.41/4, rho=1, dpdx=-1, delta=1, ymin=-1, ymax=1, tol=1e-3,
+    retau_start=180, ratio=2, **kwargs):
+    """ cached reference at (`retau`, `k`), reached by continuation in Re_tau
+        from `retau_start` (steps of at most `ratio`) if it is not cached yet """
+    path = [(retau, k)]
+    if retau > retau_start * ratio:
+        n_steps = int(np.ceil(np.log(retau / retau_start) / np.log(ratio)))
+        path = [(float(r), k) for r in np.geomspace(retau_start, retau, n_steps + 1)]
+    return continuation(path, rho=rho, dpdx=dpdx, delta=delta, ymin=ymin, ymax=ymax,
+        tol=tol, **kwargs)[-1]
+
+def reference_table(retaus, kappas, **kwargs):
+    """ references on the `retaus` x `kappas` grid: one continuation in Re_tau per k,
+        started from the first reference of the previous k; returns {(retau, k): ref} """
+    table, start = {}, None
+    for k in kappas:
+        refs = continuation([(retau, k) for retau in retaus], start=start, **kwargs)
+        start = refs[0]
+        table.update({(retau, k): ref for retau, ref in zip(retaus, refs)})
+    return table
+
+# ===========================
+# mixing-length FD system
 # ===========================
 
-def handle_boundary(u, i, n, U_0=0, U_L=0):
-    # careful with boundaries. contains {i-2, i-1, i, i+1, i+2}
-    # if we step on or beyond the boundary, just set to the boundary (check this assumption!)
-    # returns u[i-2], u[i-1], u[i], u[i+1], u[i+2] while respecting boundary conditions
-
-    if i==0: # far left
-        return U_0, U_0, u[i], u[i+1], u[i+2]
-    elif i==1: # second from left
-        return U_0, u[i-1], u[i], u[i+1], u[i+2]
-    elif i==n-2: # second from right
-        return u[i-2], u[i-1], u[i], u[i+1], U_L
-    elif i==n-1: # far right
-        return u[i-2], u[i-1], u[i], U_L, U_L
-    else: # no boundaries
-        return u[i-2], u[i-1], u[i], u[i+1], u[i+2]
-
-def Gf(u):
-    n = u.shape[0]
-    gvec = np.zeros(n)
-    for i in range(n):
-
-        uim2, uim1, ui, uip1, uip2 = handle_boundary(u, i, n)
-        yim1, yip1 = y[i] - delta_y, y[i] + delta_y
-
-        a = (hypers['nu'] / (delta_y ** 2)) * (uip1 - 2*ui + uim1)
-        fplus = (uip2 - ui) / (2*delta_y)
-        fminus = (ui - uim2) / (2*delta_y)
-        b = (1 / (2 * delta_y)) * ((hypers['k'] * np.abs(yip1 - delta)) ** 2) * np.abs(fplus) * fplus
-        c = (-1 / (2 * delta_y)) * ((hypers['k'] * np.abs(yim1 - delta)) ** 2) * np.abs(fminus) * fminus
-        d = (-1 / hypers['rho']) * hypers['dp_dx']
-
-        gvec[i] = a + b + c + d
-
-    return gvec
-
-def dGi_ui(u, i, eps=1e-8):
-    n = u.shape[0]
-    uim2, uim1, ui, uip1, uip2 = handle_boundary(u, i, n)
-    yim1, yip1 = y[i] - delta_y, y[i] + delta_y
-
-    a = -2*hypers['nu'] / (delta_y**2)
-    b = (hypers['k']**2) / (2*delta_y)
-
-    fplus = ((uip2 - ui)/(2*delta_y)) + eps
-    fminus = ((ui - uim2)/(2*delta_y)) + eps
-
-    c1 = (np.abs(yip1-delta)**2)
-    c2 = (fplus**2) * (-1/(2*delta_y)) / np.abs(fplus)
-    c3 = np.abs(fplus) * (-1/(2*delta_y))
-    c = c1*(c2+c3)
-
-    d1 = -(np.abs(yim1-delta)**2)
-    d2 = (fminus**2) * (1/(2*delta_y)) / np.abs(fminus)
-    d3 = np.abs(fminus) * (1/(2*delta_y))
-    d = d1*(d2+d3)
-
-    return a + b * (c + d)
-
-def dGi_uim2(u, i, eps=1e-8):
-    n = u.shape[0]
-    uim2, uim1, ui, uip1, uip2 = handle_boundary(u, i, n)
-    yim1, yip1 = y[i] - delta_y, y[i] + delta_y
-
-    a = -((hypers['k'] * np.abs(yim1 - delta))**2) / (2*delta_y)
-    fminus = ((ui - uim2) / (2*delta_y)) + eps
-    b = (fminus**2) * (-1/(2*delta_y)) / np.abs(fminus)
-    c = np.abs(fminus) * (-1/(2*delta_y))
-
-    return a * (b + c)
-
-def dGi_uip2(u, i, eps=1e-8):
-    n = u.shape[0]
-    uim2, uim1, ui, uip1, uip2 = handle_boundary(u, i, n)
-    yim1, yip1 = y[i] - delta_y, y[i] + delta_y
-
-    a = -((hypers['k'] * np.abs(yip1 - delta))**2) / (2*delta_y)
-    fplus = ((uip2 - ui) / (2*delta_y)) + eps
-    b = (fplus**2) * (1/(2*delta_y)) / np.abs(fplus)
-    c = np.abs(fplus) * (1/(2*delta_y))
-
-    return a * (b + c)
-
-def jacobian(u, eps=1e-8):
-    # returns an entire column of jacobian
-    # careful with boundaries. contains {i-2, ..}
-    n = u.shape[0]
-    jac = np.zeros((n,n))
-    for i in range(n):
-        if i == 0:
-            jac[i,i]=dGi_ui(u, i, eps)
-            jac[i+1, i]=hypers['nu']/(delta_y**2)
-            jac[i+2, i]=dGi_uip2(u, i, eps)
-        elif i==1:
-            jac[i-1, i] = hypers['nu']/(delta_y**2)
-            jac[i, i] = dGi_ui(u, i, eps)
-            jac[i+1, i] = hypers['nu']/(delta_y**2)
-            jac[i+2, i] = dGi_uip2(u, i, eps)
-        elif i==n-2:
-            jac[i-2, i] = dGi_uim2(u, i, eps)
-            jac[i-1, i] = hypers['nu']/(delta_y**2)
-            jac[i, i] = dGi_ui(u, i, eps)
-            jac[i+1, i] = hypers['nu']/(delta_y**2)
-        elif i==n-1:
-            jac[i-2, i] = dGi_uim2(u, i, eps)
-            jac[i-1, i] = hypers['nu']/(delta_y**2)
-            jac[i, i] = dGi_ui(u, i, eps)
-        else:
-            jac[i-2, i] = dGi_uim2(u, i, eps)
-            jac[i-1, i] = hypers['nu']/(delta_y**2)
-            jac[i, i] = dGi_ui(u, i, eps)
-            jac[i+1, i] = hypers['nu']/(delta_y**2)
-            jac[i+2, i] = dGi_uip2(u, i, eps)
-
-    return jac
-
-def newton(u0, tol=1e-14, max_iter=int(1e6), eps=1e-8):
-    u = u0
+def mixing_length(y, k=0.41, delta=1):
+    """ Prandtl mixing length k * (distance to the nearest wall) """
+    return k * (delta - np.abs(y))
+
+def _stress(u, y, k, delta):
+    """ velocity with the (zero) wall values, central du/dy and its derivative factor,
+        Reynolds stress l^2 |du/dy| du/dy at every node (zero at the walls, where l = 0) """
+    h = y[1] - y[0]
+    U = np.concatenate([[0.], u, [0.]])
+    du = np.zeros_like(U)
+    du[1:-1] = (U[2:] - U[:-2]) / (2*h)
+    l2 = mixing_length(y, k, delta)**2
+    return U, l2 * np.abs(du) * du, l2 * np.abs(du) / h
+
+def Gf(u, y, k=0.41, nu=0.0055555555, rho=1, dpdx=-1, delta=1):
+    """ FD residual of nu u'' + (l^2 |u'| u')' - dpdx / rho = 0 at the inner nodes
+
+        `u` holds the inner values of the uniform grid `y` (u = 0 at the walls);
+        the stress is differenced centrally at the neighbouring nodes, so the
+        stencil of node i is {i-2, ..., i+2}
+    """
+    h = y[1] - y[0]
+    U, tau, _ = _stress(u, y, k, delta)
+    return nu * (U[2:] - 2*U[1:-1] + U[:-2]) / h**2 + (tau[2:] - tau[:-2]) / (2*h) - dpdx / rho
+
+def jacobian(u, y, k=0.41, nu=0.0055555555, rho=1, dpdx=-1, delta=1):
+    """ pentadiagonal Jacobian of `Gf` in the banded storage of scipy.linalg.solve_banded
+        (ab[2 + i - j, j] = dG_i / du_j) """
+    h = y[1] - y[0]
+    _, _, dtau = _stress(u, y, k, delta) # d tau_j / d u_{j+1} = -d tau_j / d u_{j-1}
+    ab = np.zeros((5, len(u)))
+    ab[0, 2:] = dtau[2:-2] / (2*h)
+    ab[1, 1:] = nu / h**2
+    ab[2] = -2 * nu / h**2 - (dtau[2:] + dtau[:-2]) / (2*h)
+    ab[3, :-1] = nu / h**2
+    ab[4, :-2] = dtau[2:-2] / (2*h)
+    return ab
+
+def newton(y, u0=None, tol=1e-10, max_iter=100, verbose=False, **params):
+    """ damped Newton iteration on `Gf`, O(n) per step with a banded solve
+
+        the step is halved until the residual norm decreases (Armijo
+        backtracking); stops when the update is below `tol` relative to max |u|.
+        `params` are passed to `Gf` (k, nu, rho, dpdx, delta). Returns u at all
+        nodes of `y`, walls included.
+    """
+    u = np.zeros(len(y) - 2) if u0 is None else np.asarray(u0, dtype=float)[1:-1].copy()
+    G = Gf(u, y, **params)
     for it in range(max_iter):
-        G = Gf(u)
-        jac = jacobian(u, eps=eps)
-        delta_u = np.linalg.solve(jac, -G)
-        u = u + delta_u
-        max_du = np.max(delta_u)
-        if it % 100 == 0:
-            print('iter {}/{}: max delta_u = {}'.format(it, max_iter, max_du))
-        if max_du < tol:
+        du = solve_banded((2, 2), jacobian(u, y, **params), -G)
+        norm, lam = np.linalg.norm(G), 1.
+        while True:
+            u_new = u + lam * du
+            G_new = Gf(u_new, y, **params)
+            if np.linalg.norm(G_new) <= (1 - 1e-4 * lam) * norm or lam < 1e-4:
+                break
+            lam /= 2
+        u, G = u_new, G_new
+        max_du = np.max(np.abs(lam * du))
+        if verbose:
+            print(f'iter {it}: max |delta u| = {max_du:.3e}, step {lam:g}, |G| = {np.linalg.norm(G):.3e}')
+        if max_du < tol * max(1., np.max(np.abs(u))):
             break
-    return u
+    else:
+        raise RuntimeError(f'newton: no convergence in {max_iter} iterations (max |delta u| = {max_du:.3e})')
+    return np.concatenate([[0.], u, [0.]])
+
+def solve_rans_fd(n=1000, retau=180, k=0.41, ymin=-1, ymax=1, **kwargs):
+    """ mixing-length FD reference on n nodes of [ymin, ymax] at Re_tau = 1 / nu
+        (u_tau = delta = 1); returns y, u """
+    y = np.linspace(ymin, ymax, n)
+    return y, newton(y, k=k, nu=1/retau, **kwargs)
+
+if __name__ == '__main__':
+    import argparse
+    args = argparse.ArgumentParser()
+    args.add_argument('--retau', type=int, nargs='+', default=[180, 550, 1000])
+    args.add_argument('--n', type=int, default=1000, help='grid points, walls included')
+    args.add_argument('--halfk', action='store_true', default=False,
+        help='use k = 0.41/2 (files *_halfk.npy)')
+    args.add_argument('--out', type=str, default='data', help='output directory')
+    args.add_argument('--bvp', action='store_true', default=False,
+        help='build the solve_bvp reference table over --retau x --kappa by continuation '
+             '(cached in experiments/cache/rans) instead of the FD files')
+    args.add_argument('--kappa', type=float, nargs='+', default=[0.41/4])
+    args.add_argument('--tol', type=float, default=1e-3, help='solve_bvp tolerance')
+    args.add_argument('--cold', action='store_true', default=False,
+        help='with --bvp: also time independent solves from zeros')
+    args = args.parse_args()
+
+    if args.bvp:
+        t0 = time.perf_counter()
+        table = reference_table(sorted(args.retau), args.kappa, tol=args.tol, n=args.n,
+            verbose=True)
+        print(f'{len(table)} references in {time.perf_counter() - t0:.2f}s')
+        if args.cold:
+            t0 = time.perf_counter()
+            failed = 0
+            for retau, k in table:
+                ref = _solve_ref(retau, k, 1, -1, 1, np.linspace(-1, 1, args.n),
+                    np.zeros((2, args.n)), args.tol, 100000)
+                failed += ref['status'] != 0
+            print(f'Cold solves: {time.perf_counter() - t0:.2f}s, {failed} not converged')
+    else:
+        k = 0.41 / 2 if args.halfk else 0.41
+        for retau in args.retau:
+            t0 = time.perf_counter()
+            y, u = solve_rans_fd(n=args.n, retau=retau, k=k)
+            fname = os.path.join(args.out, f"mixlen_numerical_u{retau}{'_halfk' if args.halfk else ''}.npy")
+            np.save(fname, u)
+            print(f'Re_tau={retau}: max u = {u.max():.4f}, {1000 * (time.perf_counter() - t0):.1f} ms -> {fname}')
@@ -7,7 +7,7 @@ from ray import tune
 from ray.tune import track
 from ray.tune.schedulers import AsyncHyperBandScheduler, MedianStoppingRule
 
-from denn.experiments import gan_experiment, L2_experiment
+from denn.experiments import run_experiment
 from denn.config.config import get_config
 
 if __name__ == "__main__":
@@ -18,6 +18,8 @@ if __name__ == "__main__":
         help='whether to use classical training, default False (use GAN))')
     args.add_argument('--ncpu', type=int, default=10)
     args.add_argument('--nsample', type=int, default=100)
+    args.add_argument('--force', action='store_true', default=False,
+        help='re-run trials even if a cached result exists')
     args = args.parse_args()
 
     params = get_config(args.pkey)
@@ -28,11 +30,18 @@ if __name__ == "__main__":
     params['training']['plot'] = False
     params['training']['save'] = False
 
+    def replay(res):
+        """ report a cached history to tune the same way training does """
+        if res['cached']:
+            val = res['mses']['val']
+            for i in range(10, len(val)+1, 10):
+                track.log(mean_squared_error=np.mean(val[i-10:i]))
+
     def gan_tuning(config):
-        res = gan_experiment(args.pkey, config)
+        replay(run_experiment(args.pkey, config, gan=True, force=args.force))
 
     def classical_tuning(config):
-        res = L2_experiment(args.pkey, config)
+        replay(run_experiment(args.pkey, config, gan=False, force=args.force))
 
     search_space = deepcopy(params)
 
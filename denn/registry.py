@@ -0,0 +1,205 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import argparse
+import yaml
+
+from denn.utils import flatten_dict, config_hash
+
+this_dir = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_PATH = os.path.join(this_dir, '../experiments/runs/registry.db')
+
+# columns of `runs` that can be used directly in `where` / metrics
+RUN_COLUMNS = ['run_id', 'pkey', 'method', 'config_hash', 'status', 'created',
+    'finished', 'final_val_mse', 'best_val_mse', 'final_train_mse', 'best_step',
+    'artifact_dir', 'wall_seconds', 'cpu_seconds', 'steps']
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY,
+    pkey TEXT,
+    method TEXT,
+    config_hash TEXT,
+    status TEXT,
+    created REAL,
+    finished REAL,
+    final_val_mse REAL,
+    best_val_mse REAL,
+    final_train_mse REAL,
+    best_step INTEGER,
+    artifact_dir TEXT,
+    config TEXT,
+    wall_seconds REAL,
+    cpu_seconds REAL,
+    steps INTEGER
+);
+CREATE TABLE IF NOT EXISTS params (
+    run_id TEXT,
+    key TEXT,
+    value,
+    PRIMARY KEY (run_id, key)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS params_key_value ON params (key, value, run_id);
+CREATE INDEX IF NOT EXISTS runs_pkey_status ON runs (pkey, status);
+CREATE INDEX IF NOT EXISTS runs_config_hash ON runs (config_hash);
+"""
+
+def _sql_value(v):
+    """ flattened config value -> sqlite value (lists/dicts as json text) """
+    if v is None or isinstance(v, (bool, int, float, str)):
+        return v
+    return json.dumps(v, default=str)
+
+class RunRegistry():
+    """ SQLite index of training runs
+
+        One row per run in `runs` (status, summary metrics, artifact path)
+        plus the flattened config in `params` as (run_id, key, value),
+        indexed on (key, value) so parameter filters / group-bys never
+        touch the artifact files.
+    """
+    def __init__(self, path=DEFAULT_PATH, timeout=60):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.conn = sqlite3.connect(path, timeout=timeout)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.executescript(_SCHEMA)
+        # registries created before the timing columns existed
+        cols = [r[1] for r in self.conn.execute('PRAGMA table_info(runs)')]
+        for col, typ in [('wall_seconds', 'REAL'), ('cpu_seconds', 'REAL'), ('steps', 'INTEGER')]:
+            if col not in cols:
+                self.conn.execute(f'ALTER TABLE runs ADD COLUMN {col} {typ}')
+        self.conn.commit()
+
+    def close(self):
+        self.conn.execute('PRAGMA optimize') # refresh planner stats for the indexes
+        self.conn.close()
+
+    def register(self, pkey, method, config, status='running'):
+        """ add a new run and return its id """
+        run_id = uuid.uuid4().hex[:16]
+        flat = flatten_dict(config)
+        with self.conn:
+            self.conn.execute(
+                'INSERT INTO runs (run_id, pkey, method, config_hash, status, created, config) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (run_id, pkey.lower().strip(), method, config_hash(config), status,
+                 time.time(), json.dumps(config, default=str)))
+            self.conn.executemany(
+                'INSERT INTO params (run_id, key, value) VALUES (?, ?, ?)',
+                [(run_id, k, _sql_value(v)) for k, v in flat.items()])
+        return run_id
+
+    def finish(self, run_id, mses=None, artifact_dir=None, status='finished', timing=None):
+        """ mark a run done and store its summary metrics and cost (`timing`) """
+        if artifact_dir is not None:
+            artifact_dir = os.path.abspath(artifact_dir)
+        vals = {'status': status, 'finished': time.time(), 'artifact_dir': artifact_dir}
+        for k in ['wall_seconds', 'cpu_seconds', 'steps']:
+            if timing and k in timing:
+                vals[k] = timing[k]
+        if mses is not None and len(mses.get('val', [])) > 0:
+            val = mses['val']
+            best_step = min(range(len(val)), key=val.__getitem__)
+            vals.update(final_val_mse=val[-1], best_val_mse=val[best_step],
+                best_step=best_step)
+        if mses is not None and len(mses.get('train', [])) > 0:
+            vals['final_train_mse'] = mses['train'][-1]
+        cols = ', '.join(f'{k} = ?' for k in vals)
+        with self.conn:
+            self.conn.execute(f'UPDATE runs SET {cols} WHERE run_id = ?',
+                list(vals.values()) + [run_id])
+
+    def _filter(self, where, pkey, status):
+        """ build JOIN / WHERE clauses for parameter and run-column filters """
+        joins, conds, args = [], [], []
+        if pkey is not None:
+            conds.append('r.pkey = ?')
+            args.append(pkey.lower().strip())
+        if status is not None:
+            conds.append('r.status = ?')
+            args.append(status)
+        join_args = []
+        for i, (k, v) in enumerate((where or {}).items()):
+            if k in RUN_COLUMNS:
+                conds.append(f'r.{k} = ?')
+                args.append(v)
+            else:
+                joins.append(f'JOIN params w{i} ON w{i}.run_id = r.run_id '
+                             f'AND w{i}.key = ? AND w{i}.value = ?')
+                join_args += [k, _sql_value(v)]
+        join_sql = ' '.join(joins)
+        where_sql = ('WHERE ' + ' AND '.join(conds)) if conds else ''
+        return join_sql, join_args, where_sql, args
+
+    def query(self, metric='best_val_mse', where=None, group_by=None, agg='MIN',
+        pkey=None, status='finished'):
+        """ aggregate `metric` over runs matching `where`, grouped by a config key
+
+            e.g. query('best_val_mse', where={'generator.residual': True},
+                       group_by='training.g_lr', pkey='nlo')
+            returns a list of (group value, aggregate, count) sorted by aggregate
+        """
+        assert metric in RUN_COLUMNS, f'Unknown metric {metric}'
+        assert agg.upper() in ['MIN', 'MAX', 'AVG', 'COUNT'], f'Unknown aggregate {agg}'
+        join_sql, join_args, where_sql, args = self._filter(where, pkey, status)
+        if group_by is None:
+            sql = (f'SELECT NULL, {agg}(r.{metric}), COUNT(*) FROM runs r {join_sql} {where_sql}')
+            return self.conn.execute(sql, join_args + args).fetchall()
+        if group_by in RUN_COLUMNS:
+            gcol, gjoin, gargs = f'r.{group_by}', '', []
+        else:
+            gcol = 'g.value'
+            gjoin = 'JOIN params g ON g.run_id = r.run_id AND g.key = ?'
+            gargs = [group_by]
+        sql = (f'SELECT {gcol}, {agg}(r.{metric}) AS m, COUNT(*) FROM runs r '
+               f'{gjoin} {join_sql} {where_sql} GROUP BY {gcol} ORDER BY m')
+        return self.conn.execute(sql, gargs + join_args + args).fetchall()
+
+    def best(self, metric='best_val_mse', where=None, pkey=None, n=10, status='finished'):
+        """ top `n` runs (lowest `metric`) matching `where` """
+        assert metric in RUN_COLUMNS, f'Unknown metric {metric}'
+        join_sql, join_args, where_sql, args = self._filter(where, pkey, status)
+        sql = (f'SELECT r.run_id, r.{metric}, r.artifact_dir FROM runs r {join_sql} '
+               f'{where_sql} ORDER BY r.{metric} LIMIT ?')
+        return self.conn.execute(sql, join_args + args + [n]).fetchall()
+
+    def configs(self, metric='final_val_mse', where=None, pkey=None, status='finished'):
+        """ (config, metric) of every run matching `where` (e.g. to warm-start a search) """
+        assert metric in RUN_COLUMNS, f'Unknown metric {metric}'
+        join_sql, join_args, where_sql, args = self._filter(where, pkey, status)
+        sql = f'SELECT r.config, r.{metric} FROM runs r {join_sql} {where_sql}'
+        rows = self.conn.execute(sql, join_args + args).fetchall()
+        return [(json.loads(c), m) for c, m in rows]
+
+    def get_config(self, run_id):
+        row = self.conn.execute('SELECT config FROM runs WHERE run_id = ?', (run_id,)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+if __name__ == '__main__':
+    args = argparse.ArgumentParser()
+    args.add_argument('--path', type=str, default=DEFAULT_PATH,
+        help='registry database file')
+    args.add_argument('--pkey', type=str, default=None,
+        help='problem key to filter on (e.g. nlo)')
+    args.add_argument('--metric', type=str, default='best_val_mse',
+        help='run column to aggregate')
+    args.add_argument('--where', type=str, nargs='*', default=[],
+        help='filters as key=value, e.g. generator.residual=True')
+    args.add_argument('--group-by', type=str, default=None,
+        help='config key to group by, e.g. training.g_lr')
+    args = args.parse_args()
+
+    where = {}
+    for w in args.where:
+        k, v = w.split('=', 1)
+        where[k] = yaml.safe_load(v)
+
+    reg = RunRegistry(args.path)
+    t = time.time()
+    rows = reg.query(args.metric, where=where, group_by=args.group_by, pkey=args.pkey)
+    for row in rows:
+        print(*row, sep='\t')
+    print(f'({len(rows)} rows in {1000*(time.time()-t):.1f} ms)')
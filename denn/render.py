@@ -0,0 +1,70 @@
+import os
+import sys
+import argparse
+import subprocess
+
+from denn.runstore import read_manifest, load_run, find_runs
+
+PLOT_FILE = 'plot.png'
+
+def _columns(manifest, group):
+    """ {original label: column} for every column in `group` (in write order) """
+    return {manifest['labels'].get(c, c): c for c in manifest['columns']
+            if c.startswith(f'{group}.')}
+
+def render_run(dirname):
+    """ render `plot.png` for a finished run from its stored data """
+    import matplotlib
+    matplotlib.use('Agg')
+    from denn.utils import plot_results
+
+    manifest = read_manifest(dirname)
+    spec = manifest.get('plot')
+    if spec is None:
+        raise ValueError(f'Run {dirname} has no plot spec (saved by an older version?)')
+    preds = _columns(manifest, 'pred')
+    diffs = _columns(manifest, 'diff')
+    cols = list(spec['mses'].values()) + list(spec['losses'].values()) \
+        + list(preds.values()) + list(diffs.values()) + ['grid.grid']
+    data = load_run(dirname, cols)
+
+    plot_results(
+        {k: data[c] for k, c in spec['mses'].items()},
+        {k: data[c] for k, c in spec['losses'].items()},
+        data['grid.grid'],
+        {k: data[c] for k, c in preds.items()},
+        diff_dict={k: data[c] for k, c in diffs.items()} or None,
+        save=True, dirname=dirname, logloss=spec.get('logloss', False),
+        alpha=spec.get('alpha', 0.8))
+    return os.path.join(dirname, PLOT_FILE)
+
+def render_async(dirname):
+    """ render a run's plot in a separate, detached process (returns the Popen) """
+    env = dict(os.environ, MPLBACKEND='Agg')
+    return subprocess.Popen([sys.executable, '-m', 'denn.render', dirname],
+        env=env, stdin=subprocess.DEVNULL, start_new_session=True)
+
+if __name__ == '__main__':
+    args = argparse.ArgumentParser()
+    args.add_argument('runs', type=str, nargs='*',
+        help='run directories to render')
+    args.add_argument('--root', type=str, default=None,
+        help='render every run found below this directory')
+    args.add_argument('--force', action='store_true', default=False,
+        help='re-render runs that already have a plot')
+    args = args.parse_args()
+
+    runs = list(args.runs)
+    if args.root:
+        runs += find_runs(args.root)
+
+    failed = 0
+    for d in runs:
+        if not args.force and args.root and os.path.exists(os.path.join(d, PLOT_FILE)):
+            continue
+        try:
+            render_run(d)
+        except Exception as e:
+            print(f'Could not render {d}: {e}')
+            failed += 1
+    sys.exit(1 if failed else 0)
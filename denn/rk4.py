@@ -34,31 +34,110 @@ def rk4 ( dydt, tspan, y0, n ):
 #    real t[n+1], y[n+1,m]: the times and solution values.
 #
   import numpy as np
+#
+#  A batch of one trajectory, stored in single precision.
+#
+  def dydt_batch ( t, y ):
+    return np.reshape ( dydt ( t, y[:,0] ), ( -1, 1 ) )
+
+  t, y = rk4_batch ( dydt_batch, tspan, y0, n, dtype = np.single )
+
+  return t, y[:,0,:]
 
-  if ( np.ndim ( y0 ) == 0 ):
-    m = 1
+def rk4_batch ( dydt, tspan, y0, n, stride = 1, dtype = None, args = () ):
+
+#*****************************************************************************80
+#
+## RK4_BATCH integrates a batch of trajectories of an ODE with the RK4 method.
+#
+#  Discussion:
+#
+#    All trajectories share the time grid and are advanced together, so
+#    each step makes four calls to dydt for the whole batch.
+#
+#    dydt receives the state component first, as y[m,b], so a right hand
+#    side written for one state, such as np.array ( [ y[1], -y[0] ] ),
+#    also works on a batch.  Arrays of shape [b] in args (or bound to dydt)
+#    give every trajectory its own parameters.
+#
+#    y0 may be a NumPy array or a torch tensor; in the latter case the
+#    integration runs in torch and dydt must return a tensor.
+#
+#  Input:
+#
+#    function dydt: evaluates the right hand side, dydt ( t, y[m,b], *args ).
+#
+#    real tspan[2]: contains the initial and final times.
+#
+#    real y0[b,m]: the initial conditions (y0[m] or a scalar is a batch of one).
+#
+#    integer n: the number of steps to take.
+#
+#    integer stride: solutions are stored every stride steps (and at the
+#    final time).
+#
+#    dtype: precision of the solution, float64 by default.
+#
+#    tuple args: extra arguments for dydt.
+#
+#  Output:
+#
+#    real t[k], y[k,b,m]: the output times and solution values, with
+#    k = n / stride + 1 when stride divides n.
+#
+  import numpy as np
+
+  if ( hasattr ( y0, 'detach' ) ):
+    import torch
+    dtype = dtype or torch.float64
+    y = y0.detach ( ).to ( dtype )
+    cast = lambda v: v.to ( dtype )
+    time = float
+    empty = lambda shape: torch.empty ( shape, dtype = dtype )
+    np_dtype = np.float64
   else:
-    m = len ( y0 )
+    dtype = dtype or np.float64
+    y = np.asarray ( y0, dtype = dtype )
+    cast = lambda v: np.asarray ( v, dtype = dtype )
+    time = lambda v: v
+    empty = lambda shape: np.empty ( shape, dtype = dtype )
+    np_dtype = dtype
+
+  if ( y.ndim < 2 ):
+    y = y.reshape ( 1, -1 )
+  b, m = y.shape
+  y = y.transpose ( 1, 0 )
+
+  steps = list ( range ( 0, n + 1, stride ) )
+  if ( steps[-1] != n ):
+    steps.append ( n )
+
+  dt = ( tspan[1] - tspan[0] ) / n
+  tt = np.zeros ( n + 1, dtype = np_dtype )
+  tt[0] = tspan[0]
+  for i in range ( 0, n ):
+    tt[i+1] = tt[i] + dt
 
-  tfirst = tspan[0]
-  tlast = tspan[1]
-  dt = ( tlast - tfirst ) / n
-  t = np.zeros ( n + 1 , dtype=np.single)
-  y = np.zeros ( [ n + 1, m ], dtype=np.single)
-  t[0] = tspan[0]
-  y[0,:] = y0
+  t = tt[steps]
+  yout = empty ( ( len ( steps ), b, m ) )
+  yout[0] = y.transpose ( 1, 0 )
+  k = 1
 
   for i in range ( 0, n ):
 
-    f1 = dydt ( t[i],            y[i,:] )
-    f2 = dydt ( t[i] + dt / 2.0, y[i,:] + dt * f1 / 2.0 )
-    f3 = dydt ( t[i] + dt / 2.0, y[i,:] + dt * f2 / 2.0 )
-    f4 = dydt ( t[i] + dt,       y[i,:] + dt * f3 )
+    ti = time ( tt[i] )
+    f1 = dydt ( ti,            y,                  *args )
+    f2 = dydt ( ti + dt / 2.0, y + dt * f1 / 2.0, *args )
+    f3 = dydt ( ti + dt / 2.0, y + dt * f2 / 2.0, *args )
+    f4 = dydt ( ti + dt,       y + dt * f3,       *args )
+
+    y = cast ( y + dt * ( f1 + 2.0 * f2 + 2.0 * f3 + f4 ) / 6.0 )
 
-    t[i+1] = t[i] + dt
-    y[i+1,:] = y[i,:] + dt * ( f1 + 2.0 * f2 + 2.0 * f3 + f4 ) / 6.0
+    if ( i + 1 == steps[k] ):
+      yout[k] = y.transpose ( 1, 0 )
+      k = k + 1
 
-  return t, y
+  return t, yout
 
 def rk4_test ( ):
 
@@ -0,0 +1,167 @@
+import os
+import re
+import json
+import glob
+import time
+import numpy as np
+
+MANIFEST = 'manifest.json'
+HISTORY = 'history.npz'
+
+def column_name(label):
+    """ turn a plot label (e.g. '$\\hat{x}$') into a plain column name ('hat_x') """
+    name = re.sub(r'[^0-9a-zA-Z]+', '_', str(label)).strip('_')
+    return name if name else 'col'
+
+def _to_numpy(v):
+    """ detach torch tensors / lists into numpy arrays """
+    if hasattr(v, 'detach'):
+        v = v.detach().cpu().numpy()
+    return np.asarray(v)
+
+def _history(dirname, segments, columns=None):
+    """ history columns: the compacted `history.npz` (from earlier, resumed
+        sessions) followed by the appended `segments` """
+    parts = {}
+    files = [HISTORY] if os.path.exists(os.path.join(dirname, HISTORY)) else []
+    for fname in files + list(segments):
+        with np.load(os.path.join(dirname, fname)) as z:
+            for k in z.files:
+                if columns is None or k in columns:
+                    parts.setdefault(k, []).append(z[k])
+    return {k: np.concatenate(v) for k, v in parts.items()}
+
+class RunStore():
+    """ Columnar storage for a single run
+
+        A run directory holds `manifest.json` (config, timing, column index)
+        plus compressed `.npz` files, one per column group. Histories are
+        appended in segments while training and compacted into a single
+        `history.npz` on `close` (after the history of earlier sessions
+        when resumed). Columns are addressed as `group.name`,
+        e.g. `history.val`, `pred.hat_x`, `grid.grid`. An existing run is
+        started afresh unless `resume=True`.
+    """
+    def __init__(self, dirname, config=None, resume=False):
+        self.dirname = dirname
+        os.makedirs(dirname, exist_ok=True)
+        path = os.path.join(dirname, MANIFEST)
+        if resume and os.path.exists(path):
+            with open(path, 'r') as f:
+                self.manifest = json.load(f)
+            if config is not None:
+                self.manifest['config'] = config
+        else:
+            self.manifest = {'config': config, 'columns': {}, 'labels': {},
+                'segments': [], 'timing': {}, 'status': 'open',
+                'created': time.time()}
+            if os.path.exists(os.path.join(dirname, HISTORY)):
+                os.remove(os.path.join(dirname, HISTORY)) # not part of the new run
+        self._write_manifest()
+
+    def _write_manifest(self):
+        path = os.path.join(self.dirname, MANIFEST)
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.manifest, f, indent=1, default=str)
+        os.replace(tmp, path)
+
+    def _columns(self, group, data):
+        cols = {}
+        for label, v in data.items():
+            name = f'{group}.{column_name(label)}'
+            cols[name] = _to_numpy(v)
+            self.manifest['labels'][name] = str(label)
+        return cols
+
+    def append(self, group, data):
+        """ append a segment of 1-D columns (e.g. flushed metric history) """
+        cols = self._columns(group, data)
+        fname = f'{group}-{len(self.manifest["segments"]):05d}.npz'
+        np.savez(os.path.join(self.dirname, fname), **cols)
+        self.manifest['segments'].append(fname)
+        for k in cols:
+            self.manifest['columns'][k] = HISTORY
+        self._write_manifest()
+
+    def write(self, group, data):
+        """ write (or overwrite) a group of columns into `<group>.npz` """
+        cols = self._columns(group, data)
+        fname = f'{group}.npz'
+        np.savez_compressed(os.path.join(self.dirname, fname), **cols)
+        for k in cols:
+            self.manifest['columns'][k] = fname
+        self._write_manifest()
+
+    def set_plot(self, mses, losses, **opts):
+        """ record which columns to plot ({label: column}) so plots can be rendered later """
+        self.manifest['plot'] = dict(mses=mses, losses=losses, **opts)
+        self._write_manifest()
+
+    def set_timing(self, **timing):
+        self.manifest['timing'].update(timing)
+        self._write_manifest()
+
+    def close(self, status='finished'):
+        """ compact appended segments (after any existing history) into a single history file """
+        segs = self.manifest['segments']
+        if segs:
+            hist = _history(self.dirname, segs)
+            tmp = os.path.join(self.dirname, 'history.tmp.npz')
+            np.savez_compressed(tmp, **hist)
+            os.replace(tmp, os.path.join(self.dirname, HISTORY))
+            for fname in segs:
+                os.remove(os.path.join(self.dirname, fname))
+            self.manifest['segments'] = []
+        self.manifest['status'] = status
+        self._write_manifest()
+
+def read_manifest(dirname):
+    with open(os.path.join(dirname, MANIFEST), 'r') as f:
+        return json.load(f)
+
+def load_run(dirname, columns=None):
+    """ read `columns` (all if None) from one run, opening only the files needed """
+    manifest = read_manifest(dirname)
+    index = manifest['columns']
+    columns = list(index) if columns is None else columns
+    by_file = {}
+    for c in columns:
+        if c not in index:
+            raise KeyError(f'Column {c} not found in run {dirname}')
+        by_file.setdefault(index[c], []).append(c)
+
+    out = {}
+    for fname, cols in by_file.items():
+        if fname == HISTORY and manifest['segments']:
+            # run still open: stitch any compacted history and the appended segments
+            out.update(_history(dirname, manifest['segments'], cols))
+        else:
+            with np.load(os.path.join(dirname, fname)) as z:
+                out.update({c: z[c] for c in cols})
+    return out
+
+def find_runs(root):
+    """ all run directories (containing a manifest) below `root` """
+    paths = glob.glob(os.path.join(root, '**', MANIFEST), recursive=True)
+    return sorted(os.path.dirname(p) for p in paths)
+
+def load_runs(dirnames, columns, config=False):
+    """ read the same `columns` across many runs
+
+        returns {dirname: {column: array}}; runs missing a column are skipped
+        with a message. If `config=True` the run config is included under 'config'.
+    """
+    if isinstance(dirnames, str):
+        dirnames = find_runs(dirnames)
+    runs = {}
+    for d in dirnames:
+        try:
+            res = load_run(d, columns)
+        except (KeyError, OSError) as e:
+            print(f'Skipping {d}: {e}')
+            continue
+        if config:
+            res['config'] = read_manifest(d)['config']
+        runs[d] = res
+    return runs
@@ -0,0 +1,298 @@
+from math import factorial
+import numpy as np
+from numpy.polynomial import Chebyshev
+from scipy import sparse
+from scipy.sparse.linalg import spsolve
+
+# Chebyshev collocation references for the smooth 1-D problems (exp, sho, nlo,
+# rans): the solution is a Chebyshev series on each of a few intervals that
+# satisfies the equation at the Chebyshev points and the initial / boundary
+# conditions, found by Newton's method. The series are evaluated exactly.
+
+def chebpts(N, domain=(-1, 1)):
+    """ the N+1 Chebyshev (extreme) points of `domain`, ascending """
+    a, b = domain
+    return a + (b - a) * (1 - np.cos(np.pi * np.arange(N + 1) / N)) / 2
+
+def chebfun(values, domain=(-1, 1)):
+    """ interpolating polynomial (numpy Chebyshev series) through `values` at the
+        ascending Chebyshev points of `domain`; for 2-D `values`, the
+        coefficients of each column """
+    from scipy.fft import dct
+    v = np.asarray(values, dtype=float)[::-1]
+    N = len(v) - 1
+    coef = dct(v, type=1, axis=0) / N
+    coef[0] /= 2
+    coef[-1] /= 2
+    return coef if coef.ndim > 1 else Chebyshev(coef, domain=domain)
+
+def integration_matrix(N, domain=(-1, 1)):
+    """ (N+1, N+1) matrix of the integral from domain[0] of the interpolant
+        through values at the Chebyshev points, evaluated at the points """
+    from numpy.polynomial import chebyshev as C
+    a, b = domain
+    x = np.cos(np.pi * np.arange(N, -1, -1) / N) # ascending points of [-1, 1]
+    coef = C.chebint(chebfun(np.eye(N + 1)), lbnd=-1, axis=0) * (b - a) / 2
+    return C.chebvander(x, N + 1) @ coef
+
+class Piecewise():
+    """ Chebyshev series on consecutive intervals, callable at any t """
+    def __init__(self, pieces):
+        self.pieces = pieces
+        self.edges = [p.domain[0] for p in pieces] + [pieces[-1].domain[1]]
+
+    def __call__(self, t):
+        t = np.asarray(t, dtype=float)
+        i = np.searchsorted(self.edges[1:-1], t, side='right')
+        out = np.empty(t.shape)
+        for j in np.unique(i):
+            out[i == j] = self.pieces[j](t[i == j])
+        return out
+
+    def deriv(self, m=1):
+        return Piecewise([p.deriv(m) for p in self.pieces])
+
+def collocation(F, dF, edges, conditions, Ns, order, guess=None, tol=1e-10, max_iter=50):
+    """ Newton iteration on the collocation system of F(t, [u, u', ..., u^(order)]) = 0
+
+        on the intervals between `edges`, with Ns[i] + 1 Chebyshev points on
+        interval i. The unknowns of an interval [a, b] are v = u^(order) at
+        its points and the Taylor coefficients c_k = u^(k)(a), k < order, so
+        that u^(k) = sum_j c_j (t - a)^(j-k) / (j-k)! + Q^(order-k) v with the
+        integration matrix Q. The equation holds at every point; each
+        condition (point, k, value), u^(k)(point) = value at either end, and
+        the continuity of u, ..., u^(order-1) between intervals add a row.
+        Unlike row-replaced differentiation matrices (condition number
+        O(N^(2 order))) the sparse system stays well conditioned.
+
+        `dF` returns the partial derivatives dF/du^(k), k = 0..order (arrays or
+        scalars), `guess` is a callable for u (default zeros). Steps are halved
+        while they do not reduce the residual (RuntimeError if no step down to
+        1e-6 does); stops when the Newton step is below `tol` relative to the
+        unknowns. Returns the pieces of u (exact integrals of the interpolants
+        of v), the coefficients of v on each interval and the iterations.
+    """
+    blocks = []
+    for a, b, N in zip(edges[:-1], edges[1:], Ns):
+        t = chebpts(N, (a, b))
+        Q = integration_matrix(N, (a, b))
+        Qk = [np.eye(N + 1)] # Q^m
+        for _ in range(order):
+            Qk.append(Q @ Qk[-1])
+        M = []
+        for k in range(order + 1):
+            taylor = np.zeros((N + 1, order))
+            for j in range(k, order):
+                taylor[:, j] = (t - a)**(j - k) / factorial(j - k)
+            M.append(np.hstack([Qk[order - k], taylor]))
+        blocks.append((t, M))
+    offsets = np.concatenate([[0], np.cumsum([N + 1 + order for N in Ns])])
+    t = np.concatenate([blk[0] for blk in blocks])
+    # derivs[k] = M[k] @ z, z = [v, c_0, ..., c_(order-1)] of every interval
+    M = [sparse.block_diag([blk[1][k] for blk in blocks], format='csr') for k in range(order + 1)]
+
+    def row(i, end, k):
+        r = np.zeros(offsets[-1])
+        r[offsets[i]:offsets[i + 1]] = blocks[i][1][k][end]
+        return r
+
+    rows, values = [], []
+    for point, k, value in conditions:
+        rows.append(row(0, 0, k) if np.isclose(point, edges[0]) else row(len(Ns) - 1, -1, k))
+        values.append(value)
+    for i in range(len(Ns) - 1):
+        for k in range(order):
+            rows.append(row(i, -1, k) - row(i + 1, 0, k))
+            values.append(0.)
+    C, values = sparse.csr_matrix(np.array(rows)), np.array(values, dtype=float)
+    points = np.concatenate([[0], np.cumsum([N + 1 for N in Ns])])
+
+    def residual(z):
+        derivs = [Mk @ z for Mk in M]
+        return np.concatenate([F(t, derivs) * np.ones(len(t)), C @ z - values]), derivs
+
+    def jacobian(derivs):
+        d = [np.broadcast_to(dk, t.shape) for dk in dF(t, derivs)]
+        J = [sum(dk[i:j, None] * Mk for dk, Mk in zip(d, blk[1]))
+            for i, j, blk in zip(points[:-1], points[1:], blocks)]
+        return sparse.vstack([sparse.block_diag(J), C], format='csc')
+
+    z = np.zeros(offsets[-1])
+    if guess is not None:
+        for i, (ti, _) in enumerate(blocks):
+            u = chebfun(guess(ti), edges[i:i + 2])
+            z[offsets[i]:offsets[i + 1]] = np.concatenate([u.deriv(order)(ti),
+                [u.deriv(k)(edges[i]) for k in range(order)]])
+
+    G, derivs = residual(z)
+    for it in range(max_iter):
+        dz = spsolve(jacobian(derivs), -G)
+        if np.max(np.abs(dz)) <= tol * max(1., np.max(np.abs(z))):
+            z = z + dz
+            break
+        norm, lam = np.linalg.norm(G), 1.
+        while True:
+            G_new, derivs = residual(z + lam * dz)
+            if np.linalg.norm(G_new) <= (1 - 1e-4 * lam) * norm:
+                break
+            lam /= 2
+            if lam < 1e-6:
+                raise RuntimeError('collocation: line search failed')
+        z, G = z + lam * dz, G_new
+    else:
+        raise RuntimeError(f'collocation: Newton did not converge in {max_iter} iterations')
+
+    pieces, vcoefs = [], []
+    for i, N in enumerate(Ns):
+        zi = z[offsets[i]:offsets[i + 1]]
+        vcoefs.append(chebfun(zi[:N + 1]).coef)
+        pieces.append(Chebyshev(vcoefs[-1], domain=edges[i:i + 2]).integ(order,
+            k=zi[N + 1:][::-1], lbnd=edges[i]))
+    return pieces, vcoefs, it + 1
+
+def spectral_solve(F, dF, domain, conditions, order, N=None, N_min=16, N_split=64,
+    max_points=8192, tol=1e-13, guess=None, info=None):
+    """ collocation solution of F(t, [u, ..., u^(order)]) = 0 on `domain` as a Piecewise
+
+        with `N` given, a single interval of N+1 points. Otherwise hp-adaptive:
+        starting from one interval of `N_min` + 1 points (or the intervals of a
+        Piecewise `guess`), the points of every interval whose last three
+        coefficients of u^(order) exceed `tol` (relative to the largest) are
+        doubled, and intervals with `N_split` + 1 points already are bisected.
+        If Newton fails, the whole mesh is refined. `info` (a dict) receives
+        the number of intervals, points, Newton iterations and the largest tail.
+    """
+    if N:
+        edges, Ns = list(domain), [N]
+    elif isinstance(guess, Piecewise):
+        edges, Ns = guess.edges, [p.degree() - order for p in guess.pieces]
+    else:
+        edges, Ns = list(domain), [N_min]
+    iters = 0
+    while True:
+        try:
+            pieces, vcoefs, it = collocation(F, dF, edges, conditions, Ns, order, guess=guess)
+            iters += it
+            scale = max(np.max(np.abs(c)) for c in vcoefs) or 1.
+            tails = [np.max(np.abs(c[-3:])) / scale for c in vcoefs]
+        except RuntimeError:
+            if N:
+                raise
+            tails = None # too coarse to have a solution near the guess
+        if N or tails is not None and max(tails) <= tol:
+            break
+        new_edges, new_Ns = [edges[0]], []
+        for i, (a, b) in enumerate(zip(edges[:-1], edges[1:])):
+            if tails is not None and tails[i] <= tol:
+                new_edges.append(b)
+                new_Ns.append(Ns[i])
+            elif Ns[i] < N_split:
+                new_edges.append(b)
+                new_Ns.append(2 * Ns[i])
+            else:
+                new_edges += [(a + b) / 2, b]
+                new_Ns += [Ns[i], Ns[i]]
+        if sum(new_Ns) > max_points:
+            raise RuntimeError(f'spectral_solve: not resolved with {max_points} points '
+                               f'({len(Ns)} intervals)')
+        edges, Ns = new_edges, new_Ns
+        if tails is not None:
+            guess = Piecewise(pieces)
+    if info is not None:
+        info.update(intervals=len(Ns), points=sum(N + 1 for N in Ns), iterations=iters,
+            tail=max(tails))
+    return Piecewise(pieces)
+
+def march(F, dF, tspan, y0, h=4., info=None, **kwargs):
+    """ initial value problem F(t, [x, ..., x^(order)]) = 0, x^(k)(t0) = y0[k]
+
+        by Chebyshev time stepping: `spectral_solve` on consecutive windows of
+        length about `h`, each started from the end values of the previous one
+        (Newton on the whole interval needs a guess close to an oscillating
+        solution). Newton starts from the Taylor polynomial of the initial
+        values. `info` receives the total intervals, points and iterations.
+    """
+    order = len(y0)
+    t0, t1 = tspan
+    windows = np.linspace(t0, t1, max(1, int(np.ceil((t1 - t0) / h))) + 1)
+    pieces, total = [], {'intervals': 0, 'points': 0, 'iterations': 0}
+    y = [float(v) for v in y0]
+    for a, b in zip(windows[:-1], windows[1:]):
+        taylor = lambda t, a=a, y=y: sum(v * (t - a)**k / factorial(k) for k, v in enumerate(y))
+        sub = {}
+        sol = spectral_solve(F, dF, (a, b), [(a, k, v) for k, v in enumerate(y)], order,
+            guess=taylor, info=sub, **kwargs)
+        pieces += sol.pieces
+        total = {key: total[key] + sub[key] for key in total}
+        y = [sol.pieces[-1].deriv(k)(b) for k in range(order)]
+    if info is not None:
+        info.update(total)
+    return Piecewise(pieces)
+
+# ===========================
+# references of the problems
+# ===========================
+
+def exp_reference(t_min=0, t_max=10, x0=1., L=1, **kwargs):
+    """ x' + L x = 0, x(t_min) = x0 """
+    return march(lambda t, d: d[1] + L * d[0], lambda t, d: [L, 1.], (t_min, t_max), [x0],
+        **kwargs)
+
+def sho_reference(t_min=0, t_max=4 * np.pi, x0=0., dx_dt0=1., **kwargs):
+    """ x'' + x = 0, x(t_min) = x0, x'(t_min) = dx_dt0 """
+    return march(lambda t, d: d[2] + d[0], lambda t, d: [1., 0., 1.], (t_min, t_max),
+        [x0, dx_dt0], **kwargs)
+
+def nlo_reference(t_min=0, t_max=4 * np.pi, x0=0., dx_dt0=1., beta=.1, omega=1, phi=1,
+    epsilon=.1, **kwargs):
+    """ x'' + 2 beta x' + omega^2 x + phi x^2 + epsilon x^3 = 0, x(t_min) = x0, x'(t_min) = dx_dt0 """
+    F = lambda t, d: d[2] + 2 * beta * d[1] + omega**2 * d[0] + phi * d[0]**2 + epsilon * d[0]**3
+    dF = lambda t, d: [omega**2 + 2 * phi * d[0] + 3 * epsilon * d[0]**2, 2 * beta, 1.]
+    return march(F, dF, (t_min, t_max), [x0, dx_dt0], **kwargs)
+
+class Mirrored():
+    """ even extension u(y) = half(c - |y - c|) of a solution on [ymin, c] """
+    def __init__(self, half, center):
+        self.half = half
+        self.center = center
+
+    def __call__(self, y):
+        return self.half(self.center - np.abs(np.asarray(y) - self.center))
+
+def _geometric_path(start, end, ratio):
+    """ start, ..., end in steps of at most `ratio` """
+    n_steps = int(np.ceil(abs(np.log(end / start)) / np.log(ratio)))
+    return list(np.geomspace(start, end, n_steps + 1)) if n_steps else [end]
+
+def rans_channel_reference(k=0.41/4, nu=0.0055555555, rho=1, dpdx=-1, delta=1, ymin=-1, ymax=1,
+    k_start=0.41/4, nu_start=0.0055555555, ratio=2, info=None, **kwargs):
+    """ RANS channel of solve_rans_scipy_solve_bvp,
+        nu u'' + k^2 d/dy[(y^2 - delta)^2 |u'| u'] = dpdx / rho, u(ymin) = u(ymax) = 0
+
+        solved on the lower half with u'(center) = 0 (there u' >= 0, so the
+        stress k^2 (y^2 - delta)^2 u'^2 is smooth; |u'| is not at the centre)
+        and mirrored. Newton starts from the laminar profile at (`k_start`,
+        `nu_start`, Re_tau = 180) and follows k, then nu (if smaller) in steps
+        of at most `ratio`, each solve starting from the previous profile and mesh
+    """
+    c = (ymin + ymax) / 2
+    nu_0 = max(nu, nu_start)
+    path = [(k_i, nu_0) for k_i in _geometric_path(k_start, k, ratio)]
+    path += [(k, nu_i) for nu_i in _geometric_path(nu_0, nu, ratio)[1:]]
+    half = lambda y: -dpdx / rho / (2 * nu_0) * (y - ymin) * (2 * c - ymin - y) # laminar
+    iters = 0
+    for k_i, nu_i in path:
+        F = lambda y, d, k=k_i, nu=nu_i: nu * d[2] + k**2 * (4 * (y**2 - delta) * y * d[1]**2
+            + 2 * (y**2 - delta)**2 * d[1] * d[2]) - dpdx / rho
+        dF = lambda y, d, k=k_i, nu=nu_i: [0., k**2 * (8 * (y**2 - delta) * y * d[1]
+            + 2 * (y**2 - delta)**2 * d[2]), nu + 2 * k**2 * (y**2 - delta)**2 * d[1]]
+        sub = {}
+        half = spectral_solve(F, dF, (ymin, c), [(ymin, 0, 0.), (c, 1, 0.)], order=2,
+            guess=half, info=sub, **kwargs)
+        iters += sub['iterations']
+    if info is not None:
+        info.update(sub, iterations=iters, steps=len(path))
+    return Mirrored(half, c)
+
+REFERENCES = {'exp': exp_reference, 'sho': sho_reference, 'nlo': nlo_reference,
+    'rans': rans_channel_reference}
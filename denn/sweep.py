@@ -0,0 +1,218 @@
+import os
+import json
+import time
+import multiprocessing as mp
+from copy import deepcopy
+import numpy as np
+import torch
+
+from denn.utils import dict_product, config_hash
+from denn.cache import _NON_RESULT_KEYS
+
+def set_dotted(params, key, value):
+    """ set `params['training']['g_lr']` from key 'training.g_lr' """
+    d = params
+    *path, last = key.split('.')
+    for k in path:
+        d = d.setdefault(k, {})
+    d[last] = value
+
+def apply_hypers(params, hypers):
+    """ return a copy of `params` with dotted `hypers` (e.g. training.g_lr) applied """
+    params = deepcopy(params)
+    for k, v in hypers.items():
+        set_dotted(params, k, v)
+    # ensure plotting / saving is off
+    params['training']['plot'] = False
+    params['training']['save'] = False
+    params['training']['log'] = False
+    return params
+
+def base_hash(params, hypers):
+    """ hash of the base `params` a sweep starts from, without the swept keys and seed """
+    params = deepcopy(params)
+    for key in list(hypers) + ['training.seed'] + [f'training.{k}' for k in _NON_RESULT_KEYS]:
+        d = params
+        *path, last = key.split('.')
+        for k in path:
+            d = d.get(k, {})
+        d.pop(last, None)
+    return config_hash(params)
+
+def cell_key(pkey, method, params, hypers, seed):
+    """ id of one (hypers, seed) cell of a sweep over base `params`
+
+        the base params are part of the key, so records of a sweep file
+        written with another config are not resumed from
+    """
+    return config_hash({'pkey': pkey.lower().strip(), 'method': method,
+        'base': base_hash(params, hypers), 'hypers': hypers, 'seed': seed})
+
+def make_cells(pkey, params, space, nreps=1, gan=False):
+    """ grid cells (dict_product of `space`) x replication seeds """
+    method = 'gan' if gan else 'L2'
+    cells = []
+    for hypers in dict_product(space):
+        for seed in range(nreps):
+            cells.append({'key': cell_key(pkey, method, params, hypers, seed),
+                'hypers': hypers, 'seed': seed})
+    return cells
+
+def load_sweep(fname):
+    """ records of a sweep results file (last record per cell wins) """
+    records = {}
+    if not os.path.exists(fname):
+        return records
+    with open(fname, 'r') as f:
+        for line in f:
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                continue # partially written line from an interrupted sweep
+            records[rec['key']] = rec
+    return records
+
+def shared_problem(pkey, params):
+    """ build the problem (grids, reference solution) once and move it to shared memory """
+    from denn.experiments import get_problem
+    return get_problem(pkey, params).share_memory()
+
+# per-worker state, set once by the pool initializer
+_WORKER = {}
+
+def _init_worker(threads, pkey, params, gan, force, problem=None):
+    torch.set_num_threads(threads)
+    _WORKER.update(pkey=pkey, params=params, gan=gan, force=force, problem=problem)
+
+# cost measures reported by the trainers (`res['timing']`)
+COSTS = ['wall_seconds', 'cpu_seconds', 'steps']
+
+def _val_trace(val, points=100):
+    """ running min of val mse at (up to) `points` evenly spaced steps: [[step, mse], ...] """
+    best = np.minimum.accumulate(np.asarray(val, dtype=float))
+    idx = np.unique(np.linspace(0, len(val) - 1, min(points, len(val))).astype(int))
+    return [[int(i) + 1, float(best[i])] for i in idx]
+
+def _run_cell(cell):
+    """ run one cell in a worker and return its record (never raises) """
+    from denn.experiments import run_experiment
+
+    pkey, gan = _WORKER['pkey'], _WORKER['gan']
+    params = apply_hypers(_WORKER['params'], cell['hypers'])
+    params['training']['seed'] = cell['seed']
+    rec = dict(cell, pkey=pkey, method='gan' if gan else 'L2', pid=os.getpid())
+    t0 = time.time()
+    try:
+        # the shared problem is only valid if the cell does not change it
+        problem = None if any(k.startswith('problem.') for k in cell['hypers']) \
+            else _WORKER['problem']
+        res = run_experiment(pkey, params, gan=gan, force=_WORKER['force'], problem=problem)
+        val = res['mses']['val']
+        rec.update(final_val_mse=float(val[-1]), best_val_mse=float(np.min(val)),
+            final_train_mse=float(res['mses']['train'][-1]),
+            cached=res.get('cached', False), run_id=res.get('run_id'),
+            val_trace=_val_trace(val), **res.get('timing', {}))
+    except Exception as e:
+        rec.update(status='failed', error=repr(e), seconds=time.time() - t0)
+        return rec
+    rec.update(status='finished', seconds=time.time() - t0)
+    return rec
+
+def run_sweep(pkey, params, space, fname, gan=False, nreps=1, **kwargs):
+    """ grid search over `space` x `nreps` seeds (see `run_cells`) """
+    cells = make_cells(pkey, params, space, nreps=nreps, gan=gan)
+    return run_cells(pkey, params, cells, fname, gan=gan, **kwargs)
+
+def run_cells(pkey, params, cells, fname, gan=False, workers=None, threads=None,
+    force=False, retries=0):
+    """ run sweep `cells` with a bounded process pool
+
+        each worker pins torch to `threads` intra-op threads (default: CPUs / workers);
+        records are appended to `fname` (JSON lines) as soon as a cell finishes,
+        so an interrupted sweep resumes by skipping cells already finished there.
+        Failed cells are resubmitted up to `retries` times; every failure is recorded.
+    """
+    done = {} if force else {k: r for k, r in load_sweep(fname).items()
+        if r.get('status') == 'finished'}
+    todo = [c for c in cells if c['key'] not in done]
+    workers = max(1, min(workers or mp.cpu_count(), len(todo)))
+    threads = threads or max(1, mp.cpu_count() // workers)
+    print(f'{len(cells)} cells, {len(cells) - len(todo)} already done, '
+          f'{len(todo)} to run on {workers} workers x {threads} threads')
+    if not todo:
+        return [done[c['key']] for c in cells]
+
+    records = dict(done)
+    problem = shared_problem(pkey, params)
+    with open(fname, 'a') as f, mp.Pool(workers, initializer=_init_worker,
+        initargs=(threads, pkey, params, gan, force, problem)) as pool:
+        for attempt in range(retries + 1):
+            failed = []
+            for i, rec in enumerate(pool.imap_unordered(_run_cell, todo)):
+                rec['attempt'] = attempt
+                f.write(json.dumps(rec, default=str) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+                records[rec['key']] = rec
+                mse = rec.get('final_val_mse', rec.get('error'))
+                print(f'[{i+1}/{len(todo)}] {rec["status"]} seed={rec["seed"]} {rec["hypers"]}: {mse}')
+                if rec['status'] == 'failed':
+                    failed.append({k: rec[k] for k in ['key', 'hypers', 'seed']})
+            if not failed:
+                break
+            todo = failed
+            if attempt < retries:
+                print(f'Retrying {len(failed)} failed cells')
+    return [records[c['key']] for c in cells if c['key'] in records]
+
+def time_to_target(rec, target, cost='wall_seconds'):
+    """ `cost` spent until the best val mse of a run first reached `target` (inf if never)
+
+        assumes steps cost the same, so the run's cost is prorated to the
+        step (within 1% of the run) where the target was reached
+    """
+    if rec.get('status') != 'finished' or cost not in rec or not rec.get('steps'):
+        return np.inf
+    for step, mse in rec.get('val_trace', []):
+        if mse <= target:
+            return rec[cost] * step / rec['steps']
+    return np.inf
+
+def summarize(records, metric='final_val_mse', target=None, cost='wall_seconds'):
+    """ mean / std of `metric` over seeds per hyper setting, best first
+
+        rows also hold the mean training cost (wall / CPU seconds, steps) and,
+        with a `target`, the mean `cost` to reach it (inf if any seed never did)
+    """
+    groups = {}
+    for rec in records:
+        if rec.get('status') != 'finished':
+            continue
+        h = json.dumps(rec['hypers'], sort_keys=True)
+        groups.setdefault(h, []).append(rec)
+    rows = []
+    for h, recs in groups.items():
+        v = [r[metric] for r in recs]
+        row = {'hypers': json.loads(h), 'mean': float(np.mean(v)), 'std': float(np.std(v)),
+            'n': len(v)}
+        for c in COSTS:
+            row[c] = float(np.mean([r.get(c, np.nan) for r in recs]))
+        if target is not None:
+            row['time_to_target'] = float(np.mean([time_to_target(r, target, cost) for r in recs]))
+        rows.append(row)
+    return sorted(rows, key=lambda r: r['mean'])
+
+def pareto_front(rows, objectives=('mean', 'wall_seconds')):
+    """ rows not dominated in all `objectives` (all minimized), sorted by the first """
+    pts = np.array([[r[o] for o in objectives] for r in rows], dtype=float)
+    front = []
+    for i, p in enumerate(pts):
+        dominated = np.any(np.all(pts <= p, axis=1) & np.any(pts < p, axis=1))
+        if not dominated:
+            front.append(rows[i])
+    return sorted(front, key=lambda r: r[objectives[0]])
+
+def fastest_to_target(rows):
+    """ rows (from `summarize(..., target=...)`) that reached the target, fastest first """
+    return sorted([r for r in rows if np.isfinite(r['time_to_target'])],
+        key=lambda r: r['time_to_target'])
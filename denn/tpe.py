@@ -0,0 +1,259 @@
+import json
+import math
+import argparse
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import numpy as np
+
+from denn.config.config import get_config, get_sweep_space
+from denn.utils import flatten_dict
+from denn.sweep import cell_key, _init_worker, _run_cell, shared_problem
+
+_erf = np.vectorize(math.erf)
+
+def _ndtr(z):
+    return 0.5 * (1 + _erf(z / np.sqrt(2)))
+
+def _parzen(obs, lo, hi):
+    """ gaussian mixture over observations plus a wide prior component on [lo, hi]
+
+        bandwidth of each point is the larger gap to its neighbours, clipped
+        to [(hi-lo)/min(100, n+1), hi-lo] (as in hyperopt)
+    """
+    mus = np.append(np.asarray(obs, dtype=float), 0.5 * (lo + hi))
+    order = np.argsort(mus)
+    s = mus[order]
+    gaps = np.diff(np.concatenate([[lo], s, [hi]]))
+    sigmas = np.empty_like(mus)
+    sigmas[order] = np.maximum(gaps[:-1], gaps[1:])
+    sigmas = np.clip(sigmas, (hi - lo) / min(100., len(mus) + 1.), hi - lo)
+    sigmas[-1] = hi - lo
+    return mus, sigmas
+
+def _parzen_logpdf(x, mus, sigmas, lo, hi):
+    """ log density of the (truncated, equally weighted) mixture at points `x` """
+    x = np.asarray(x, dtype=float)[:, None]
+    mass = _ndtr((hi - mus) / sigmas) - _ndtr((lo - mus) / sigmas)
+    pdf = np.exp(-0.5 * ((x - mus) / sigmas)**2) / (sigmas * np.sqrt(2 * np.pi) * mass)
+    return np.log(pdf.mean(axis=1) + 1e-300)
+
+def _parzen_sample(mus, sigmas, lo, hi, n, rng):
+    """ `n` draws from the mixture, redrawn until inside [lo, hi] """
+    idx = rng.randint(len(mus), size=n)
+    x = rng.normal(mus[idx], sigmas[idx])
+    bad = (x < lo) | (x > hi)
+    while bad.any():
+        x[bad] = rng.normal(mus[idx[bad]], sigmas[idx[bad]])
+        bad = (x < lo) | (x > hi)
+    return x
+
+class TPESampler():
+    """ tree-structured Parzen estimator over a YAML search space
+
+        `space` maps dotted config keys to specs:
+            {type: uniform | loguniform, low, high, size (optional)}
+            {type: categorical, choices}
+        plus an optional `condition: {dotted key: value(s)}`; a parameter is
+        only sampled when the condition holds for earlier parameters or the
+        base config. After `n_startup` random trials, each parameter is drawn
+        from l(x) (density of the best `gamma` fraction of observations with it
+        active) and the candidate maximizing l(x)/g(x) is kept.
+    """
+    def __init__(self, space, n_startup=10, gamma=0.25, n_candidates=24, seed=0):
+        self.space = space
+        self.n_startup = n_startup
+        self.gamma = gamma
+        self.n_candidates = n_candidates
+        self.rng = np.random.RandomState(seed)
+        self.observations = [] # (values, score)
+
+    def observe(self, values, score):
+        score = float(score) if score is not None and np.isfinite(score) else np.inf
+        self.observations.append((values, score))
+
+    def values_from_config(self, config):
+        """ search-space values of a full config (None if some value is out of the space) """
+        flat = flatten_dict(config)
+        values = {}
+        for key, spec in self.space.items():
+            if not self._active(spec, values, flat):
+                continue
+            if key not in flat or not self._contains(spec, flat[key]):
+                return None
+            values[key] = flat[key]
+        return values
+
+    def _active(self, spec, values, base):
+        for k, allowed in (spec.get('condition') or {}).items():
+            allowed = allowed if isinstance(allowed, list) else [allowed]
+            if values.get(k, base.get(k)) not in allowed:
+                return False
+        return True
+
+    def _contains(self, spec, v):
+        if spec['type'] == 'categorical':
+            return v in spec['choices']
+        v = np.atleast_1d(np.asarray(v, dtype=float))
+        return len(v) == spec.get('size', 1) and \
+            bool(np.all((v >= spec['low']) & (v <= spec['high'])))
+
+    def _split(self, key):
+        """ observed values of `key` among the good / bad trials """
+        obs = sorted(self.observations, key=lambda o: o[1])
+        n_good = max(1, int(math.ceil(self.gamma * len(obs))))
+        good = [v[key] for v, _ in obs[:n_good] if key in v]
+        bad = [v[key] for v, _ in obs[n_good:] if key in v]
+        return good, bad
+
+    def _sample_numeric(self, key, spec):
+        log = spec['type'] == 'loguniform'
+        lo, hi = (np.log(spec['low']), np.log(spec['high'])) if log else (spec['low'], spec['high'])
+        size = spec.get('size', 1)
+        good, bad = self._split(key)
+        good = np.asarray(good, dtype=float).reshape(len(good), size)
+        bad = np.asarray(bad, dtype=float).reshape(len(bad), size)
+        if log:
+            good, bad = np.log(good), np.log(bad)
+        out = []
+        for j in range(size): # components are modelled independently
+            if len(good) == 0 or len(self.observations) < self.n_startup:
+                x = self.rng.uniform(lo, hi)
+            else:
+                l = _parzen(good[:, j], lo, hi)
+                g = _parzen(bad[:, j], lo, hi)
+                cand = _parzen_sample(*l, lo, hi, self.n_candidates, self.rng)
+                ei = _parzen_logpdf(cand, *l, lo, hi) - _parzen_logpdf(cand, *g, lo, hi)
+                x = cand[np.argmax(ei)]
+            out.append(float(np.exp(x)) if log else float(x))
+        return out if 'size' in spec else out[0]
+
+    def _sample_categorical(self, key, spec):
+        choices = spec['choices']
+        good, bad = self._split(key)
+        if len(good) == 0 or len(self.observations) < self.n_startup:
+            return choices[self.rng.randint(len(choices))]
+        count = lambda vals: np.array([sum(v == c for v in vals) for c in choices], dtype=float)
+        pl = (count(good) + 1) / (len(good) + len(choices))
+        pg = (count(bad) + 1) / (len(bad) + len(choices))
+        cand = self.rng.choice(len(choices), size=self.n_candidates, p=pl)
+        return choices[cand[np.argmax(np.log(pl[cand]) - np.log(pg[cand]))]]
+
+    def sample(self, base=None):
+        """ propose {dotted key: value} for the active parameters """
+        base = flatten_dict(base or {})
+        values = {}
+        for key, spec in self.space.items():
+            if not self._active(spec, values, base):
+                continue
+            if spec['type'] == 'categorical':
+                values[key] = self._sample_categorical(key, spec)
+            elif spec['type'] in ['uniform', 'loguniform']:
+                values[key] = self._sample_numeric(key, spec)
+            else:
+                raise ValueError(f"Unknown search space type {spec['type']} for {key}")
+        return values
+
+def warm_start(sampler, pkey, method, params, metric='final_val_mse'):
+    """ observe finished runs of the registry with the same problem, method and niters """
+    from denn.registry import RunRegistry
+    reg = RunRegistry()
+    rows = reg.configs(metric, where={'method': method,
+        'training.niters': params['training']['niters']}, pkey=pkey)
+    reg.close()
+    n = 0
+    for config, score in rows:
+        values = sampler.values_from_config(config)
+        if values is not None and score is not None:
+            sampler.observe(values, score)
+            n += 1
+    return n
+
+def run_tpe(pkey, params, space, fname, gan=False, ntrials=50, workers=None,
+    threads=None, seed=0, warm=True, force=False, **sampler_kwargs):
+    """ asynchronous TPE search: a new config is proposed as soon as a trial finishes """
+    method = 'gan' if gan else 'L2'
+    sampler = TPESampler(space, seed=seed, **sampler_kwargs)
+    if warm:
+        print(f'Warm start from {warm_start(sampler, pkey, method, params)} registry runs')
+    workers = max(1, min(workers or mp.cpu_count(), ntrials))
+    threads = threads or max(1, mp.cpu_count() // workers)
+    training_seed = params['training']['seed']
+
+    records = []
+    with open(fname, 'a') as f, ProcessPoolExecutor(workers, initializer=_init_worker,
+        initargs=(threads, pkey, params, gan, force, shared_problem(pkey, params))) as pool:
+        def submit():
+            values = sampler.sample(params)
+            cell = {'key': cell_key(pkey, method, params, values, training_seed),
+                'hypers': values, 'seed': training_seed}
+            return pool.submit(_run_cell, cell)
+
+        running = {submit() for _ in range(workers)}
+        submitted = workers
+        while running:
+            finished, running = wait(running, return_when=FIRST_COMPLETED)
+            for fut in finished:
+                rec = fut.result()
+                sampler.observe(rec['hypers'], rec.get('final_val_mse'))
+                records.append(rec)
+                f.write(json.dumps(rec, default=str) + '\n')
+                f.flush()
+                best = min(r.get('final_val_mse', np.inf) for r in records)
+                print(f"[{len(records)}/{ntrials}] {rec['status']}: "
+                      f"{rec.get('final_val_mse', rec.get('error'))} (best {best:.4e})")
+                if submitted < ntrials:
+                    running.add(submit())
+                    submitted += 1
+    return records
+
+def trials_to_target(records, target):
+    """ number of completed trials until `final_val_mse <= target` (None if never) """
+    for i, rec in enumerate(records):
+        if rec.get('final_val_mse', np.inf) <= target:
+            return i + 1
+    return None
+
+if __name__ == "__main__":
+    args = argparse.ArgumentParser()
+    args.add_argument('--pkey', type=str, default='EXP',
+        help='problem to run (exp=Exponential, sho=SimpleOscillator, nlo=NonlinearOscillator)')
+    args.add_argument('--classical', action='store_true', default=False,
+        help='whether to use classical training, default False (use GAN))')
+    args.add_argument('--ntrials', type=int, default=50)
+    args.add_argument('--startup', type=int, default=10,
+        help='random trials before the model is used (warm-start runs count)')
+    args.add_argument('--random', action='store_true', default=False,
+        help='pure random search over the same space (baseline)')
+    args.add_argument('--no-warm-start', action='store_true', default=False,
+        help='ignore finished runs in the registry')
+    args.add_argument('--target', type=float, default=None,
+        help='report the number of trials needed to reach this val MSE')
+    args.add_argument('--workers', type=int, default=None,
+        help='number of worker processes, default all CPUs')
+    args.add_argument('--threads', type=int, default=None,
+        help='torch threads per worker, default CPUs / workers')
+    args.add_argument('--seed', type=int, default=0)
+    args.add_argument('--fname', type=str, default=None,
+        help='trial records (JSON lines), default {PKEY}_{method}_tpe.jsonl')
+    args.add_argument('--force', action='store_true', default=False,
+        help='re-run trials even if a cached result exists')
+    args = args.parse_args()
+
+    gan = not args.classical
+    method = 'gan' if gan else 'L2'
+    fname = args.fname or f'{args.pkey.upper()}_{method}_tpe.jsonl'
+    params = get_config(args.pkey)
+    params['training'].update(log=False, plot=False, save=False)
+    space = get_sweep_space(args.pkey, method, name='search_space')
+
+    records = run_tpe(args.pkey, params, space, fname, gan=gan, ntrials=args.ntrials,
+        workers=args.workers, threads=args.threads, seed=args.seed,
+        warm=not (args.no_warm_start or args.random), force=args.force,
+        n_startup=args.ntrials if args.random else args.startup)
+
+    done = sorted([r for r in records if r['status'] == 'finished'],
+        key=lambda r: r['final_val_mse'])
+    if done:
+        print(f"Best val MSE {done[0]['final_val_mse']:.4e} with {done[0]['hypers']}")
+    if args.target is not None:
+        print(f'Trials to reach {args.target:.1e}: {trials_to_target(records, args.target)}')
@@ -1,10 +1,54 @@
+import time
 import argparse
+from functools import partial
 import numpy as np
 import torch
 from denn.config.config import get_config
-from denn.rk4 import rk4
-from denn.fd import fd
-from denn.problems import NonlinearOscillator, CoupledOscillator, SIRModel
+from denn.rk4 import rk4, rk4_batch
+from denn.integrators import embedded_rk, symplectic, EMBEDDED, SYMPLECTIC
+from denn.spectral import REFERENCES
+from denn.fd import solve_problem, poisson_solution, SOLVERS as FD_SOLVERS
+from denn.multigrid import CYCLES, SMOOTHERS
+from denn.problems import NonlinearOscillator, CoupledOscillator, SIRModel, PoissonEquation
+
+METHODS = ['rk4'] + list(EMBEDDED) + list(SYMPLECTIC) + ['spectral']
+
+def integrate(deriv, tspan, y0, n, method='rk4', tol=None):
+    """ solution on the uniform `n`-step grid and its cost in function evaluations
+
+        'rk4' takes the `n` fixed steps; the embedded pairs ('dopri5', 'bs23')
+        choose their own steps for rtol = atol = `tol` (default 1e-6) and are
+        evaluated on the grid with their dense output
+    """
+    tol = 1e-6 if tol is None else tol
+    if method == 'rk4':
+        t, y = rk4(deriv, tspan, y0, n)
+        return t, y, 4 * n
+    if method == 'spectral':
+        raise ValueError('Spectral collocation is implemented for exp, sho and nlo only')
+    if method not in EMBEDDED:
+        raise ValueError(f'Method {method} needs a (q, p) splitting; only sho / coo have one')
+    res = embedded_rk(deriv, tspan, y0, method=method, rtol=tol, atol=tol)
+    t = np.linspace(tspan[0], tspan[1], n + 1)
+    return t, res['sol'](t), res['nfev']
+
+def collocate(pkey, tspan, y0, n, tol=None):
+    """ Chebyshev collocation reference of exp / sho / nlo (denn.spectral) on the
+        uniform `n`-step grid; the cost is a dict of intervals, collocation
+        points and Newton iterations. `tol` bounds the trailing coefficients
+        (default 1e-13)
+    """
+    info = {}
+    sol = REFERENCES[pkey](*tspan, *y0, info=info, **({} if tol is None else {'tol': tol}))
+    t = np.linspace(tspan[0], tspan[1], n + 1)
+    return t, sol(t)[:, None], info
+
+def _report(mse, cost):
+    if isinstance(cost, dict): # collocation
+        print(f"MSE: {mse} | collocation points: {cost['points']} ({cost['intervals']} "
+              f"intervals), Newton iterations: {cost['iterations']}")
+    else:
+        print(f"MSE: {mse} | function evaluations: {cost}")
 
 def exp_deriv(t, x):
     """
@@ -13,12 +57,15 @@ def exp_deriv(t, x):
     rhs = -x
     return rhs
 
-def solve_exp(params):
-    t, sol = rk4(exp_deriv, [0, 10], 1, 100)
+def solve_exp(params, method='rk4', tol=None, n=100):
+    if method == 'spectral':
+        t, sol, nfev = collocate('exp', [0, 10], [1], n, tol=tol)
+    else:
+        t, sol, nfev = integrate(exp_deriv, [0, 10], 1, n, method=method, tol=tol)
     sol = sol[:, 0]
     true = np.exp(-t)
     mse = np.mean((true-sol)**2)
-    print(f"MSE: {mse}")
+    _report(mse, nfev)
     return t, sol, true
 
 def sho_deriv(t, xz):
@@ -31,15 +78,22 @@ def sho_deriv(t, xz):
     rhs = np.array([z, -x])
     return rhs
 
-def solve_sho(params):
-    t, sol = rk4(sho_deriv, [0, 6.28], [0,1], 400)
+def solve_sho(params, method='rk4', tol=None, n=400):
+    if method == 'spectral':
+        t, sol, nfev = collocate('sho', [0, 6.28], [0, 1], n, tol=tol)
+    elif method in SYMPLECTIC:
+        # q = x, p = z: H = (p^2 + q^2) / 2
+        res = symplectic(lambda t, p: p, lambda t, q: -q, [0, 6.28], [0], [1], n, method=method)
+        t, sol, nfev = res['t'], res['q'], res['nfev']
+    else:
+        t, sol, nfev = integrate(sho_deriv, [0, 6.28], [0,1], n, method=method, tol=tol)
     sol = sol[:,0]
     true = np.sin(t)
     mse = np.mean((true-sol)**2)
-    print(f"MSE: {mse}")
+    _report(mse, nfev)
     return t, sol, true
 
-def nlo_deriv(t, xz):
+def nlo_deriv(t, xz, b=0.1, e=0.1, o=1, p=1):
     """
     $$ \ddot{x} + 2 \beta \dot{x} + \omega^{2} x + \phi x^{2} + \epsilon x^{3} = f(t) $$
     dxdt = z
@@ -55,24 +109,22 @@ def nlo_deriv(t, xz):
     t_max: 12.56
     dx_dt0: 0.5
     """
-    b = 0.1
-    e = 0.1
-    o = 1
-    p = 1
-
     x = xz[0]
     z = xz[1]
     rhs = np.array([z, -2*b*z - o*o*x - p*x*x - e*(x**3)])
     return rhs
 
-def solve_nlo(params):
-    t, sol = rk4(nlo_deriv, [0, 12.56], [0, 0.5], 1000)
+def solve_nlo(params, method='rk4', tol=None, n=1000):
+    if method == 'spectral':
+        t, sol, nfev = collocate('nlo', [0, 12.56], [0, 0.5], n, tol=tol)
+    else:
+        t, sol, nfev = integrate(nlo_deriv, [0, 12.56], [0, 0.5], n, method=method, tol=tol)
     sol = sol[:,0]
     nlo = NonlinearOscillator(dx_dt0=0.5, n=1000)
     true = nlo.get_solution(t).numpy()
     true = true[:,0]
     mse = np.mean((true-sol)**2)
-    print(f"MSE: {mse}")
+    _report(mse, nfev)
     return t, sol, true
 
 def coo_deriv(t, xy):
@@ -87,59 +139,94 @@ def coo_deriv(t, xy):
     return np.array([rhs1, rhs2])
     return rhs
 
-def solve_coo(params):
-    t, sol = rk4(coo_deriv, [0, 6.28], [1, 0], 800)
+def solve_coo(params, method='rk4', tol=1e-6, n=800):
+    if method in SYMPLECTIC:
+        # q = y, p = x: H = t (p^2 + q^2) / 2
+        res = symplectic(lambda t, p: t*p, lambda t, q: -t*q, [0, 6.28], [0], [1], n, method=method)
+        t, sol, nfev = res['t'], np.hstack((res['p'], res['q'])), res['nfev']
+    else:
+        t, sol, nfev = integrate(coo_deriv, [0, 6.28], [1, 0], n, method=method, tol=tol)
     true = CoupledOscillator(x0=1, y0=0, n=800).get_solution(torch.tensor(t))
     mse = np.mean( (sol - true.numpy())**2 )
-    print(f"MSE: {mse}")
+    _report(mse, nfev)
     return t, sol, true
 
-def sir_deriv(t, sir):
+def sir_deriv(t, sir, beta=3, gamma=1, N=1):
     """
-    dxdt = z
-    dzdt = -x
+    dSdt = -beta I S / N
+    dIdt = beta I S / N - gamma I
+    dRdt = gamma I
     """
     S, I, R = sir[0], sir[1], sir[2]
 
-    beta = 3
-    N = 1
-    gamma = 1
-
     rhs1 = -beta*I*S/N
     rhs2 = (beta*I*S/N) - gamma*I
     rhs3 = gamma*I
     return np.array([rhs1, rhs2, rhs3])
 
-def solve_sir(params):
-    t, sol = rk4(sir_deriv, [0, 10], [0.99, 0.01, 0.00], 800)
+def solve_sir(params, method='rk4', tol=1e-6, n=800):
+    t, sol, nfev = integrate(sir_deriv, [0, 10], [0.99, 0.01, 0.00], n, method=method, tol=tol)
     true = SIRModel(S0=0.99, I0=0.01, R0=0.00, beta=3, gamma=1, n=800).get_solution(t)
     mse = np.mean( (sol - true.numpy())**2 )
-    print(f"MSE: {mse}")
+    _report(mse, nfev)
     return t, sol, true
 
-def solve_pos(params):
-    X, Y, sol = fd()
-    true = X*(1-X)*Y*(1-Y)*np.exp(X-Y)
+def solve_pos(params, M=None, solver='splu', **mg_kwargs):
+    """ FD solution on the grid of the configured PoissonEquation (M x M if given) """
+    problem = PoissonEquation(**dict(params['problem'], **({'nx': M, 'ny': M} if M else {})))
+    if solver == 'mg': # report the convergence of every cycle
+        mg_kwargs['verbose'] = True
+    t0 = time.perf_counter()
+    sol = solve_problem(problem, solver=solver, **mg_kwargs)
+    seconds = time.perf_counter() - t0
+    x, y = (g.detach().numpy().astype(float) for g in problem.get_grid())
+    true = poisson_solution(x, y)
     mse = np.mean( (sol - true)**2 )
-    print(f"MSE: {mse}")
-    return X, Y, sol, true
+    print(f"MSE: {mse} | {problem.nx}x{problem.ny} grid, {solver} solve in {seconds:.3f}s")
+    return x, y, sol, true
+
+# right hand side and time span of the ODE problems, for ensembles
+ODES = {
+    'exp': (exp_deriv, [0, 10]),
+    'sho': (sho_deriv, [0, 6.28]),
+    'nlo': (nlo_deriv, [0, 12.56]),
+    'sir': (sir_deriv, [0, 10]),
+    'coo': (coo_deriv, [0, 6.28]),
+}
+
+def solve_ensemble(pkey, y0, n, stride=1, tspan=None, **params):
+    """ integrate a batch of initial conditions `y0[b, m]` at once with batched RK4
+
+        keyword parameters of the right hand side (e.g. `beta`, `gamma` for sir,
+        `b`, `e`, `o`, `p` for nlo) may be scalars or arrays of shape [b], one
+        value per trajectory; returns t[k] and y[k, b, m] (float64)
+    """
+    deriv, default_tspan = ODES[pkey.lower().strip()]
+    params = {k: np.asarray(v, dtype=np.float64) for k, v in params.items()}
+    return rk4_batch(partial(deriv, **params), tspan or default_tspan, y0, n, stride=stride)
 
-def solve(pkey, params):
+def solve(pkey, params, M=None, fd_solver=None, cycle=None, smoother=None, **kwargs):
     """ helper to parse problem key and return appropriate problem
+        (`method`, `tol` and `n` select the ODE integrator, see `integrate` /
+        `collocate`; `M` and `fd_solver` the FD grid and linear solver of pos,
+        `cycle` and `smoother` its multigrid options)
     """
     pkey = pkey.lower().strip()
+    kwargs = {k: v for k, v in kwargs.items() if v is not None}
+    fd_kwargs = {k: v for k, v in [('M', M), ('solver', fd_solver), ('cycle', cycle),
+        ('smoother', smoother)] if v is not None}
     if pkey == 'exp':
-        solve_exp(params)
+        solve_exp(params, **kwargs)
     elif pkey == 'sho':
-        solve_sho(params)
+        solve_sho(params, **kwargs)
     elif pkey == 'nlo':
-        solve_nlo(params)
+        solve_nlo(params, **kwargs)
     elif pkey == 'pos':
-        solve_pos(params)
+        solve_pos(params, **fd_kwargs)
     elif pkey == 'sir':
-        solve_sir(params)
+        solve_sir(params, **kwargs)
     elif pkey == 'coo':
-        solve_coo(params)
+        solve_coo(params, **kwargs)
     else:
         raise RuntimeError(f'Did not understand problem key (pkey): {pkey}')
 
@@ -147,6 +234,26 @@ if __name__=='__main__':
     args = argparse.ArgumentParser()
     args.add_argument('--pkey', type=str, default='EXP',
         help='problem to run (exp=Exponential, sho=SimpleOscillator, nlo=NonlinearOscillator)')
+    args.add_argument('--method', type=str, default=None, choices=METHODS,
+        help='ODE integrator, default rk4 (dopri5 if --tol is given); '
+             'leapfrog / yoshida4 for sho and coo only, spectral (Chebyshev '
+             'collocation) for exp, sho and nlo only')
+    args.add_argument('--tol', type=float, default=None,
+        help='target tolerance (rtol = atol) of the adaptive methods, '
+             'trailing Chebyshev coefficients with spectral')
+    args.add_argument('--n', type=int, default=None,
+        help='steps of the fixed-step methods / output grid size, default per problem')
+    args.add_argument('--M', type=int, default=None,
+        help='pos: points per side of the FD grid, default the problem nx / ny')
+    args.add_argument('--fd-solver', type=str, default=None, choices=FD_SOLVERS,
+        help='pos: sparse LU (splu, default), Jacobi-preconditioned CG (cg), '
+             'fast sine transform (dst) or geometric multigrid (mg), the last two for large M')
+    args.add_argument('--cycle', type=str, default=None, choices=list(CYCLES),
+        help='pos with mg: multigrid cycle, default V')
+    args.add_argument('--smoother', type=str, default=None, choices=SMOOTHERS,
+        help='pos with mg: weighted Jacobi or red-black Gauss-Seidel (rbgs, default)')
     args = args.parse_args()
     params = get_config(args.pkey)
-    res = solve(args.pkey, params)
+    method = args.method or ('rk4' if args.tol is None else 'dopri5')
+    res = solve(args.pkey, params, method=method, tol=args.tol, n=args.n,
+        M=args.M, fd_solver=args.fd_solver, cycle=args.cycle, smoother=args.smoother)
@@ -3,15 +3,25 @@ import torch
 from torch import autograd
 import numpy as np
 import itertools
-import matplotlib.pyplot as plt
-from IPython.display import clear_output
-import pandas as pd
-
-# global plot params
-plt.rc('axes', titlesize=15, labelsize=15)
-plt.rc('legend', fontsize=15)
-plt.rc('xtick', labelsize=13)
-plt.rc('ytick', labelsize=13)
+import time
+import json
+import hashlib
+
+# matplotlib / IPython / pandas are only imported by the plotting helpers
+# (see `_pyplot`) so that training workers start quickly
+_PLOT_PARAMS_SET = False
+
+def _pyplot():
+    """ import pyplot on first use and apply the global plot params """
+    global _PLOT_PARAMS_SET
+    import matplotlib.pyplot as plt
+    if not _PLOT_PARAMS_SET:
+        plt.rc('axes', titlesize=15, labelsize=15)
+        plt.rc('legend', fontsize=15)
+        plt.rc('xtick', labelsize=13)
+        plt.rc('ytick', labelsize=13)
+        _PLOT_PARAMS_SET = True
+    return plt
 
 def diff(x, t, order=1):
     """The derivative of a variable with respect to another.
@@ -31,9 +41,15 @@ def diff(x, t, order=1):
         der, = autograd.grad(der, t, create_graph=True, grad_outputs=ones)
     return der
 
+def meshgrid_ij(x, y):
+    """ torch.meshgrid(x, y) in 'ij' order, without its `indexing` argument
+        (only in torch >= 1.10, and a warning when omitted) """
+    return x.repeat_interleave(len(y)).reshape(len(x), len(y)), y.repeat(len(x)).reshape(len(x), len(y))
+
 def plot_results(mse_dict, loss_dict, grid, pred_dict, diff_dict=None, clear=False,
     save=False, dirname=None, logloss=False, alpha=0.8):
     """ helpful plotting function """
+    plt = _pyplot()
 
     plt.rc('axes', titlesize=15, labelsize=15)
     plt.rc('legend', fontsize=15)
@@ -41,6 +57,7 @@ def plot_results(mse_dict, loss_dict, grid, pred_dict, diff_dict=None, clear=Fal
     plt.rc('ytick', labelsize=13)
 
     if clear:
+      from IPython.display import clear_output
       clear_output(True)
 
     if save and not dirname:
@@ -128,26 +145,20 @@ def plot_results(mse_dict, loss_dict, grid, pred_dict, diff_dict=None, clear=Fal
 
     plt.tight_layout()
     if save:
-        print(f'Saving results to {dirname}')
+        # run data (histories, preds, config) is written by `denn.runstore`
+        print(f'Saving plot to {dirname}')
         if not os.path.exists(dirname):
-            os.mkdir(dirname)
+            os.makedirs(dirname)
         plt.savefig(os.path.join(dirname, 'plot.png'))
-        np.save(os.path.join(dirname, "grid"), grid)
-        for k, v in mse_dict.items():
-            np.save(os.path.join(dirname, f"{k}_mse"), v)
-        for k, v in loss_dict.items():
-            np.save(os.path.join(dirname, f"{k}_loss"), v)
-        for k, v in pred_dict.items():
-            np.save(os.path.join(dirname, f"{k}_pred"), v)
-        if diff_dict:
-            for k, v in diff_dict.items():
-                np.save(os.path.join(dirname, f"{k}_diff"), v)
+        plt.close(fig)
     else:
         plt.show()
 
 def plot_reps_results(arrs_dict,
     linewidth=2, alpha_line=0.8, alpha_shade=0.4, figsize=(12,8),
     pctiles = (2.5, 97.5), window=10, fname=None):
+    import pandas as pd
+    plt = _pyplot()
 
     plt.rc('axes', titlesize=20, labelsize=20)
     plt.rc('legend', fontsize=20)
@@ -215,12 +226,82 @@ class LambdaLR():
         # ==> 1e-4 < 1 - min(1,max(0,_)) < 1
         return 1.0 - min(0.9999, max(0., epoch + self.offset - self.decay_start_epoch)/(self.n_epochs - self.decay_start_epoch))
 
-def calc_gradient_penalty(disc, real_data, generated_data, gp_lambda, cuda=False):
-    """ helper method for gradient penalty (WGAN-GP) """
+class MetricBuffer():
+    """ Preallocated on-device ring buffer of scalar metrics
+
+        `record` copies 0-dim tensors into the buffer without forcing a
+        device sync; the buffer is flushed to host lists every `size` steps
+        (or on `flush`), which is the only point where values are read back.
+        `on_flush` (optional) receives each flushed chunk as {key: array}.
+    """
+    def __init__(self, keys, size=100, device=None, dtype=torch.float, on_flush=None):
+        assert size > 0, "Buffer size must be positive!"
+        self.keys = list(keys)
+        self.size = size
+        self.buffer = torch.zeros(size, len(self.keys), device=device, dtype=dtype)
+        self.pos = 0
+        self.history = {k: [] for k in self.keys}
+        self.on_flush = on_flush
+
+    def record(self, **metrics):
+        """ store one step of metrics (tensors or floats) """
+        with torch.no_grad():
+            for j, k in enumerate(self.keys):
+                v = metrics[k]
+                if torch.is_tensor(v):
+                    v = v.detach().reshape(())
+                self.buffer[self.pos, j] = v
+        self.pos += 1
+        if self.pos == self.size:
+            self.flush()
+
+    def flush(self):
+        """ copy buffered steps to host history in a single transfer """
+        if self.pos == 0:
+            return
+        vals = self.buffer[:self.pos].cpu().numpy()
+        for j, k in enumerate(self.keys):
+            self.history[k].extend(vals[:, j].tolist())
+        if self.on_flush is not None:
+            self.on_flush({k: vals[:, j] for j, k in enumerate(self.keys)})
+        self.pos = 0
+
+    def tail(self, key, n):
+        """ last `n` recorded values of `key` (host + buffered) """
+        j = self.keys.index(key)
+        buffered = self.buffer[:self.pos, j].tolist() if self.pos else []
+        return (self.history[key][-n:] + buffered)[-n:]
+
+    def latest(self):
+        """ most recently recorded value of every key """
+        return {k: self.tail(k, 1)[-1] for k in self.keys}
+
+    def __len__(self):
+        return len(self.history[self.keys[0]]) + self.pos
+
+class RateLimiter():
+    """ True at most once every `every` seconds (and on the last step) """
+    def __init__(self, every=1.0, last_step=None):
+        self.every = every
+        self.last_step = last_step
+        self.t_last = None
+
+    def ready(self, step):
+        now = time.time()
+        if (self.t_last is None or now - self.t_last >= self.every
+            or (self.last_step is not None and step == self.last_step)):
+            self.t_last = now
+            return True
+        return False
+
+def calc_gradient_penalty(disc, real_data, generated_data, gp_lambda, cuda=False, alpha=None):
+    """ helper method for gradient penalty (WGAN-GP); `alpha` are the
+        (batch_size, 1) interpolation weights, uniform draws if None """
     batch_size = real_data.size()[0]
 
     # Calculate interpolation
-    alpha = torch.rand(batch_size, 1)
+    if alpha is None:
+        alpha = torch.rand(batch_size, 1)
     alpha = alpha.expand_as(real_data)
     if cuda:
       alpha = alpha.cuda()
@@ -260,6 +341,38 @@ def dict_product(dicts):
     """
     return (dict(zip(dicts, x)) for x in itertools.product(*dicts.values()))
 
+def flatten_dict(d, prefix=''):
+    """
+    >>> flatten_dict({'training': {'g_lr': 0.1}, 'problem': {'n': 10}})
+    {'training.g_lr': 0.1, 'problem.n': 10}
+    """
+    flat = {}
+    for k, v in d.items():
+        key = f'{prefix}{k}'
+        if isinstance(v, dict):
+            flat.update(flatten_dict(v, prefix=key + '.'))
+        else:
+            flat[key] = v
+    return flat
+
+def config_hash(config):
+    """ stable hash of a (nested) config dict """
+    s = json.dumps(config, sort_keys=True, default=str)
+    return hashlib.sha1(s.encode()).hexdigest()
+
+def unique_dirname(dirname):
+    """ create and return `dirname`, or `dirname_1`, `dirname_2`, ... if taken
+        (non-blocking replacement for `handle_overwrite` on run directories) """
+    os.makedirs(os.path.dirname(os.path.abspath(dirname)), exist_ok=True)
+    candidate, i = dirname, 0
+    while True:
+        try:
+            os.mkdir(candidate)
+            return candidate
+        except FileExistsError:
+            i += 1
+            candidate = f'{dirname}_{i}'
+
 def exponential_weight_average(prev_weights, curr_weights, beta=0.999):
     """ returns exponential moving average of prev_weights and curr_weights
         (beta=0 => no averaging) """
@@ -295,6 +408,7 @@ def draw_neural_net(ax, left, right, bottom, top, layer_sizes):
         # draw_neural_net(ax, .1, .9, .1, .9, [1, 20, 20, 1])
         # fig.savefig('nn.png')
     '''
+    plt = _pyplot()
     n_layers = len(layer_sizes)
     v_spacing = (top - bottom)/float(max(layer_sizes))
     h_spacing = (right - left)/float(len(layer_sizes) - 1)
@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+import torch
+import torch.distributed as dist
+
+from denn.config.config import get_config
+from denn.ddm import subdomains, neighbours, owner, run_ddm
+
+def test_owner_and_neighbours():
+    """ box (i, j) is rank i * py + j; its neighbours share the edges, interface
+        points go to the upper box """
+    px, py = 3, 2
+    boxes = subdomains(0, 3, 0, 2, px, py)
+    for rank, (x0, x1, y0, y1) in enumerate(boxes):
+        assert owner((x0 + x1) / 2, (y0 + y1) / 2, boxes, px, py) == rank
+        left, right, bottom, top = neighbours(rank, px, py)
+        for nb, edge in ((left, (x0, 0)), (right, (x1, 0)), (bottom, (y0, 1)), (top, (y1, 1))):
+            if nb is None:
+                assert edge[0] in ((0, 3), (0, 2))[edge[1]]
+            else:
+                assert boxes[nb][2 * edge[1] + (nb < rank)] == edge[0]
+                assert neighbours(nb, px, py)[neighbours(rank, px, py).index(nb) ^ 1] == rank
+    assert neighbours(0, px, py) == [None, 2, None, 1]
+    assert list(owner([1., 0.5, 3.], [0.5, 1., 2.], boxes, px, py)) == [2, 1, 5]
+
+@pytest.mark.skipif(not dist.is_available(), reason='torch.distributed not available')
+def test_two_subdomains():
+    """ the assembled model is each subdomain net on its own box, and training
+        drives the interface mismatch down """
+    res = run_ddm(get_config('pos'), 2, 1, threads=1, niters=100, save=False, log=False)
+    model = res['model']
+    torch.manual_seed(0)
+    for net, (x0, x1, y0, y1) in zip(model.nets, model.boxes):
+        xy = torch.rand(64, 2) * 0.98 + 0.01 # strictly inside the box
+        xy = xy * torch.tensor([[x1 - x0, y1 - y0]]) + torch.tensor([[x0, y0]])
+        assert torch.equal(model(xy), net(xy))
+    iface = np.asarray(res['losses']['iface'])
+    assert len(iface) == 100
+    assert iface[-10:].mean() < 0.1 * iface[:30].max()
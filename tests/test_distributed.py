@@ -0,0 +1,78 @@
+import socket
+import pytest
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+
+from denn.config.config import get_config
+from denn.experiments import L2_experiment, gan_experiment, get_problem
+from denn.distributed import ShardedProblem
+from denn.models import MLP
+from denn.utils import calc_gradient_penalty
+
+# train_GAN steps G before D's backward through the same graph (retain_graph),
+# which autograd rejects as an in-place modification from torch 1.5
+GAN_TRAINS = tuple(int(v) for v in torch.__version__.split('.')[:2]) < (1, 5)
+
+def _params(gan, distributed=False):
+    params = get_config('exp')
+    # 100 grid points: equal shards on 2 ranks, 34/33/33 on 3 (weighted by shard size)
+    params['training'].update(niters=10, log=False, plot=False, save=False,
+        betas=[0., 0.9], wgan=gan, gp=0.1, distributed=distributed)
+    return params
+
+def _train(gan, params):
+    experiment = gan_experiment if gan else L2_experiment
+    return experiment('exp', params, register=False)['model']
+
+def _rank(rank, world_size, init_method, gan, fname):
+    torch.set_num_threads(1)
+    dist.init_process_group('gloo', init_method=init_method, rank=rank, world_size=world_size)
+    model = _train(gan, _params(gan, distributed=True))
+    if rank == 0:
+        torch.save(model.state_dict(), fname)
+    dist.destroy_process_group()
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def test_shards_match_single_process_sample():
+    """ grid samples and GP weights of 2 ranks are the shards of the single-process
+        draws, and the RNG stays in step for the next sample """
+    params = get_config('exp')
+    problem = get_problem('exp', params)
+    torch.manual_seed(0)
+    samp = problem.get_grid_sample()
+    alpha = torch.rand(len(samp), 1) # as drawn by calc_gradient_penalty
+    samp2 = problem.get_grid_sample()
+    D = MLP(**params['discriminator']).eval() # no spectral norm power iterations
+    real, fake = torch.zeros_like(samp), samp.detach() ** 2
+    penalty = calc_gradient_penalty(D, real, fake, 0.1, alpha=alpha)
+    shard_penalties = []
+    for rank in range(2):
+        sharded = ShardedProblem(problem, rank=rank, world_size=2)
+        torch.manual_seed(0)
+        s, a, s2 = sharded.get_grid_sample(), sharded.gp_weights(), sharded.get_grid_sample()
+        assert torch.equal(s, samp[rank::2]) and torch.equal(s2, samp2[rank::2])
+        assert torch.equal(a, alpha[rank::2])
+        shard_penalties.append(calc_gradient_penalty(D, real[rank::2], fake[rank::2], 0.1, alpha=a))
+    assert torch.allclose(sum(shard_penalties) / 2, penalty)
+
+@pytest.mark.skipif(not dist.is_available(), reason='torch.distributed not available')
+@pytest.mark.parametrize('gan', [False, pytest.param(True, marks=pytest.mark.skipif(
+    not GAN_TRAINS, reason='train_GAN needs torch < 1.5'))], ids=['L2', 'GAN+GP'])
+@pytest.mark.parametrize('world_size', [2, 3])
+def test_two_ranks_match_single_process(gan, world_size, tmp_path):
+    """ data-parallel training follows the single-process run (same samples, same GP
+        weights, gradients averaged by shard size), also for unequal shards """
+    fname = str(tmp_path / 'rank0.pt')
+    mp.spawn(_rank, args=(world_size, f'tcp://127.0.0.1:{_free_port()}', gan, fname),
+        nprocs=world_size)
+    distributed = torch.load(fname)
+
+    torch.set_num_threads(1)
+    single = _train(gan, _params(gan)).state_dict()
+    for k, v in single.items():
+        assert torch.allclose(distributed[k], v, atol=1e-5), k
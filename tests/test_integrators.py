@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+from scipy.integrate import solve_ivp
+
+from denn.integrators import dopri5, bs23, symplectic
+
+def _nlo(t, y):
+    """ the nonlinear oscillator of NonlinearOscillator as a first order system """
+    x, v = y
+    return np.array([v, -(0.2 * v + x + x**2 + 0.1 * x**3)])
+
+@pytest.mark.parametrize('tol', [1e-3, 1e-6, 1e-9])
+@pytest.mark.parametrize('integrate, method', [(dopri5, 'RK45'), (bs23, 'RK23')],
+    ids=['dopri5', 'bs23'])
+def test_embedded_matches_scipy(integrate, method, tol):
+    """ same steps, cost and dense output as scipy's implementation of the pair """
+    tspan, y0 = (0, 4 * np.pi), [0., 1.]
+    res = integrate(_nlo, tspan, y0, rtol=tol, atol=tol)
+    ref = solve_ivp(_nlo, tspan, y0, method=method, rtol=tol, atol=tol, dense_output=True)
+    assert res['nfev'] == ref.nfev
+    np.testing.assert_allclose(res['t'], ref.t, rtol=1e-8)
+    t = np.linspace(*tspan, 101)
+    np.testing.assert_allclose(res['sol'](t), ref.sol(t).T, atol=1e-12)
+
+@pytest.mark.parametrize('method, order', [('leapfrog', 2), ('yoshida4', 4)])
+def test_symplectic_order(method, order):
+    """ error of q'' = -q at t=10 falls as h^order """
+    errs = []
+    for n in [50, 100, 200]:
+        res = symplectic(lambda t, p: p, lambda t, q: -q, (0, 10), [1.], [0.], n, method=method)
+        errs.append(abs(res['q'][-1, 0] - np.cos(10)))
+    rates = np.log2(np.array(errs[:-1]) / np.array(errs[1:]))
+    np.testing.assert_allclose(rates, order, atol=0.1)
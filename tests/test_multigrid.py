@@ -0,0 +1,27 @@
+import numpy as np
+import pytest
+from scipy.sparse.linalg import spsolve
+
+from denn.multigrid import Multigrid, laplacian, interpolation
+
+@pytest.mark.parametrize('n_fine, n_coarse', [(15, 7), (100, 50), (99, 48)], ids=['nested', 'even', 'odd'])
+def test_interpolation_is_exact_for_linear(n_fine, n_coarse):
+    """ u = x (zero at the left boundary) is reproduced up to the last coarse point """
+    xc = np.arange(1, n_coarse + 1) / (n_coarse + 1)
+    xf = np.arange(1, n_fine + 1) / (n_fine + 1)
+    inside = xf <= xc[-1]
+    np.testing.assert_allclose((interpolation(n_fine, n_coarse) @ xc)[inside], xf[inside])
+
+@pytest.mark.parametrize('shape', [(63, 63), (100,), (90, 70), (24, 30, 20)])
+@pytest.mark.parametrize('cycle', ['V', 'W'])
+@pytest.mark.parametrize('smoother', ['rbgs', 'jacobi'])
+def test_converges_on_any_grid(shape, cycle, smoother):
+    """ residual below tol in a bounded number of cycles, nested (2^k - 1) or not """
+    h = tuple(1 / (n + 1) for n in shape)
+    f = np.random.RandomState(0).standard_normal(shape)
+    mg = Multigrid(shape, h, cycle=cycle, smoother=smoother, coarse_size=64)
+    u, info = mg.solve(f, tol=1e-10, maxiter=40)
+    assert info['converged'] and info['residuals'][-1] <= 1e-10
+    assert info['levels'] > 1 and info['factor'] < 0.5
+    ref = spsolve(laplacian(shape, h).tocsc(), f.ravel()).reshape(shape)
+    np.testing.assert_allclose(u, ref, atol=1e-8 * np.abs(ref).max())
@@ -0,0 +1,83 @@
+import json
+import numpy as np
+import torch
+
+from denn.algos import get_state, load_state
+from denn.asha import LR_BOUND, BETA_BOUND
+from denn.config.config import get_config
+from denn.models import MLP
+from denn.pbt import exploit_explore, sample_hypers, run_pbt
+
+def _trained(seed, steps=5, lr=1e-3, gamma=0.9):
+    """ a small net, Adam and lr schedule after `steps` steps """
+    torch.manual_seed(seed)
+    net = MLP(n_hidden_units=8)
+    opt = torch.optim.Adam(net.parameters(), lr=lr, betas=(0., 0.9))
+    sched = torch.optim.lr_scheduler.ExponentialLR(opt, gamma=gamma)
+    x = torch.linspace(0, 1, 16).reshape(-1, 1)
+    for _ in range(steps):
+        opt.zero_grad()
+        torch.mean((net(x) - x)**2).backward()
+        opt.step()
+        sched.step()
+    return net, opt, sched
+
+def test_load_state_clones_and_continues_decay():
+    net, opt, _ = _trained(0)
+    state = get_state([net], [opt], 5)
+
+    clone, opt2, sched2 = _trained(1, steps=0, lr=5e-4)
+    step = load_state(state, [clone], [opt2], [sched2], [2e-3], [(0.5, 0.9)], gamma=0.9)
+    assert step == 5
+    for a, b in zip(net.parameters(), clone.parameters()):
+        assert torch.equal(a, b)
+    for p, q in zip(opt.param_groups[0]['params'], opt2.param_groups[0]['params']):
+        assert torch.equal(opt.state[p]['exp_avg'], opt2.state[q]['exp_avg'])
+    # mutated hypers applied in place, the decay continues from the saved step
+    assert np.isclose(opt2.param_groups[0]['lr'], 2e-3 * 0.9**5)
+    assert opt2.param_groups[0]['betas'] == (0.5, 0.9)
+    opt2.step()
+    sched2.step()
+    assert np.isclose(opt2.param_groups[0]['lr'], 2e-3 * 0.9**6)
+
+def test_exploit_explore():
+    rng = np.random.RandomState(0)
+    members = []
+    for i in range(4):
+        net, opt, _ = _trained(i)
+        members.append({'id': i, 'hypers': sample_hypers(rng), 'state': get_state([net], [opt], 5),
+            'parent': None, 'status': 'finished', 'score': float(i)})
+    members[-1].update(status='failed', score=np.inf, state=None)
+    top = {m['id']: m for m in members[:2]}
+    old = [dict(m) for m in members]
+
+    exploit_explore(members, rng, quantile=0.5)
+    for m, o in zip(members[:2], old[:2]): # the top is unchanged
+        assert m['state'] is o['state'] and m['hypers'] == o['hypers'] and m['parent'] is None
+    for m in members[2:]: # the bottom (incl. the failed member) copies a top member
+        src = top[m['parent']]
+        assert m['state'] is not src['state']
+        for a, b in zip(m['state']['nets'][0].values(), src['state']['nets'][0].values()):
+            assert torch.equal(a, b)
+        assert m['hypers'] != src['hypers']
+        for k, v in m['hypers'].items():
+            lo, hi = LR_BOUND if k.endswith('_lr') else BETA_BOUND
+            assert np.all((lo <= np.asarray(v)) & (np.asarray(v) <= hi))
+
+def test_exploit_explore_without_finished_members():
+    members = [{'id': i, 'hypers': {}, 'state': None, 'parent': None, 'status': 'failed',
+        'score': np.inf} for i in range(4)]
+    exploit_explore(members, np.random.RandomState(0))
+    assert all(m['parent'] is None for m in members)
+
+def test_failed_members_are_recorded(tmp_path):
+    """ a crashing member does not abort the population; it is recorded and ranks last """
+    params = get_config('exp')
+    params['training']['niters'] = 20
+    params['generator']['n_hidden_units'] = -1 # MLP construction fails in every member
+    fname = str(tmp_path / 'pbt.jsonl')
+    members = run_pbt('exp', params, fname, population=2, interval=10, workers=1, threads=1)
+    assert all(m['status'] == 'failed' and m['score'] == np.inf for m in members)
+    with open(fname) as f:
+        recs = [json.loads(line) for line in f]
+    assert len(recs) == 4 and all(r['status'] == 'failed' and 'error' in r for r in recs)
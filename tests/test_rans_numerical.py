@@ -0,0 +1,48 @@
+import os
+import numpy as np
+import pytest
+
+from denn.rans.numerical import Gf, jacobian, solve_rans_fd
+
+data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '../data')
+
+def _dense(ab):
+    """ full matrix of the banded storage ab[2 + i - j, j] """
+    n = ab.shape[1]
+    J = np.zeros((n, n))
+    for i in range(n):
+        for j in range(max(0, i - 2), min(n, i + 3)):
+            J[i, j] = ab[2 + i - j, j]
+    return J
+
+@pytest.mark.parametrize('k, nu', [(0.41, 1/180), (0.41/4, 1/550)])
+def test_jacobian_matches_finite_differences(k, nu):
+    """ banded Jacobian = central differences of Gf, which has no entries off the 5 bands """
+    y = np.linspace(-1, 1, 41)
+    u = (1 - y[1:-1]**2) * 10 + np.random.RandomState(0).uniform(-0.5, 0.5, len(y) - 2)
+    params = dict(k=k, nu=nu)
+    eps = 1e-6
+    fd = np.empty((len(u), len(u)))
+    for j in range(len(u)):
+        e = np.zeros_like(u)
+        e[j] = eps
+        fd[:, j] = (Gf(u + e, y, **params) - Gf(u - e, y, **params)) / (2 * eps)
+    J = _dense(jacobian(u, y, **params))
+    np.testing.assert_allclose(J, fd, rtol=1e-6, atol=1e-6 * np.abs(fd).max())
+    assert np.all(np.abs(np.subtract.outer(np.arange(len(u)), np.arange(len(u))))[fd != 0] <= 2)
+
+@pytest.mark.parametrize('retau, k, suffix', [(180, 0.41, ''), (550, 0.41, ''), (1000, 0.41, ''),
+    (180, 0.41/2, '_halfk'), (550, 0.41/2, '_halfk'), (1000, 0.41/2, '_halfk')])
+def test_newton_reproduces_data_files(retau, k, suffix):
+    """ converged residual, and the profiles of data/mixlen_numerical_u*.npy """
+    y, u = solve_rans_fd(n=1000, retau=retau, k=k)
+    assert u[0] == u[-1] == 0
+    assert np.linalg.norm(Gf(u[1:-1], y, k=k, nu=1/retau)) < 1e-6
+    ref = np.load(os.path.join(data_dir, f'mixlen_numerical_u{retau}{suffix}.npy'))
+    np.testing.assert_allclose(u, ref, rtol=1e-8, atol=1e-8)
+
+def test_newton_converges_quadratically():
+    """ halving h on nested grids divides the change in u by about 4 """
+    us = [solve_rans_fd(n=n, retau=180)[1] for n in (501, 1001, 2001, 4001)]
+    diffs = [np.abs(a - b[::2]).max() for a, b in zip(us, us[1:])]
+    assert all(3.5 < d0 / d1 < 4.5 for d0, d1 in zip(diffs, diffs[1:]))
@@ -0,0 +1,28 @@
+import numpy as np
+
+from denn.runstore import RunStore, load_run
+
+def test_resumed_history_round_trip(tmp_path):
+    d = str(tmp_path / 'run')
+    store = RunStore(d)
+    store.append('history', {'val': [0, 1, 2]})
+    store.close()
+
+    store = RunStore(d, resume=True)
+    store.append('history', {'val': [3, 4]})
+    # open run: the compacted history comes before the new segments
+    np.testing.assert_array_equal(load_run(d, ['history.val'])['history.val'], [0, 1, 2, 3, 4])
+    store.append('history', {'val': [5]})
+    store.close()
+    np.testing.assert_array_equal(load_run(d, ['history.val'])['history.val'], np.arange(6))
+
+def test_new_run_drops_old_history(tmp_path):
+    d = str(tmp_path / 'run')
+    store = RunStore(d)
+    store.append('history', {'val': [0, 1, 2]})
+    store.close()
+
+    store = RunStore(d)
+    store.append('history', {'val': [3, 4]})
+    store.close()
+    np.testing.assert_array_equal(load_run(d, ['history.val'])['history.val'], [3, 4])
@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+from scipy.integrate import solve_ivp
+
+from denn.spectral import exp_reference, sho_reference, nlo_reference, rans_channel_reference
+from denn.rans.numerical import rans_reference, reference_sol
+
+@pytest.mark.parametrize('L, x0', [(1, 1.), (0.5, -2.)])
+def test_exp_matches_analytic(L, x0):
+    t = np.linspace(0, 10, 1001)
+    sol = exp_reference(0, 10, x0, L=L)
+    np.testing.assert_allclose(sol(t), x0 * np.exp(-L * t), rtol=1e-12, atol=1e-14)
+
+@pytest.mark.parametrize('x0, dx_dt0', [(0., 1.), (1., -0.5)])
+def test_sho_matches_analytic(x0, dx_dt0):
+    t = np.linspace(0, 4 * np.pi, 1001)
+    sol = sho_reference(0, 4 * np.pi, x0, dx_dt0)
+    np.testing.assert_allclose(sol(t), x0 * np.cos(t) + dx_dt0 * np.sin(t), atol=1e-13)
+
+def test_nlo_matches_tight_ivp():
+    beta, phi, epsilon = .1, 1, .1
+    f = lambda t, z: [z[1], -(2 * beta * z[1] + z[0] + phi * z[0]**2 + epsilon * z[0]**3)]
+    t = np.linspace(0, 4 * np.pi, 1001)
+    ref = solve_ivp(f, (0, 4 * np.pi), [0., 1.], method='DOP853', rtol=1e-13, atol=1e-13,
+        dense_output=True)
+    sol = nlo_reference(0, 4 * np.pi, 0., 1., beta=beta, phi=phi, epsilon=epsilon)
+    np.testing.assert_allclose(sol(t), ref.sol(t)[0], atol=1e-11)
+
+def test_rans_channel_matches_bvp():
+    """ u vanishes at the walls, is even about the centre and agrees with solve_bvp """
+    y = np.linspace(-1, 1, 2001)
+    u = rans_channel_reference()(y)
+    assert abs(u[0]) < 1e-12 and abs(u[-1]) < 1e-12
+    np.testing.assert_allclose(u, u[::-1], atol=1e-12)
+    ref = reference_sol(rans_reference(180, k=0.41/4, tol=1e-6, n=1000, cache_dir=None))
+    np.testing.assert_allclose(u, ref(y)[0], atol=1e-6)